@@ -0,0 +1,367 @@
+"""
+done/ アーカイブの索引（SQLite）
+done/YYYYMMDD/（答案PDF・抽出テキスト）と done/YYYYMMDD_output/（採点済みPDF）の
+ファイルを1行ずつ記録し、日付・マスターID・生徒番号で検索できるようにする。
+画面を更新するたびに全フォルダをglobし直さなくて済む。
+
+- ファイルを done/ に移すときに move_into() で記録する
+- 手作業でフォルダを触った場合に備え、refresh() はフォルダの更新時刻が変わったものだけ走査し直す
+- 復元（inputs/ への書き戻し）は、PDFは同じファイルシステムならハードリンク（容量を増やさない）、
+  できなければコピー。テキストは画面で編集されるので必ずコピーする（アーカイブを書き換えないため）
+
+索引は done/archive_index.db に置く（アーカイブと一緒に移動・バックアップできるように）。
+
+使い方:
+    python archive_index.py rebuild
+    python archive_index.py find --student 55615210
+    python archive_index.py find --date 20260301 --master 2025_1_1
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+INDEX_NAME = "archive_index.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive_files (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    folder      TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    base        TEXT NOT NULL,
+    size        INTEGER,
+    master_id   TEXT,
+    student_id  TEXT,
+    archived_at TEXT NOT NULL,
+    sha256      TEXT,
+    UNIQUE(folder, name)
+);
+CREATE INDEX IF NOT EXISTS idx_archive_date    ON archive_files(date, kind);
+CREATE INDEX IF NOT EXISTS idx_archive_master  ON archive_files(master_id, date);
+CREATE INDEX IF NOT EXISTS idx_archive_student ON archive_files(student_id, date);
+CREATE INDEX IF NOT EXISTS idx_archive_base    ON archive_files(base);
+CREATE INDEX IF NOT EXISTS idx_archive_sha256  ON archive_files(sha256);
+CREATE TABLE IF NOT EXISTS archive_folders (
+    folder   TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+_COLUMNS = ["id", "folder", "date", "kind", "name", "base", "size", "master_id", "student_id", "archived_at",
+            "sha256"]
+
+# 既存の索引に後から足した列（古い索引ファイルを開いたときに追加する）
+_MIGRATIONS = [
+    ("sha256", "ALTER TABLE archive_files ADD COLUMN sha256 TEXT"),
+]
+
+
+def _is_archive_folder(name):
+    """YYYYMMDD または YYYYMMDD_output"""
+    date = name[:8]
+    return len(date) == 8 and date.isdigit() and name[8:] in ("", "_output")
+
+
+def _classify(folder, name):
+    """(種類, ベース名) を返す。対象外のファイルは None"""
+    low = name.lower()
+    if low.endswith("_draft.txt"):
+        return "text", name[:-len("_draft.txt")]
+    if low.endswith(".pdf"):
+        return ("output" if folder.endswith("_output") else "input"), os.path.splitext(name)[0]
+    return None
+
+
+def _read_ids(path):
+    """抽出テキストの1行目（マスターID）・2行目（生徒番号）"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [f.readline().strip(), f.readline().strip()]
+    except OSError:
+        return None, None
+    master = lines[0] if lines[0] and lines[0] != "UNKNOWN" and not lines[0].startswith("ERROR") else None
+    return master, lines[1] or None
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """同じファイルシステムならハードリンク、無理ならコピー。戻り値は "link" / "copy" """
+    if os.path.exists(dst):
+        os.remove(dst)  # 既存ファイルを上書き（同じ実体へのリンクでも張り直す）
+    try:
+        os.link(src, dst)
+        return "link"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+class ArchiveIndex:
+    def __init__(self, done_dir, path=None):
+        self.done_dir = done_dir
+        self.path = path or os.path.join(done_dir, INDEX_NAME)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._conn.executescript(_SCHEMA)
+
+    def _migrate(self):
+        cols = {r["name"] for r in self._conn.execute("PRAGMA table_info(archive_files)").fetchall()}
+        if not cols:
+            return  # 新規作成
+        with self._conn:
+            for col, sql in _MIGRATIONS:
+                if col not in cols:
+                    self._conn.execute(sql)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # ── 書き込み ──
+
+    def add(self, folder, name, sha256=None):
+        """
+        done/<folder>/<name> を索引に登録（既にあれば更新）する。
+        sha256=True なら答案PDFのハッシュをその場で計算する（重複取り込みの判定用）
+        """
+        kind_base = _classify(folder, name)
+        if not kind_base:
+            return
+        kind, base = kind_base
+        path = os.path.join(self.done_dir, folder, name)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock, self._conn:
+            if kind == "text":
+                master_id, student_id = _read_ids(path)
+                # 同じ答案のPDF（同じフォルダ・出力フォルダ）にも反映する
+                self._conn.execute(
+                    "UPDATE archive_files SET master_id = ?, student_id = ? WHERE base = ? AND folder IN (?, ?)",
+                    (master_id, student_id, base, folder, folder + "_output"))
+            else:
+                row = self._conn.execute(
+                    "SELECT master_id, student_id FROM archive_files WHERE base = ? AND kind = 'text' "
+                    "ORDER BY folder DESC LIMIT 1", (base,)).fetchone()
+                master_id, student_id = (row["master_id"], row["student_id"]) if row else (None, None)
+            if sha256 is True:
+                sha256 = sha256_file(path) if kind == "input" else None
+            self._conn.execute(
+                "INSERT INTO archive_files (folder, date, kind, name, base, size, master_id, student_id, archived_at,"
+                " sha256) VALUES (?,?,?,?,?,?,?,?,?,?) ON CONFLICT(folder, name) DO UPDATE SET"
+                " size = excluded.size, master_id = excluded.master_id, student_id = excluded.student_id,"
+                " archived_at = excluded.archived_at,"
+                " sha256 = CASE WHEN archive_files.size = excluded.size"
+                " THEN COALESCE(excluded.sha256, archive_files.sha256) ELSE excluded.sha256 END",
+                (folder, folder[:8], kind, name, base, size, master_id, student_id,
+                 datetime.now().isoformat(timespec="seconds"), sha256))
+            self._touch_folder(folder)
+
+    def _touch_folder(self, folder):
+        try:
+            mtime = os.stat(os.path.join(self.done_dir, folder)).st_mtime_ns
+        except OSError:
+            return
+        self._conn.execute("INSERT INTO archive_folders (folder, mtime_ns) VALUES (?, ?) "
+                           "ON CONFLICT(folder) DO UPDATE SET mtime_ns = excluded.mtime_ns", (folder, mtime))
+
+    def move_into(self, src, folder):
+        """src を done/<folder>/ に移動して索引に登録し、移動先のパスを返す"""
+        dst_dir = os.path.join(self.done_dir, folder)
+        os.makedirs(dst_dir, exist_ok=True)
+        dst = os.path.join(dst_dir, os.path.basename(src))
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            os.remove(src)  # 復元時のハードリンク同士（rename では消えない）
+        else:
+            shutil.move(src, dst)
+        self.add(folder, os.path.basename(src), sha256=True)
+        return dst
+
+    def scan_folder(self, folder):
+        """フォルダを走査し直して索引と一致させる（消えたファイルの行も削除する）"""
+        full = os.path.join(self.done_dir, folder)
+        try:
+            names = os.listdir(full)
+        except OSError:
+            names = []
+        with self._lock:
+            with self._conn:
+                if names:
+                    self._conn.execute(
+                        f"DELETE FROM archive_files WHERE folder = ? AND name NOT IN ({','.join('?' * len(names))})",
+                        [folder] + names)
+                else:
+                    self._conn.execute("DELETE FROM archive_files WHERE folder = ?", (folder,))
+            # テキストを先に登録し、PDFにマスターID・生徒番号を引き継ぐ
+            for name in sorted(names, key=lambda n: not n.endswith("_draft.txt")):
+                self.add(folder, name)
+            with self._conn:
+                if names:
+                    self._touch_folder(folder)
+                else:
+                    self._conn.execute("DELETE FROM archive_folders WHERE folder = ?", (folder,))
+
+    def refresh(self):
+        """更新時刻が変わったフォルダだけ走査し直す。走査したフォルダ数を返す"""
+        try:
+            entries = [e for e in os.scandir(self.done_dir) if e.is_dir() and _is_archive_folder(e.name)]
+        except OSError:
+            entries = []
+        with self._lock:
+            known = {r["folder"]: r["mtime_ns"] for r in
+                     self._conn.execute("SELECT folder, mtime_ns FROM archive_folders").fetchall()}
+        current = {e.name for e in entries}
+        stale = [e.name for e in entries if known.get(e.name) != e.stat().st_mtime_ns]
+        stale += [f for f in known if f not in current]  # 削除されたフォルダ
+        for folder in stale:
+            self.scan_folder(folder)
+        return len(stale)
+
+    def rebuild(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM archive_files")
+            self._conn.execute("DELETE FROM archive_folders")
+        return self.refresh()
+
+    def backfill_hashes(self):
+        """ハッシュ未計算の答案PDF（走査で登録した分・古い索引の分）のハッシュを計算する"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, folder, name FROM archive_files WHERE kind = 'input' AND sha256 IS NULL").fetchall()
+        for r in rows:
+            try:
+                sha = sha256_file(os.path.join(self.done_dir, r["folder"], r["name"]))
+            except OSError:
+                continue
+            with self._lock, self._conn:
+                self._conn.execute("UPDATE archive_files SET sha256 = ? WHERE id = ?", (sha, r["id"]))
+        return len(rows)
+
+    # ── 読み出し ──
+
+    def find_by_hash(self, sha256):
+        """同じ内容の答案PDFの行（なければ None）"""
+        with self._lock:
+            r = self._conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM archive_files "
+                                   "WHERE sha256 = ? AND kind = 'input' LIMIT 1", (sha256,)).fetchone()
+        return dict(r) if r else None
+
+    def dates(self):
+        """答案PDFのある日付フォルダ: [{"key", "label", "count"}]（新しい順）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT date, COUNT(*) AS n FROM archive_files WHERE kind = 'input' AND folder = date "
+                "GROUP BY date ORDER BY date DESC").fetchall()
+        return [{"key": r["date"], "label": f"{r['date'][:4]}/{r['date'][4:6]}/{r['date'][6:]}", "count": r["n"]}
+                for r in rows]
+
+    def find(self, date=None, master_id=None, student_id=None, kind=None, since=None, until=None):
+        """条件に合うファイル（dict）のリスト。date/since/until は YYYYMMDD"""
+        where, params = [], []
+        for col, val in (("date", date), ("master_id", master_id), ("student_id", student_id), ("kind", kind)):
+            if val:
+                where.append(f"{col} = ?")
+                params.append(val)
+        if since:
+            where.append("date >= ?")
+            params.append(since)
+        if until:
+            where.append("date <= ?")
+            params.append(until)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM archive_files"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY date DESC, name"
+        with self._lock:
+            rows = [dict(r) for r in self._conn.execute(sql, params).fetchall()]
+        for row in rows:
+            row["path"] = os.path.join(self.done_dir, row["folder"], row["name"])
+        return rows
+
+    # ── 復元 ──
+
+    def restore(self, rows, input_dir, text_dir):
+        """
+        rows（find() の結果）の答案PDFと抽出テキストを inputs/・step1_texts/ に戻す。
+        (PDF件数, テキスト件数, ハードリンクできた件数) を返す
+        """
+        os.makedirs(input_dir, exist_ok=True)
+        os.makedirs(text_dir, exist_ok=True)
+        pdf_count = txt_count = linked = 0
+        for row in rows:
+            if not os.path.exists(row["path"]):
+                continue
+            if row["kind"] == "input":
+                if link_or_copy(row["path"], os.path.join(input_dir, row["name"])) == "link":
+                    linked += 1
+                pdf_count += 1
+            elif row["kind"] == "text":
+                shutil.copy2(row["path"], os.path.join(text_dir, row["name"]))
+                txt_count += 1
+        return pdf_count, txt_count, linked
+
+
+def _config():
+    cfg = {"done_dir": "./done"}
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    except Exception:
+        pass
+    return cfg
+
+
+def main():
+    parser = argparse.ArgumentParser(description="done/ アーカイブの索引")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("rebuild", help="done/ を全件走査して索引を作り直す")
+    p_find = sub.add_parser("find", help="アーカイブを検索する")
+    p_find.add_argument("--date", default=None)
+    p_find.add_argument("--master", default=None)
+    p_find.add_argument("--student", default=None)
+    p_find.add_argument("--kind", choices=["input", "text", "output"], default=None)
+    args = parser.parse_args()
+
+    with ArchiveIndex(_config()["done_dir"]) as index:
+        if args.cmd == "rebuild":
+            n = index.rebuild()
+            print(f"✅ {n}フォルダを走査しました（{len(index.find())}件）")
+        else:
+            index.refresh()
+            rows = index.find(date=args.date, master_id=args.master, student_id=args.student, kind=args.kind)
+            for r in rows:
+                print(f"{r['date']}  {r['kind']:<6} {r['name']:<40} {r['master_id'] or '-':<12} {r['student_id'] or '-'}")
+            print(f"--- {len(rows)}件")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
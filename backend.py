@@ -1,15 +1,29 @@
-import webview
+try:
+    import webview
+except ImportError:  # server.py（ヘッドレス）ではデスクトップ画面なしで動かせる
+    webview = None
 import sys
 import os
 import glob
-import zipfile
 import subprocess
 import json
 import base64
-import shutil
+import tempfile
+import threading
 from pathlib import Path
 from datetime import datetime
-import fitz
+from page_cache import PageRenderCache
+from page_server import PageServer
+from step_worker import WorkerClient
+from job_scheduler import JobScheduler, Unit, LANES, PRIORITY_NORMAL, PRIORITY_HIGH
+import results_store
+import json_cache
+from watch_mode import FolderWatcher, review_reasons
+from archive_index import ArchiveIndex
+from ingest import Ingestor, summarize
+import progress
+import metrics
+import profiling
 
 _CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
 _DEFAULT_CONFIG = {
@@ -20,6 +34,10 @@ _DEFAULT_CONFIG = {
     "output_dir":      "./step3_final",
     "done_dir":        "./done",
     "step23_script":   "step23_combined.py",
+    "results_db":      "./results.db",
+    "page_cache_mb":   256,
+    "warm_worker":     True,
+    "watch_settle_seconds": 2.0,
 }
 
 def load_config() -> dict:
@@ -38,6 +56,9 @@ def load_config() -> dict:
 
 CFG = load_config()
 
+# Stepスクリプト（常駐ワーカー・子プロセスとも）に進捗をJSONイベントで出させる
+os.environ[progress.ENV_FLAG] = "1"
+
 PDFXCHANGE_CANDIDATES = [
     CFG.get("pdfxchange_path", ""),
     r"C:\Program Files\Tracker Software\PDF Editor\PDFXEdit.exe",
@@ -52,43 +73,142 @@ def find_pdfxchange():
             return path
     return None
 
+def _is_pdf_name(name) -> bool:
+    """フォルダ直下のPDFのファイル名か（"../x.pdf" のようにパスを含む名前は受け付けない）"""
+    return (isinstance(name, str) and name.lower().endswith(".pdf")
+            and os.path.basename(name) == name and "\\" not in name)
+
 class Api:
-    def __init__(self):
+    def __init__(self, page_host="127.0.0.1", page_port=0, page_public_host=None):
         self._window = None
-        self._current_proc = None
-        self._cancelled = False
+        self._listeners = []  # _send_ui_batch を受け取る関数（server.py のイベント配信など）
+        # ログと進捗イベントはまとめて、最大10回/秒でフロントエンドに送る
+        self._ui = progress.UiBatcher(self._send_ui_batch, rate=10)
+        # Stepは常駐ワーカーで実行する（import・APIクライアント・マスター読み込みを使い回す）
+        # step1 と step23 のレーンが同時に動けるよう、レーンごとに1つずつ持つ
+        self._workers = {lane: WorkerClient() for lane in LANES}
+        self._scheduler = JobScheduler(self._run_unit)
+        self._job_metrics = {}  # ジョブID -> Stepスクリプトから届いた metrics イベント
+        self._archive_index = None
+        self._archive_lock = threading.Lock()
+        # 監視フォルダモード
+        self._watcher = None
+        self._watch_run_id = None
+        self._watch_review = {}  # PDF名 -> 確認が必要な理由
+        self._page_cache = PageRenderCache(max_bytes=int(CFG["page_cache_mb"]) * 1024 * 1024)
+        # ページ画像はローカルHTTPで配信する（起動できなければ従来のdata URLにフォールバック）
+        try:
+            self._page_server = PageServer(
+                self._page_cache,
+                lambda: [CFG["input_dir"], CFG["output_dir"], CFG["done_dir"]],
+                host=page_host, port=page_port, public_host=page_public_host,
+            )
+            self._page_server.start()
+        except OSError as e:
+            print(f"⚠️ ページ画像サーバーを起動できませんでした: {e}")
+            self._page_server = None
 
     def set_window(self, window):
         self._window = window
 
+    def add_listener(self, fn):
+        """ログ・進捗イベントのまとまり（batch）を受け取る関数を登録する"""
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def _send_ui_batch(self, batch):
+        for fn in list(self._listeners):
+            try:
+                fn(batch)
+            except Exception:
+                pass
+        if self._window:
+            self._window.evaluate_js(f'window.updateEvents({json.dumps(batch, ensure_ascii=False)})')
+
     def _log(self, msg: str):
         skip_patterns = ["./inputs", "./step1_texts", "./step3_final", "./done", "./masters", "./rubric_txts", "\\inputs", "\\step1_texts"]
         for pat in skip_patterns:
             if pat in msg:
                 return
         
-        # \r を含む行はプログレスバー → 専用関数で最後の行を上書き
+        # \r を含む行はプログレスバー → 最後の行を上書きする進捗イベントとして送る
         if '\r' in msg:
             clean = msg.replace('\r', '').strip()
             if clean:
                 print(f"Progress: {clean}")
-                try:
-                    self._window.evaluate_js(f'window.updateProgress({json.dumps(clean)})')
-                except Exception:
-                    pass
+                self._ui.event({"event": "progress", "text": clean})
         else:
             print(f"Log: {msg}")
-            try:
-                self._window.evaluate_js(f'window.updateLog({json.dumps(msg)})')
-            except Exception:
-                pass
+            self._ui.log(msg)
+
+    def _on_event(self, ev):
+        if ev.get("event") == "file":
+            print(f"Progress: [{ev.get('stage')}] {ev.get('index')}/{ev.get('total')} "
+                  f"{ev.get('status')} {ev.get('file')}")
+        self._ui.event(ev)
     
-    def _run_realtime(self, script_path: str, label: str) -> bool:
+    def _run_realtime(self, script_path: str, label: str, args=None, unit=None) -> bool:
+        """
+        スクリプトを1回実行する。unit（job_scheduler.Unit）が渡されたら実行中のプロセスを
+        unit.proc に登録し、キャンセルされたかを unit.cancelled で判定する。
+        """
+        unit = unit or Unit(None)
+        on_output = lambda line: self._on_output(line, unit.job)
+        try:
+            if CFG.get("warm_worker", True):
+                worker = self._workers[unit.job.lane if unit.job else "step23"]
+                try:
+                    return self._run_in_worker(worker, script_path, label, args, unit, on_output)
+                except OSError as e:
+                    # ワーカーにジョブを渡せなかった場合は従来どおり毎回起動する
+                    worker.kill()
+                    self._log(f"⚠️ 常駐ワーカーを使えないため通常起動します: {e}")
+            return self._run_subprocess(script_path, label, args, unit, on_output)
+        finally:
+            self._ui.flush()  # 呼び出し元に戻る前に最後の進捗を画面に出す
+
+    def _on_output(self, line, job=None):
+        line = line.rstrip("\n").rstrip("\r")
+        ev = progress.parse(line)
+        if ev is not None and ev.get("event") == "metrics":
+            # 計測結果は画面に送らず、ジョブの終了時にまとめてレポートにする
+            if job:
+                self._job_metrics.setdefault(job.id, []).append(ev)
+            return
+        if ev is not None:
+            if job:
+                ev = job.note_event(ev)
+            if ev is not None:
+                self._on_event(ev)
+        elif line.strip():
+            self._log(line.strip())
+
+    def _run_in_worker(self, worker, script_path, label, args, unit, on_output) -> bool:
+        """常駐ワーカー（step_worker.py）の中でスクリプトを実行する"""
+        unit.proc = worker
+        try:
+            returncode, stderr = worker.run(script_path, args, on_output)
+        finally:
+            unit.proc = None
+        if unit.cancelled:
+            worker.kill()
+            return False
+        if returncode is None:
+            self._log(f"❌ {label} 失敗: ワーカーが異常終了しました")
+            return False
+        if returncode != 0:
+            if stderr:
+                self._log(f"❌ {label} 失敗: {stderr[-300:]}")
+            return False
+        return True
+
+    def _run_subprocess(self, script_path, label, args, unit, on_output) -> bool:
         try:
-            self._log(f"▶ {label} 開始...")
-            self._cancelled = False
             proc = subprocess.Popen(
-                [sys.executable, "-u", script_path],
+                [sys.executable, "-u", script_path] + list(args or []),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True,
@@ -96,38 +216,87 @@ class Api:
                 errors="replace",
                 bufsize=1,
             )
-            self._current_proc = proc
+            unit.proc = proc
             for line in iter(proc.stdout.readline, ""):
-                if self._cancelled:
+                if unit.cancelled:
                     break
-                line = line.rstrip("\n").rstrip("\r")
-                if line.strip():
-                    self._log(line.strip())
+                on_output(line)
             proc.stdout.close()
-            if self._cancelled:
+            if unit.cancelled:
                 try:
                     proc.terminate()
                     proc.wait(timeout=5)
                 except Exception:
                     proc.kill()
-                self._current_proc = None
-                self._log(f"⛔ {label} をキャンセルしました")
+                unit.proc = None
                 return False
             proc.wait()
-            self._current_proc = None
+            unit.proc = None
             if proc.returncode != 0:
                 stderr = proc.stderr.read()
                 if stderr:
                     self._log(f"❌ {label} 失敗: {stderr[:300]}")
                 return False
-            self._log(f"✅ {label} 完了")
             return True
         except Exception as e:
-            self._current_proc = None
+            unit.proc = None
             self._log(f"❌ {e}")
-        return False            
-        
-        
+        return False
+
+    def _run_unit(self, job, unit, args):
+        """JobScheduler から呼ばれる実行関数"""
+        ok = self._run_realtime(job.script, job.label, args, unit)
+        if unit.file and not unit.cancelled and job.file_status.get(unit.file) == "running":
+            # 採点されないまま終わった（file イベントが来なかった）ファイルはエラーとして画面に出す
+            for ev in job.missing_events(unit.file):
+                self._on_event(ev)
+        return ok
+
+    def _submit(self, kind, script, label, files=None, args=None, priority=PRIORITY_NORMAL, lane=None,
+                on_finish=None):
+        self._log(f"▶ {label} 開始..." if files is None else f"▶ {label} を受け付けました（{len(files)}件）")
+
+        def finish(job):
+            ev = job.stage_end_event()
+            if ev is not None:
+                self._on_event(ev)
+            if job.status == "cancelled":
+                self._log(f"⛔ {label} をキャンセルしました（処理済み {len(job.done_files())}件は保持）")
+            elif job.ok:
+                self._log(f"✅ {label} 完了")
+            self._write_job_report(job)
+            if on_finish:
+                on_finish(job)
+            self._ui.flush()
+        return self._scheduler.submit(kind, script, label, files=files, args=args,
+                                      priority=priority, lane=lane, on_finish=finish)
+
+    def _write_job_report(self, job):
+        """ジョブ内の各実行の計測結果をまとめて reports/ に書き出す"""
+        events = self._job_metrics.pop(job.id, [])
+        if not events:
+            return None
+        snap = metrics.merge([ev.get("snapshot", {}) for ev in events])
+        started = job.started or job.created
+        seconds = (job.finished or started) - started
+        sheets = sum(ev.get("sheets") or 0 for ev in events)
+        run = f"{datetime.fromtimestamp(started):%Y%m%d_%H%M%S}_{job.id}"
+        try:
+            path = metrics.write_report(run, job.kind, snap, sheets, seconds, label=job.label,
+                                        errors=sum(ev.get("errors") or 0 for ev in events))
+        except OSError as e:
+            self._log(f"⚠️ 実行レポートを書き出せませんでした: {e}")
+            return None
+        report = metrics.build_report(run, job.kind, snap, sheets, seconds)
+        speed = f"（{report['sheets_per_min']:.1f}枚/分）" if report["sheets_per_min"] else ""
+        cost = f" 推定コスト ${report['cost_usd']:.3f}" if report["tokens"] else ""
+        self._log(f"📊 {job.label}: {sheets}枚 {seconds / 60:.1f}分{speed}{cost}")
+        return path
+
+    def get_run_reports(self, limit=20):
+        """実行レポート（工程別の所要時間・トークン・コスト・処理速度）を新しい順に返す"""
+        return metrics.list_reports(int(limit))
+
     def run_coordinate_picker(self):
         base = os.path.dirname(os.path.abspath(__file__))
         path = os.path.join(base, "coordinate_picker.py")
@@ -165,9 +334,33 @@ class Api:
             self._log(f"❌ 設定保存エラー: {e}")
             return False
 
+    def get_profiling(self):
+        """有効なプロファイリングのモード（環境変数 GRADING_PROFILE が優先）"""
+        return sorted(profiling.modes())
+
+    def set_profiling(self, mode: str = ""):
+        """
+        Stepスクリプトのプロファイリングを切り替える（"cprofile" / "sample" / "memory" のカンマ区切り、空でオフ）。
+        次に実行するStepから有効になり、結果は profiles/ とログに出る。
+        """
+        modes = profiling.parse_modes(mode)
+        CFG["profile"] = ",".join(sorted(modes))
+        try:
+            with open(_CONFIG_PATH, "w", encoding="utf-8") as f:
+                json.dump(CFG, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            self._log(f"❌ 設定保存エラー: {e}")
+            return False
+        if os.environ.get(profiling.ENV_FLAG) is not None:
+            self._log(f"⚠️ 環境変数 {profiling.ENV_FLAG} が設定されているため、そちらが優先されます")
+        self._log(f"🔬 プロファイリング: {CFG['profile'] or 'オフ'}")
+        return True
+
     # ── ファイルダイアログ ──────────────────────────────
     
     def open_file_dialog(self):
+        if webview is None or self._window is None:
+            return None
         try:
             result = self._window.create_file_dialog(
                 webview.OPEN_DIALOG,
@@ -182,20 +375,59 @@ class Api:
             return None
 
 
+    def _ingestor(self):
+        """inputs/ と done/ アーカイブの両方を見て重複を判定する取り込み器"""
+        index = None
+        if os.path.isdir(CFG["done_dir"]):
+            index = self._archive()
+            index.refresh()
+            index.backfill_hashes()
+        return Ingestor(CFG["input_dir"], index)
+
+    def _log_ingest(self, results, label):
+        for r in results:
+            if r.status == "duplicate":
+                self._log(f"⏭️ {os.path.basename(r.source)} は {r.duplicate_of} と同じ内容のためスキップしました")
+            elif r.renamed:
+                self._log(f"📄 {os.path.basename(r.source)} → {r.name}（同名ファイルがあるため改名）")
+        added, dups, _ = summarize(results)
+        self._log(f"{label}: {added}件" + (f"（重複 {dups}件をスキップ）" if dups else ""))
+        return added
+
     def copy_pdf(self, pdf_path):
         if not pdf_path or not os.path.exists(pdf_path):
             return False
-        os.makedirs(CFG["input_dir"], exist_ok=True)
         try:
-            dst = os.path.join(CFG["input_dir"], os.path.basename(pdf_path))
-            shutil.copy2(pdf_path, dst)
-            self._log(f"📄 PDF取り込み完了: {os.path.basename(pdf_path)}")
-            return True
+            result = self._ingestor().ingest_file(pdf_path)
         except Exception as e:
             self._log(f"❌ PDFコピーエラー: {e}")
             return False
+        self._log_ingest([result], f"📄 PDF取り込み完了 ({os.path.basename(pdf_path)})")
+        return True
     
     
+    def split_batch(self, pdf_path, mode="auto", pages=None, master_id=None):
+        """
+        クラス全員分の一括スキャンPDFを生徒ごとのPDFに分けて inputs/ に取り込む（batch_splitter.py）。
+        取り込んだ件数を返す（失敗時は -1）。
+        """
+        if not pdf_path or not os.path.exists(pdf_path):
+            return -1
+        import batch_splitter
+        try:
+            with tempfile.TemporaryDirectory(prefix="split_") as tmp:
+                result = batch_splitter.split_pdf(pdf_path, tmp, mode, int(pages) if pages else None, master_id or None)
+                ingestor = self._ingestor()
+                results = [ingestor.ingest_file(p) for p in result["paths"]]
+        except Exception as e:
+            self._log(f"❌ 分割エラー: {e}")
+            return -1
+        self._log(f"✂️ {os.path.basename(pdf_path)} を {len(result['ranges'])}人分に分割しました（{result['mode']}）")
+        for w in result["warnings"]:
+            self._log(f"⚠️ {w}")
+        self._log_ingest(results, "📄 分割したPDFの取り込み完了")
+        return summarize(results)[0]
+
     def open_output_dir(self):
         try:
             output_dir = os.path.abspath(CFG["output_dir"])
@@ -243,68 +475,154 @@ class Api:
             pairs.append({"pdf": pdf, "txt": txt, "filename": os.path.basename(pdf)})
         return pairs
 
+    def _archive(self):
+        """done/ の索引（done_dir が設定で変わったら開き直す）"""
+        with self._archive_lock:
+            if self._archive_index is None or self._archive_index.done_dir != CFG["done_dir"]:
+                if self._archive_index:
+                    self._archive_index.close()
+                self._archive_index = ArchiveIndex(CFG["done_dir"])
+            return self._archive_index
+
     def get_done_dates(self):
-        done_dir = CFG["done_dir"]
-        if not os.path.isdir(done_dir):
+        if not os.path.isdir(CFG["done_dir"]):
             return []
-        dates = []
-        for entry in sorted(os.listdir(done_dir), reverse=True):
-            full_path = os.path.join(done_dir, entry)
-            if os.path.isdir(full_path) and len(entry) == 8 and entry.isdigit():
-                pdfs = glob.glob(os.path.join(full_path, "*.pdf"))
-                if pdfs:
-                    formatted = f"{entry[:4]}/{entry[4:6]}/{entry[6:]}"
-                    dates.append({"key": entry, "label": formatted, "count": len(pdfs)})
-        return dates
+        index = self._archive()
+        index.refresh()  # 更新時刻が変わったフォルダだけ走査し直す
+        return index.dates()
+
+    def search_archive(self, date: str = "", master_id: str = "", student_id: str = ""):
+        """アーカイブを日付（YYYYMMDD）・マスターID・生徒番号で検索する"""
+        if not os.path.isdir(CFG["done_dir"]):
+            return []
+        index = self._archive()
+        index.refresh()
+        return index.find(date=date or None, master_id=master_id or None, student_id=student_id or None)
+
+    def _restore(self, rows, label):
+        pdfs, txts, linked = self._archive().restore(rows, CFG["input_dir"], CFG["text_dir"])
+        note = f"（ハードリンク {linked}件）" if linked else ""
+        self._log(f"♻️ {label} から復元: PDF {pdfs}件, テキスト {txts}件{note}")
+        return pdfs > 0
 
     def restore_from_done(self, date_str: str):
         """
-        done/YYYYMMDD/ のPDFとtxtをinputs/とstep1_texts/にコピーして
+        done/YYYYMMDD/ のPDFとtxtをinputs/とstep1_texts/に戻して
         通常フローと同じ状態にする。既存ファイルは上書き。
+        PDFはハードリンク（できなければコピー）、txtは編集されるのでコピー。
         """
         folder = os.path.join(CFG["done_dir"], date_str)
         if not os.path.isdir(folder):
             self._log(f"❌ フォルダが見つかりません: done/{date_str}/")
             return False
-
-        os.makedirs(CFG["input_dir"], exist_ok=True)
-        os.makedirs(CFG["text_dir"], exist_ok=True)
-
-        copied_pdf = 0
-        copied_txt = 0
-
-        for pdf in glob.glob(os.path.join(folder, "*.pdf")):
-            dst = os.path.join(CFG["input_dir"], os.path.basename(pdf))
-            shutil.copy2(pdf, dst)
-            copied_pdf += 1
-
-        for txt in glob.glob(os.path.join(folder, "*_draft.txt")):
-            dst = os.path.join(CFG["text_dir"], os.path.basename(txt))
-            shutil.copy2(txt, dst)
-            copied_txt += 1
-
-        self._log(f"♻️ done/{date_str}/ から復元: PDF {copied_pdf}件, テキスト {copied_txt}件")
+        index = self._archive()
+        index.refresh()
+        rows = [r for r in index.find(date=date_str) if r["folder"] == date_str]
+        self._restore(rows, f"done/{date_str}/")
         return True
 
+    def restore_archive(self, date: str = "", master_id: str = "", student_id: str = ""):
+        """検索条件に合う答案だけを復元する"""
+        if not (date or master_id or student_id):
+            self._log("❌ 復元する条件を指定してください")
+            return False
+        rows = [r for r in self.search_archive(date, master_id, student_id) if r["kind"] != "output"]
+        # 検索条件に合ったPDFの抽出テキストも一緒に戻す
+        bases = {(r["folder"], r["base"]) for r in rows}
+        rows += [r for r in self._archive().find(kind="text") if (r["folder"], r["base"]) in bases and r not in rows]
+        if not rows:
+            self._log("❌ 条件に合う答案がアーカイブにありません")
+            return False
+        return self._restore(rows, "アーカイブ")
+
     # ── PDF・テキスト操作 ──────────────────────────────
 
     def get_pdf_image(self, pdf_path, page_idx=0, zoom=1.0):
         if not pdf_path or not os.path.exists(pdf_path):
             return {"error": "PDFが見つかりません"}
-        doc = fitz.open(pdf_path)
-        if page_idx >= len(doc):
-            page_idx = len(doc) - 1
-        page = doc[page_idx]
-        mat = fitz.Matrix(zoom * 150 / 72, zoom * 150 / 72)
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
+        if self._page_server and self._page_server.resolve(pdf_path):
+            # URLだけ返し、描画・転送は画像サーバー側で行う
+            try:
+                mtime, total = self._page_cache.page_count(pdf_path)
+            except Exception as e:
+                return {"error": f"PDFを表示できません: {e}"}
+            page_idx = max(0, min(int(page_idx), total - 1))
+            self._page_cache.prefetch([(pdf_path, page_idx, zoom)] +
+                                      self._prefetch_targets(pdf_path, page_idx, total, zoom))
+            return {
+                "image_url": self._page_server.page_url(pdf_path, page_idx, zoom, mtime),
+                "tile_url": self._page_server.tile_url_template(pdf_path, page_idx, zoom, mtime),
+                "current_page": page_idx,
+                "total_pages": total
+            }
+        try:
+            img_data, page_idx, total = self._page_cache.get(pdf_path, page_idx, zoom)
+        except Exception as e:
+            return {"error": f"PDFを表示できません: {e}"}
+        self._page_cache.prefetch(self._prefetch_targets(pdf_path, page_idx, total, zoom))
         b64_str = base64.b64encode(img_data).decode("utf-8")
         return {
             "image_data": f"data:image/png;base64,{b64_str}",
             "current_page": page_idx,
-            "total_pages": len(doc)
+            "total_pages": total
         }
 
+    def _prefetch_targets(self, pdf_path, page_idx, total, zoom):
+        """次に表示されそうなページ: 前後のページ、対応するPDF（inputs ↔ step3_final）、前後の答案の1ページ目"""
+        targets = []
+        if page_idx + 1 < total:
+            targets.append((pdf_path, page_idx + 1, zoom))
+        if page_idx > 0:
+            targets.append((pdf_path, page_idx - 1, zoom))
+        name = os.path.basename(pdf_path)
+        folder = os.path.abspath(os.path.dirname(pdf_path))
+        input_dir = os.path.abspath(CFG["input_dir"])
+        output_dir = os.path.abspath(CFG["output_dir"])
+        counterpart = {input_dir: output_dir, output_dir: input_dir}.get(folder)
+        if counterpart and os.path.exists(os.path.join(counterpart, name)):
+            targets.append((os.path.join(counterpart, name), page_idx, zoom))
+        siblings = sorted(glob.glob(os.path.join(folder, "*.pdf")))
+        names = [os.path.basename(p) for p in siblings]
+        if name in names:
+            i = names.index(name)
+            for j in (i + 1, i - 1):
+                if 0 <= j < len(siblings):
+                    targets.append((siblings[j], 0, zoom))
+        return targets
+
+    def _named_pdf(self, name, folder="input"):
+        """ファイル名から inputs/（folder="output" なら step3_final/）のPDFのパスを返す。名前が不正なら None"""
+        root = {"input": CFG["input_dir"], "output": CFG["output_dir"]}.get(folder)
+        if root is None or not _is_pdf_name(name):
+            return None
+        return os.path.join(root, name)
+
+    def _draft_path(self, name):
+        if not _is_pdf_name(name):
+            return None
+        return os.path.join(CFG["text_dir"], f"{os.path.splitext(name)[0]}_draft.txt")
+
+    def get_page_image(self, name: str, page_idx: int = 0, zoom: float = 1.0, folder: str = "input"):
+        """ファイル名で指定した答案のページ画像（get_pdf_image のファイル名版。サーバーからも使える）"""
+        path = self._named_pdf(name, folder)
+        if path is None:
+            return {"error": "ファイル名が不正です"}
+        return self.get_pdf_image(path, page_idx, zoom)
+
+    def read_draft(self, name: str):
+        """答案（PDFのファイル名）の抽出テキストを読む"""
+        path = self._draft_path(name)
+        if path is None:
+            return None
+        return self.read_text(path)
+
+    def save_draft(self, name: str, text: str):
+        """答案（PDFのファイル名）の抽出テキストを保存する"""
+        path = self._draft_path(name)
+        if path is None or not isinstance(text, str):
+            return False
+        return self.save_text(path, text)
+
     def read_text(self, txt_path):
         if os.path.exists(txt_path):
             return Path(txt_path).read_text(encoding="utf-8")
@@ -324,109 +642,301 @@ class Api:
             return False
 
     def extract_zip(self, zip_path):
+        """ZIP内のPDFを展開せずにストリームで読み、重複を除いて inputs/ に取り込む"""
         if not zip_path or not os.path.exists(zip_path):
             return False
-        os.makedirs(CFG["input_dir"], exist_ok=True)
         try:
-            with zipfile.ZipFile(zip_path) as z:
-                pdfs = [n for n in z.namelist() if n.lower().endswith(".pdf")]
-                for name in pdfs:
-                    z.extract(name, CFG["input_dir"])
-                    src = os.path.join(CFG["input_dir"], name)
-                    dst = os.path.join(CFG["input_dir"], os.path.basename(name))
-                    if src != dst:
-                        os.replace(src, dst)
-            self._log(f"📦 ZIP展開完了: {len(pdfs)}件")
-            return True
+            results = self._ingestor().ingest_zip(zip_path)
         except Exception as e:
             self._log(f"❌ ZIP展開エラー: {e}")
             return False
+        self._log_ingest(results, "📦 ZIP展開完了")
+        return True
 
-    # ── Step実行 ───────────────────────────────────────
-
-    def run_step1(self):
+    def run_step1_from_zip(self, zip_path):
+        """ZIPを取り込みながら、各PDFをそのままStep1に流す（取り込み完了を待たない）"""
+        if not zip_path or not os.path.exists(zip_path):
+            return False
         base = os.path.dirname(os.path.abspath(__file__))
         path = os.path.join(base, "step1_mark_and_text_v2.py")
-        if not os.path.exists(path):
-            self._log("❌ step1_mark_and_text_v2.py が見つかりません")
-            return False
-        # 前回の出力PDFをdoneに退避
+        self._archive_previous_output()
+        job = self._submit("step1", path, "ZIP取り込み + Step1 テキスト抽出", args=["--zip", os.path.abspath(zip_path)])
+        job.wait()
+        return job.ok
+
+    # ── Step実行 ───────────────────────────────────────
+
+    def _step1_files(self):
+        """inputs/ のPDFのうち、まだジョブに入っていないもの"""
+        queued = self._scheduler.active_files("step1")
+        return [os.path.basename(p) for p in sorted(glob.glob(os.path.join(CFG["input_dir"], "*.pdf")))
+                if os.path.basename(p) not in queued]
+
+    def _step23_files(self):
+        """テキスト抽出済みで、まだ採点ジョブに入っていないPDF"""
+        queued = self._scheduler.active_files()
+        return [os.path.basename(p["pdf"]) for p in self.get_pairs()
+                if os.path.exists(p["txt"]) and os.path.basename(p["pdf"]) not in queued]
+
+    def _archive_previous_output(self):
+        # 前回の出力PDFをdoneに退避（採点ジョブが動いている間は出力中のPDFを動かさない）
+        if self._scheduler.busy("step23"):
+            return
         output_dir = os.path.abspath(CFG["output_dir"])
         pdfs = glob.glob(os.path.join(output_dir, "*.pdf"))
         if pdfs:
             date_str = datetime.now().strftime("%Y%m%d")
-            archive_folder = os.path.join(CFG["done_dir"], f"{date_str}_output")
-            os.makedirs(archive_folder, exist_ok=True)
+            index = self._archive()
             for pdf in pdfs:
-                shutil.move(pdf, os.path.join(archive_folder, os.path.basename(pdf)))
+                index.move_into(pdf, f"{date_str}_output")
             self._log(f"📁 前回の出力PDF {len(pdfs)}件を done/{date_str}_output/ に退避しました")
-        return self._run_realtime(path, "Step1 テキスト抽出")
 
-    def _move_files_to_done(self):
+    def _check_names(self, files):
+        """ファイル名の一覧がすべてフォルダ直下のPDF名か（不正な名前があればログに出す）"""
+        bad = [f for f in files if not _is_pdf_name(f)]
+        if bad:
+            self._log(f"❌ ファイル名が不正です: {', '.join(map(str, bad[:5]))}")
+        return not bad
+
+    def submit_step1(self, files=None, priority: int = PRIORITY_NORMAL):
+        """Step1をジョブキューに積み、ジョブIDを返す（完了を待たない）"""
+        if files is not None and not self._check_names(files):
+            return None
+        base = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(base, "step1_mark_and_text_v2.py")
+        if not os.path.exists(path):
+            self._log("❌ step1_mark_and_text_v2.py が見つかりません")
+            return None
+        files = files if files is not None else self._step1_files()
+        if not files:
+            self._log("❌ 処理するPDFがありません")
+            return None
+        self._archive_previous_output()
+        return self._submit("step1", path, "Step1 テキスト抽出", files=files, priority=priority).id
+
+    def submit_step23(self, files=None, priority: int = PRIORITY_NORMAL):
+        """Step2&3をジョブキューに積み、ジョブIDを返す。処理できたファイルだけ done/ に移す"""
+        if files is not None and not self._check_names(files):
+            return None
+        base = os.path.dirname(os.path.abspath(__file__))
+        path = os.path.join(base, CFG["step23_script"])
+        if not os.path.exists(path):
+            self._log(f"❌ {CFG['step23_script']} が見つかりません")
+            return None
+        files = files if files is not None else self._step23_files()
+        if not files:
+            self._log("❌ 採点できる答案がありません（Step1を実行してください）")
+            return None
+        args = ["--run-id", results_store.new_run_id()]
+        return self._submit("step23", path, "採点・PDF印字", files=files, args=args, priority=priority,
+                            on_finish=lambda job: self._move_files_to_done(job.done_files())).id
+
+    def run_step1(self):
+        job_id = self.submit_step1()
+        if not job_id:
+            return False
+        job = self._scheduler.get(job_id)
+        job.wait()
+        return job.ok and not job.cancelled
+
+    def _move_files_to_done(self, files=None):
+        """files（PDFのファイル名）を done/YYYYMMDD/ に移す。None なら inputs/ と step1_texts/ の全件"""
+        if files is not None and not files:
+            return
         date_str = datetime.now().strftime("%Y%m%d")
-        done_folder = os.path.join(CFG["done_dir"], date_str)
-        os.makedirs(done_folder, exist_ok=True)
+        index = self._archive()
+        if files is None:
+            pdfs = glob.glob(os.path.join(CFG["input_dir"], "*.pdf"))
+            txts = glob.glob(os.path.join(CFG["text_dir"], "*_draft.txt"))
+        else:
+            files = [f for f in files if _is_pdf_name(f)]
+            pdfs = [os.path.join(CFG["input_dir"], f) for f in files]
+            txts = [os.path.join(CFG["text_dir"], f"{os.path.splitext(f)[0]}_draft.txt") for f in files]
         moved_pdf = 0
         moved_txt = 0
-        for pdf in glob.glob(os.path.join(CFG["input_dir"], "*.pdf")):
-            shutil.move(pdf, os.path.join(done_folder, os.path.basename(pdf)))
-            moved_pdf += 1
-        for txt in glob.glob(os.path.join(CFG["text_dir"], "*_draft.txt")):
-            shutil.move(txt, os.path.join(done_folder, os.path.basename(txt)))
-            moved_txt += 1
+        for pdf in pdfs:
+            if os.path.exists(pdf):
+                index.move_into(pdf, date_str)
+                moved_pdf += 1
+        for txt in txts:
+            if os.path.exists(txt):
+                index.move_into(txt, date_str)
+                moved_txt += 1
         self._log(f"📁 done/{date_str}/ に移動: PDF {moved_pdf}件, テキスト {moved_txt}件")
 
     def run_step23(self):
+        job_id = self.submit_step23()
+        if not job_id:
+            return False
+        job = self._scheduler.get(job_id)
+        job.wait()
+        return job.ok and not job.cancelled
+
+    def run_restamp(self, run_id: str = ""):
+        """保存済みの採点結果からPDFを再印字する（APIは呼ばない）"""
         base = os.path.dirname(os.path.abspath(__file__))
-        path = os.path.join(base, CFG["step23_script"])
+        path = os.path.join(base, "restamp.py")
         if not os.path.exists(path):
-            self._log(f"❌ {CFG['step23_script']} が見つかりません")
+            self._log("❌ restamp.py が見つかりません")
             return False
-        ok = self._run_realtime(path, "採点・PDF印字")
+        args = ["--db", CFG["results_db"], "--out", CFG["output_dir"]]
+        if run_id:
+            args += ["--run", run_id]
+        job = self._submit("restamp", path, "再印字", args=args, priority=PRIORITY_HIGH, lane="step23")
+        job.wait()
+        return job.ok
+
+    # ── ジョブキュー ───────────────────────────────────
+
+    def get_queue_state(self):
+        """レーンごとの実行状況と、各ジョブのファイル別の状態を返す"""
+        return self._scheduler.state()
+
+    def cancel_job(self, job_id: str):
+        """ジョブを取り消す（処理済みのファイルはそのまま残す）"""
+        return self._scheduler.cancel_job(job_id)
+
+    def cancel_file(self, job_id: str, filename: str):
+        """ジョブの中のファイル1件だけを取り消す"""
+        if not _is_pdf_name(filename):
+            return False
+        ok = self._scheduler.cancel_file(job_id, filename)
         if ok:
-            self._move_files_to_done()
+            self._log(f"⛔ {filename} をキャンセルしました")
         return ok
 
-    def cancel_step1(self):
-        """Step1をキャンセルし、inputs/とstep1_texts/をクリーンアップ"""
-        self._cancelled = True
-        if self._current_proc:
-            try:
-                self._current_proc.terminate()
-            except Exception:
-                pass
-        # inputs/ の全PDF削除
-        for f in glob.glob(os.path.join(CFG["input_dir"], "*.pdf")):
-            try:
-                os.remove(f)
-            except Exception:
-                pass
-        # step1_texts/ の全txt削除
-        for f in glob.glob(os.path.join(CFG["text_dir"], "*_draft.txt")):
+    # ── 監視フォルダモード ─────────────────────────────
+
+    def start_watch(self, include_existing: bool = False):
+        """inputs/ を監視し、置かれたPDFを1件ずつ Step1 → 採点・印字 まで流す"""
+        if self._watcher:
+            return True
+        self._watch_run_id = results_store.new_run_id()
+        self._watch_review = {}
+        try:
+            self._watcher = FolderWatcher(CFG["input_dir"], self._on_watch_new,
+                                          settle_seconds=float(CFG["watch_settle_seconds"]),
+                                          ignore_existing=not include_existing).start()
+        except Exception as e:
+            self._watcher = None
+            self._log(f"❌ 監視を開始できませんでした: {e}")
+            return False
+        self._log(f"👀 inputs/ の監視を開始しました（{self._watcher.backend}）")
+        return True
+
+    def stop_watch(self):
+        if not self._watcher:
+            return False
+        self._watcher.stop()
+        self._watcher = None
+        self._log("👀 inputs/ の監視を停止しました（実行中のジョブはそのまま続きます）")
+        return True
+
+    def get_watch_state(self):
+        return {
+            "watching": self._watcher is not None,
+            "backend": self._watcher.backend if self._watcher else None,
+            "run_id": self._watch_run_id,
+            "review": dict(self._watch_review),
+        }
+
+    def _on_watch_new(self, path):
+        name = os.path.basename(path)
+        if name in self._scheduler.active_files():
+            return
+        base = os.path.dirname(os.path.abspath(__file__))
+        script = os.path.join(base, "step1_mark_and_text_v2.py")
+        self._submit("step1", script, f"Step1 テキスト抽出 ({name})", files=[name],
+                     on_finish=self._after_watch_step1)
+
+    def _after_watch_step1(self, job):
+        """Step1が終わった答案を、問題なければそのまま採点に回す"""
+        master_ids = {d["meta"]["id"] for _, d in json_cache.load_dir("./masters")
+                      if "meta" in d and "id" in d["meta"]}
+        for name in job.done_files():
+            txt = os.path.join(CFG["text_dir"], f"{os.path.splitext(name)[0]}_draft.txt")
             try:
-                os.remove(f)
-            except Exception:
-                pass
-        self._log("🗑️ inputs/ と step1_texts/ をクリーンアップしました")
+                text = Path(txt).read_text(encoding="utf-8")
+            except OSError:
+                text = ""
+            reasons = review_reasons(text, master_ids)
+            if reasons:
+                self._watch_review[name] = reasons
+                self._log(f"🔍 {name} は確認待ちにしました: {' / '.join(reasons)}")
+                self._ui.event({"event": "file", "stage": "review", "file": name, "status": "review",
+                                "reasons": reasons})
+            else:
+                self._submit_watch_step23(name)
+
+    def _submit_watch_step23(self, name):
+        base = os.path.dirname(os.path.abspath(__file__))
+        script = os.path.join(base, CFG["step23_script"])
+        self._submit("step23", script, f"採点・PDF印字 ({name})", files=[name],
+                     args=["--run-id", self._watch_run_id or results_store.new_run_id()],
+                     on_finish=self._after_watch_step23)
+
+    def _after_watch_step23(self, job):
+        self._move_files_to_done(job.done_files())
+        if self._watcher:
+            for name in job.done_files():  # 同じ名前で置き直されたら再び処理する
+                self._watcher.forget(os.path.join(CFG["input_dir"], name))
+
+    def approve_review(self, filename: str):
+        """確認待ちの答案を（テキスト修正後に）採点に回す"""
+        if not _is_pdf_name(filename) or self._watch_review.pop(filename, None) is None:
+            return False
+        self._submit_watch_step23(filename)
+        return True
+
+    def _cancelled_files(self, jobs):
+        """取り消したジョブのうち、処理が終わらなかった（取り消し・未着手の）ファイル名"""
+        for job in jobs:
+            job.wait(10)
+        return [f for job in jobs for f, s in job.state()["files"].items() if s in ("cancelled", "queued")]
+
+    def cancel_step1(self):
+        """Step1をキャンセルし、処理が終わらなかったファイルのPDFとtxtをクリーンアップ（処理済みの分は残す）"""
+        files = self._cancelled_files(self._scheduler.cancel_kind("step1"))
+        in_use = self._scheduler.active_files("step23")  # 採点中のファイルには触らない
+        removed = 0
+        for f in files:
+            if f in in_use or not _is_pdf_name(f):
+                continue
+            base = os.path.splitext(f)[0]
+            for path in (os.path.join(CFG["input_dir"], f), os.path.join(CFG["text_dir"], f"{base}_draft.txt")):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            self._log(f"🗑️ キャンセルした{len(files)}件の inputs/ と step1_texts/ をクリーンアップしました")
         return True
 
     def cancel_step23(self):
-        """Step2&3をキャンセルし、step3_final/をクリーンアップ（inputs/step1_textsは残す）"""
-        self._cancelled = True
-        if self._current_proc:
+        """Step2&3をキャンセルし、処理が終わらなかったファイルの出力PDFをクリーンアップ（inputs/step1_textsは残す）"""
+        files = self._cancelled_files(self._scheduler.cancel_kind("step23"))
+        removed = 0
+        for f in files:
+            if not _is_pdf_name(f):
+                continue
             try:
-                self._current_proc.terminate()
-            except Exception:
+                os.remove(os.path.join(CFG["output_dir"], f))
+                removed += 1
+            except OSError:
                 pass
-        # step3_final/ の全PDF削除
-        for f in glob.glob(os.path.join(CFG["output_dir"], "*.pdf")):
-            try:
-                os.remove(f)
-            except Exception:
-                pass
-        self._log("🗑️ step3_final/ をクリーンアップしました")
+        if removed:
+            self._log(f"🗑️ キャンセルした{removed}件の step3_final/ をクリーンアップしました")
         return True
 
+    def shutdown(self):
+        """監視・常駐ワーカー・画像サーバーを止める（終了時に呼ぶ）"""
+        self.stop_watch()
+        for worker in self._workers.values():
+            worker.kill()
+        if self._page_server:
+            self._page_server.stop()
+
 if __name__ == '__main__':
     api = Api()
     window = webview.create_window(
@@ -438,4 +948,5 @@ if __name__ == '__main__':
     )
     api.set_window(window)
     print("バックエンド起動中...")
-    webview.start(debug=True)
\ No newline at end of file
+    webview.start(debug=True)
+    api.shutdown()
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""
+一括スキャンPDFの分割
+コピー機でクラス全員分（40人 × Nページ）をまとめてスキャンした1つのPDFを、生徒ごとのPDFに分ける。
+パイプラインは inputs/ に「1人1ファイル」を前提にしているので、Step1の前に使う。
+
+分け方（--mode）:
+    pages   1人あたりのページ数で区切る（--pages か、--master の座標データで使っているページ数）
+    blank   白紙の区切りページ（page_features.is_blank、Step1 の白紙除外と同じ判定）で区切る。区切りページは出力しない
+    header  各ページのヘッダー部分（上部）の見た目が1ページ目と同じなら、そこから次の生徒とみなす
+    auto    --pages / --master があれば pages、白紙ページがあれば blank、なければ header
+            （白紙と判定されたページが半分を超えるなら、判定の誤りとみなして header）
+
+ページは描画し直さず insert_pdf でそのままコピーするので、画質は変わらず速い。
+判定用の描画は36dpiのグレースケール（page_features.py）だけ。
+
+使い方:
+    python batch_splitter.py class_3A.pdf --mode pages --pages 4
+    python batch_splitter.py class_3A.pdf --master 2025_1_1
+    python batch_splitter.py class_3A.pdf --mode blank --out ./inputs --dry-run
+"""
+import os
+import sys
+import json
+import argparse
+
+import fitz
+from page_features import render_gray, top_band, is_blank, dhash, hamming
+
+COORD_DB_DIR = "./coord_db"
+MAX_BLANK_RATIO = 0.5    # auto で白紙がこの割合を超えるなら blank を使わない（区切りは生徒数分しかないはず）
+HEADER_FRACTION = 0.15   # ヘッダーとみなすページ上部の割合
+HEADER_MAX_DISTANCE = 10  # 1ページ目のヘッダーとのハッシュの違い（64ビット中）がこれ以下なら同じ用紙の先頭
+MODES = ("auto", "pages", "blank", "header")
+
+
+def pages_for_master(master_id, coord_db_dir=COORD_DB_DIR):
+    """座標データで使われている最大のページ番号 + 1（1人あたりのページ数）。分からなければ None"""
+    path = os.path.join(coord_db_dir, f"{master_id}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            coords = json.load(f)
+    except (OSError, ValueError):
+        return None
+    pages = []
+
+    def walk(v):
+        if isinstance(v, list) and len(v) == 5 and all(isinstance(x, (int, float)) for x in v):
+            pages.append(int(v[0]))
+        elif isinstance(v, dict):
+            for x in v.values():
+                walk(x)
+    walk(coords)
+    return max(pages) + 1 if pages else None
+
+
+def split_by_pages(page_count, per_student):
+    """[(開始ページ, 終了ページ), ...]（終了ページを含む）"""
+    return [(i, min(i + per_student, page_count) - 1) for i in range(0, page_count, per_student)]
+
+
+def blank_pages(doc):
+    return [i for i in range(len(doc)) if is_blank(render_gray(doc[i]))]
+
+
+def split_by_blank(page_count, blanks):
+    """白紙ページを区切りとして、その間のページのまとまりを返す（連続する白紙・空のまとまりは無視）"""
+    blanks = set(blanks)
+    ranges, start = [], None
+    for i in range(page_count):
+        if i in blanks:
+            if start is not None:
+                ranges.append((start, i - 1))
+                start = None
+        elif start is None:
+            start = i
+    if start is not None:
+        ranges.append((start, page_count - 1))
+    return ranges
+
+
+def header_starts(doc, fraction=HEADER_FRACTION, max_distance=HEADER_MAX_DISTANCE, reference=None):
+    """ヘッダーが reference（省略時は1ページ目）と同じ見た目のページ番号のリスト"""
+    hashes = [dhash(render_gray(doc[i], clip=top_band(doc[i], fraction))) for i in range(len(doc))]
+    ref = hashes[0] if reference is None else reference
+    return [i for i, h in enumerate(hashes) if i == 0 or hamming(h, ref) <= max_distance]
+
+
+def split_by_starts(page_count, starts):
+    starts = sorted(set(starts) | {0})
+    return [(s, (starts[k + 1] if k + 1 < len(starts) else page_count) - 1) for k, s in enumerate(starts)]
+
+
+def plan_split(doc, mode="auto", pages=None, master_id=None):
+    """(使ったモード, [(開始, 終了), ...]) を返す"""
+    n = len(doc)
+    if mode in ("auto", "pages") and not pages and master_id:
+        pages = pages_for_master(master_id)
+    if mode == "pages" or (mode == "auto" and pages):
+        if not pages:
+            raise ValueError("1人あたりのページ数が分かりません（--pages か --master を指定してください）")
+        return "pages", split_by_pages(n, pages)
+    if mode in ("auto", "blank"):
+        blanks = blank_pages(doc)
+        if mode == "blank" or (blanks and len(blanks) <= n * MAX_BLANK_RATIO):
+            return "blank", split_by_blank(n, blanks)
+    return "header", split_by_starts(n, header_starts(doc))
+
+
+def write_parts(doc, ranges, out_dir, stem):
+    """ページをコピーして <stem>_001.pdf, ... を書き出し、パスのリストを返す"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    width = max(3, len(str(len(ranges))))
+    for k, (start, end) in enumerate(ranges, 1):
+        path = os.path.join(out_dir, f"{stem}_{k:0{width}d}.pdf")
+        part = path + ".part"
+        out = fitz.open()
+        try:
+            out.insert_pdf(doc, from_page=start, to_page=end)
+            out.save(part, garbage=3, deflate=True)
+        finally:
+            out.close()
+        os.replace(part, path)
+        paths.append(path)
+    return paths
+
+
+def split_pdf(pdf_path, out_dir, mode="auto", pages=None, master_id=None, dry_run=False):
+    """
+    一括スキャンPDFを生徒ごとに分ける。
+    {"mode": 使ったモード, "ranges": [(開始, 終了), ...], "paths": [出力PDF], "warnings": [...]} を返す。
+    """
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    doc = fitz.open(pdf_path)
+    try:
+        used, ranges = plan_split(doc, mode, pages, master_id)
+        if not ranges:
+            raise ValueError(f"分割できるページがありません（モード: {used}、{len(doc)}ページ）")
+        warnings = []
+        if used == "pages" and len(ranges) > 1 and ranges[-1][1] - ranges[-1][0] != ranges[0][1] - ranges[0][0]:
+            warnings.append(f"ページ数 {len(doc)} が1人あたりのページ数で割り切れません（最後の1人が欠けている可能性）")
+        lengths = {e - s + 1 for s, e in ranges}
+        if used != "pages" and len(lengths) > 1:
+            warnings.append(f"1人あたりのページ数がそろっていません: {sorted(lengths)}")
+        paths = [] if dry_run else write_parts(doc, ranges, out_dir, stem)
+    finally:
+        doc.close()
+    return {"mode": used, "ranges": ranges, "paths": paths, "warnings": warnings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="クラス全員分の一括スキャンPDFを生徒ごとのPDFに分ける")
+    parser.add_argument("pdf")
+    parser.add_argument("--mode", choices=MODES, default="auto")
+    parser.add_argument("--pages", type=int, default=None, help="1人あたりのページ数")
+    parser.add_argument("--master", default=None, help="マスターID（座標データからページ数を決める）")
+    parser.add_argument("--out", default="./inputs")
+    parser.add_argument("--dry-run", action="store_true", help="分け方だけ表示して書き出さない")
+    args = parser.parse_args()
+
+    try:
+        result = split_pdf(args.pdf, args.out, args.mode, args.pages, args.master, args.dry_run)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✂️ {os.path.basename(args.pdf)} → {len(result['ranges'])}人分（モード: {result['mode']}）")
+    for k, (s, e) in enumerate(result["ranges"], 1):
+        print(f"   {k:3d}: p{s + 1}〜p{e + 1}")
+    for w in result["warnings"]:
+        print(f"⚠️ {w}")
+    if result["paths"]:
+        print(f"📄 {len(result['paths'])}件を {args.out} に書き出しました")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
@@ -0,0 +1,195 @@
+"""
+PDF処理（CPU側）のマイクロベンチマーク
+合成答案に対して以下のステージを計測し、所要時間とメモリ確保量を表示する。
+    rasterize   step1.pdf_to_images（300dpi画像化 + コントラスト調整）
+    crop        step1.crop_image
+    stamp       step2_and3_combined.write_to_pdf（注釈の書き込み）
+    render      page_cache.PageRenderCache.get（backend.Api.get_pdf_image / 画像サーバーの描画処理）
+
+メモリはtracemallocで計測するため、Python側の確保量のみ（MuPDF内部の確保は含まない）。
+--baseline に前回のJSONを渡すと、p50が閾値を超えて遅くなったステージを検出して終了コード1を返す。
+
+使い方:
+    python bench_pdf_stages.py --sheets 20 --json bench_pdf.json
+    python bench_pdf_stages.py --sheets 20 --baseline bench_pdf.json --threshold 1.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+import sheet_generator
+from bench_pipeline import percentile, peak_rss_mb
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _sample_grading(master):
+    """write_to_pdf に渡す採点結果dict（長めの添削コメント入り）"""
+    questions = {}
+    for key, q in master.get("sub_questions", {}).items():
+        mx = int(q.get("max", 10))
+        questions[key] = {
+            "max": mx, "score": mx - 3, "mark": "triangle",
+            "corrections": [f"{n}「sample」の語法に誤りがあります。文脈に合う表現を選びましょう。(-1)"
+                            for n in "①②③"],
+            "details_text": "", "sub_results": {},
+        }
+    return {
+        "questions": questions,
+        "comment_parts": {"praise": "構文を正しく理解することができています。" * 2,
+                          "advice": "時制の一致を見直せると良いですね。" * 2,
+                          "closing": "これからも頑張ってください。応援しています。"},
+    }
+
+
+def _measure(fn, inputs, trace):
+    """inputsの各要素でfnを呼び、1回ごとの秒数とtracemallocのピーク（バイト）を返す"""
+    times, peaks = [], []
+    for item in inputs:
+        if trace:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        fn(item)
+        times.append(time.perf_counter() - t0)
+        if trace:
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    return times, peaks
+
+
+def run_stages(sheets, master_id, workdir, scanned=True, alloc_samples=5, stages=None):
+    import step1_mark_and_text_v2 as step1
+    import step2_and3_combined as step23
+    from page_cache import PageRenderCache
+
+    pdf_dir = os.path.join(workdir, "inputs")
+    out_dir = os.path.join(workdir, "step3_final")
+    pdfs = sheet_generator.generate_sheets(master_id, sheets, pdf_dir, scanned=scanned)
+    master, _ = sheet_generator.load_layout(master_id)
+    grading = _sample_grading(master or {})
+    step23.OUTPUT_DIR = out_dir
+    step23.COORD_DB_DIR = os.path.join(BASE_DIR, "coord_db")
+    cache = PageRenderCache()
+
+    # crop用の入力（1枚目の画像化結果を使い回す）
+    # rasterize は同じ temp_*.png の名前で書いて消すので、別の名前に移しておく
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        rendered = step1.pdf_to_images(pdfs[0], dpi=300)
+    finally:
+        os.chdir(cwd)
+    sample_pngs = []
+    for k, p in enumerate(rendered):
+        dst = os.path.join(workdir, f"crop_sample_{k}.png")
+        os.replace(os.path.join(workdir, p), dst)
+        sample_pngs.append(dst)
+
+    def rasterize(pdf):
+        for p in step1.pdf_to_images(pdf, dpi=300):
+            os.remove(p)
+
+    def crop(png):
+        os.remove(step1.crop_image(png, [600, 50, 950, 500]))
+
+    def stamp(pdf):
+        step23.write_to_pdf(grading, master_id, pdf, None)
+
+    def render(pdf):
+        cache.clear()  # 繰り返し実行がキャッシュヒットにならないよう、毎回描画させる
+        cache.get(pdf, 0, 1.0)
+
+    table = {
+        "rasterize": (rasterize, pdfs),
+        "crop": (crop, sample_pngs * max(1, sheets // len(sample_pngs))),
+        "stamp": (stamp, pdfs),
+        "render": (render, pdfs),
+    }
+    results = {}
+    os.chdir(workdir)  # Step1の一時ファイルを作業フォルダに出す
+    try:
+        for name, (fn, inputs) in table.items():
+            if stages and name not in stages:
+                continue
+            fn(inputs[0])  # ウォームアップ
+            times, _ = _measure(fn, inputs, trace=False)
+            tracemalloc.start()
+            _, peaks = _measure(fn, inputs[:alloc_samples], trace=True)
+            tracemalloc.stop()
+            results[name] = {
+                "count": len(times),
+                "p50": round(percentile(times, 50), 5),
+                "p95": round(percentile(times, 95), 5),
+                "mean": round(sum(times) / len(times), 5),
+                "alloc_peak_kb": round(max(peaks) / 1024, 1) if peaks else None,
+            }
+    finally:
+        os.chdir(cwd)
+    return {"sheets": sheets, "scanned": scanned, "stages": results,
+            "peak_rss_mb": round(peak_rss_mb() or 0, 1) or None}
+
+
+def compare(report, baseline, threshold):
+    """baselineより p50 が threshold 倍以上遅いステージ名のリスト"""
+    slow = []
+    for name, s in report["stages"].items():
+        b = baseline.get("stages", {}).get(name)
+        if b and b["p50"] > 0 and s["p50"] / b["p50"] >= threshold:
+            slow.append((name, b["p50"], s["p50"]))
+    return slow
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF処理ステージのマイクロベンチマーク")
+    parser.add_argument("--sheets", type=int, default=20)
+    parser.add_argument("--master", default="2025_1_1")
+    parser.add_argument("--vector", action="store_true", help="画像PDFではなくベクターPDFで計測する")
+    parser.add_argument("--stages", nargs="*", default=None, help="計測するステージ（省略時は全て）")
+    parser.add_argument("--alloc-samples", type=int, default=5, help="メモリ計測に使う枚数")
+    parser.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", default=None, help="比較する前回のJSON")
+    parser.add_argument("--threshold", type=float, default=1.2, help="劣化とみなすp50の倍率")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="grading_pdfbench_")
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")):
+            report = run_stages(args.sheets, args.master, workdir, scanned=not args.vector,
+                                alloc_samples=args.alloc_samples, stages=args.stages)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"📊 PDFステージ計測（{report['sheets']}枚, {'画像PDF' if report['scanned'] else 'ベクターPDF'}）")
+    print(f"   {'ステージ':<12}{'件数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'平均(ms)':>10}{'確保ピーク(KB)':>16}")
+    for name, s in report["stages"].items():
+        alloc = f"{s['alloc_peak_kb']:.1f}" if s["alloc_peak_kb"] is not None else "-"
+        print(f"   {name:<12}{s['count']:>6}{s['p50']*1000:>10.1f}{s['p95']*1000:>10.1f}"
+              f"{s['mean']*1000:>10.1f}{alloc:>16}")
+    if report["peak_rss_mb"]:
+        print(f"   ピークRSS: {report['peak_rss_mb']:.1f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 {args.json} に保存しました")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        slow = compare(report, baseline, args.threshold)
+        for name, before, after in slow:
+            print(f"❌ {name}: p50 {before*1000:.1f}ms → {after*1000:.1f}ms（{after/before:.2f}倍）")
+        if slow:
+            sys.exit(1)
+        print(f"✅ 基準値から{args.threshold}倍以上遅くなったステージはありません")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
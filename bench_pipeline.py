@@ -0,0 +1,203 @@
+"""
+パイプライン全体のベンチマーク（オフライン）
+モックLLMサーバー（mock_llm.py）を立ち上げ、合成答案N枚に対して
+Step1 → Step2/3 を実行し、スループットとステージごとの所要時間を表示する。
+
+使い方:
+    python bench_pipeline.py --sheets 20 --latency 0.3 --rate-limit-rate 0.05
+    python bench_pipeline.py --sheets 100 --json bench_result.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import functools
+import threading
+import contextlib
+
+import mock_llm
+import sheet_generator
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_MOCK_ENV = {"LLM_MOCK_URL": "", "GOOGLE_API_KEY": "mock", "ANTHROPIC_API_KEY": "mock",
+             "GEMINI_BASE_URL": "", "ANTHROPIC_BASE_URL": ""}
+
+
+def percentile(values, p):
+    """最近傍順位法によるパーセンタイル（値がなければ0）"""
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = max(0, min(len(s) - 1, int(round(p / 100.0 * len(s) + 0.5)) - 1))
+    return s[k]
+
+
+def peak_rss_mb():
+    """このプロセスのピークRSS（MB）。取得できない環境ではNone"""
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linuxはキロバイト、macOSはバイト
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class StageTimer:
+    """関数をラップしてステージごとの所要時間を記録する"""
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples.setdefault(stage, []).append(time.perf_counter() - t0)
+        return timed
+
+
+def run_benchmark(sheets, master_id, options, workdir, verbose=False, scanned=True):
+    import llm_client
+
+    server = mock_llm.MockServer(options=options)
+    url = server.start()
+    # 本物のキー・接続先が環境に残っていても、モック以外には送らない（終わったら元に戻す）
+    saved_env = {k: os.environ.get(k) for k in _MOCK_ENV}
+    os.environ.update(_MOCK_ENV, LLM_MOCK_URL=url)
+    llm_client.reset()
+
+    import step1_mark_and_text_v2 as step1
+    import step2_and3_combined as step23
+
+    input_dir = os.path.join(workdir, "inputs")
+    text_dir = os.path.join(workdir, "step1_texts")
+    output_dir = os.path.join(workdir, "step3_final")
+    sheet_generator.generate_sheets(master_id, sheets, input_dir, scanned=scanned)
+
+    step1.INPUT_DIR = input_dir
+    step1.OUTPUT_DIR = text_dir
+    step1.MASTER_DB_DIR = os.path.join(BASE_DIR, "masters")
+    step23.INPUT_TEXT_DIR = text_dir
+    step23.INPUT_PDF_DIR = input_dir
+    step23.OUTPUT_DIR = output_dir
+    step23.COORD_DB_DIR = os.path.join(BASE_DIR, "coord_db")
+    step23.MASTER_DB_DIR = os.path.join(BASE_DIR, "masters")
+    step23.RUBRIC_TXT_DIR = os.path.join(BASE_DIR, "rubric_txts")
+
+    timer = StageTimer()
+    step1.extract_text_with_ai = timer.wrap("step1_extract", step1.extract_text_with_ai)
+    step1.render_page = timer.wrap("step1_rasterize", step1.render_page)
+    step23.grade_answer = timer.wrap("step2_grade", step23.grade_answer)
+    step23.write_to_pdf = timer.wrap("step3_stamp", step23.write_to_pdf)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)  # Step1の一時PNGを作業フォルダに出す
+    sink = sys.stdout if verbose else open(os.devnull, "w", encoding="utf-8")
+    totals = {}
+    try:
+        with contextlib.redirect_stdout(sink):
+            t0 = time.perf_counter()
+            step1.main()
+            totals["step1"] = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            try:
+                step23.main()
+            except SystemExit:
+                pass
+            totals["step23"] = time.perf_counter() - t0
+    finally:
+        os.chdir(cwd)
+        if sink is not sys.stdout:
+            sink.close()
+        server.stop()
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        llm_client.reset()
+
+    graded = len([f for f in os.listdir(output_dir) if f.endswith(".pdf")]) if os.path.isdir(output_dir) else 0
+    total = sum(totals.values())
+    report = {
+        "sheets": sheets,
+        "graded": graded,
+        "wall_seconds": round(total, 3),
+        "sheets_per_min": round(graded / total * 60, 2) if total > 0 else 0.0,
+        "stage_totals": {k: round(v, 3) for k, v in totals.items()},
+        "stages": {
+            stage: {"count": len(v), "p50": round(percentile(v, 50), 4),
+                    "p95": round(percentile(v, 95), 4), "mean": round(sum(v) / len(v), 4)}
+            for stage, v in timer.samples.items()
+        },
+        "peak_rss_mb": round(peak_rss_mb() or 0, 1) or None,
+        "mock": server.stats(),
+    }
+    return report
+
+
+def print_report(report):
+    print(f"\n📊 ベンチマーク結果: {report['graded']}/{report['sheets']}枚  "
+          f"{report['wall_seconds']:.1f}秒  →  {report['sheets_per_min']:.1f} 枚/分")
+    print(f"   Step1: {report['stage_totals'].get('step1', 0):.1f}秒 | "
+          f"Step2/3: {report['stage_totals'].get('step23', 0):.1f}秒")
+    print(f"   {'ステージ':<18}{'件数':>6}{'p50(秒)':>10}{'p95(秒)':>10}{'平均(秒)':>10}")
+    for stage, s in report["stages"].items():
+        print(f"   {stage:<18}{s['count']:>6}{s['p50']:>10.3f}{s['p95']:>10.3f}{s['mean']:>10.3f}")
+    rss = report["peak_rss_mb"]
+    print(f"   ピークRSS: {rss:.1f} MB" if rss else "   ピークRSS: 取得できません")
+    print(f"   モックへのリクエスト: {json.dumps(report['mock'], ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モックLLMを使ったパイプライン全体のベンチマーク")
+    parser.add_argument("--sheets", type=int, default=10, help="合成答案の枚数")
+    parser.add_argument("--master", default="2025_1_1", help="使用するマスターID")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--recordings", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="作業フォルダ（省略時は一時フォルダ）")
+    parser.add_argument("--keep", action="store_true", help="作業フォルダを削除しない")
+    parser.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    parser.add_argument("--verbose", action="store_true", help="各Stepのログを表示する")
+    args = parser.parse_args()
+
+    options = mock_llm.MockOptions(latency=args.latency, upload_latency=args.upload_latency,
+                                   error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                   retry_after=args.retry_after, recordings_dir=args.recordings, seed=args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="grading_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    print(f"🚀 {args.sheets}枚の合成答案でベンチマークを実行します（作業フォルダ: {workdir}）")
+    try:
+        report = run_benchmark(args.sheets, args.master, options, workdir, verbose=args.verbose)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 {args.json} に保存しました")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
@@ -0,0 +1,169 @@
+"""
+答案用紙の枠の検出（NumPy）
+新しい答案用紙の座標取得（coordinate_picker.py）で、罫線で囲まれた欄（得点欄・採点者名欄・解答欄など）を見つけて
+候補として表示するためのもの。操作する人は候補をクリックするだけで座標を登録でき、合わなければ今まで通りドラッグする。
+
+検出のしかた（ループはページ全体の画素ではなく、見つかった線分・交点に対してだけ）:
+    1. ページを 100dpi のグレースケールで描画し、紙の地の色（中央値）より十分暗い画素をインクとして取り出す。
+       細い罫線は1画素に満たず薄くにじむので、固定のしきい値ではなく地の色との差で見て、上下左右に1画素太らせる
+    2. 横方向・縦方向に min_len 画素以上続くインクを累積和で取り出す（罫線だけが残り、手書き・文字は消える）
+    3. 線を線分（行・開始・終了）にまとめ、太い線で隣り合う線分は1本にする
+    4. 横線と縦線の交点の表を作り、左上の角ごとに、右・下で最も近い角がそろう一番小さい矩形を枠とする
+
+座標は coord_db と同じPDF座標（pt、ページ左上が原点）。
+
+使い方:
+    python box_detector.py blank_2025_1_1.pdf --page 1
+    python box_detector.py blank_2025_1_1.pdf --page 1 --overlay boxes.png
+"""
+import sys
+import argparse
+
+import fitz
+import numpy as np
+from page_features import render_gray
+
+DETECT_DPI = 100
+INK_CONTRAST = 40    # 地の色よりこれだけ暗い画素をインクとみなす（0.5pt の灰色の罫線でも拾える）
+MIN_LINE_PT = 18     # これより短い線は罫線とみなさない（文字の横棒などを除く）
+MIN_BOX_PT = 10      # これより小さい枠は候補にしない
+TOLERANCE_PX = 3     # 線どうしが交わっているとみなすすき間
+
+
+def _runs(mask):
+    """各行の True の連続を (行, 開始, 終了) の配列で返す（終了は含まない）"""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    diff = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(diff == 1)
+    _, ends = np.nonzero(diff == -1)
+    return np.stack([rows, starts, ends], axis=1)
+
+
+def _long_runs(mask, min_len):
+    """各行で min_len 以上続く True だけを残したマスク（累積和で長さ min_len の窓がすべて True かを見る）"""
+    h, w = mask.shape
+    if w < min_len:
+        return np.zeros_like(mask)
+    cs = np.zeros((h, w + 1), dtype=np.int32)
+    np.cumsum(mask, axis=1, out=cs[:, 1:])
+    full = (cs[:, min_len:] - cs[:, :-min_len]) == min_len  # full[:, i]: i から min_len 画素がすべてインク
+    # 窓の開始位置から min_len 画素ぶん広げ直す（ここも累積和で）
+    marks = np.zeros((h, w + 1), dtype=np.int32)
+    marks[:, :w - min_len + 1] += full
+    marks[:, min_len:] -= full
+    return np.cumsum(marks[:, :w], axis=1) > 0
+
+
+def _segments(mask, min_len):
+    """
+    長い線を線分 (位置, 開始, 終了) のリストにまとめる。
+    太い線で隣り合う行に同じ範囲の線分があれば1本にし、位置はその中央にする
+    """
+    runs = _runs(_long_runs(mask, min_len))
+    merged, active, current = [], [], None  # [最初の行, 最後の行, 開始, 終了]
+    for row, start, end in runs[np.lexsort((runs[:, 1], runs[:, 0]))] if len(runs) else []:
+        if row != current:
+            active = [seg for seg in active if seg[1] >= row - 1]
+            current = row
+        for seg in active:
+            if start < seg[3] and end > seg[2]:
+                seg[1] = row
+                seg[2], seg[3] = min(seg[2], start), max(seg[3], end)
+                break
+        else:
+            seg = [row, row, start, end]
+            merged.append(seg)
+            active.append(seg)
+    return np.array([((a + b) / 2, s, e) for a, b, s, e in merged], dtype=np.float32).reshape(-1, 3)
+
+
+def ink_mask(gray, contrast=INK_CONTRAST):
+    """地の色より contrast 以上暗い画素を、上下左右に1画素太らせたマスク（途切れた細い線をつなぐ）"""
+    ink = gray < int(np.median(gray)) - contrast
+    grown = ink.copy()
+    grown[1:, :] |= ink[:-1, :]
+    grown[:-1, :] |= ink[1:, :]
+    grown[:, 1:] |= ink[:, :-1]
+    grown[:, :-1] |= ink[:, 1:]
+    return grown
+
+
+def detect_lines(gray, dpi=DETECT_DPI, min_line_pt=MIN_LINE_PT):
+    """(横線 [(y, x0, x1)], 縦線 [(x, y0, y1)])（画素単位）"""
+    ink = ink_mask(gray)
+    min_len = max(2, int(min_line_pt * dpi / 72))
+    horizontal = _segments(ink, min_len)
+    vertical = _segments(ink.T, min_len)
+    return horizontal, vertical
+
+
+def boxes_from_lines(horizontal, vertical, min_size, tol=TOLERANCE_PX):
+    """横線・縦線で四方を囲まれた、入れ子でない一番小さい矩形 [(x0, y0, x1, y1)]（画素単位）"""
+    if len(horizontal) < 2 or len(vertical) < 2:
+        return []
+    hy, hx0, hx1 = horizontal[:, 0:1], horizontal[:, 1:2], horizontal[:, 2:3]
+    vx, vy0, vy1 = vertical[:, 0], vertical[:, 1], vertical[:, 2]
+    # meets[i, k]: 横線 i と縦線 k が交わる（端が少し届いていなくても可）
+    meets = (vx >= hx0 - tol) & (vx <= hx1 + tol) & (hy >= vy0 - tol) & (hy <= vy1 + tol)
+    v_order = np.argsort(vx)
+    h_order = np.argsort(horizontal[:, 0])
+    boxes = set()
+    for i, k in zip(*np.nonzero(meets)):
+        top, left = horizontal[i, 0], vx[k]
+        rights = v_order[((vx >= left + min_size) & meets[i])[v_order]]
+        bottoms = h_order[((horizontal[:, 0] >= top + min_size) & meets[:, k])[h_order]]
+        if not len(rights) or not len(bottoms):
+            continue
+        closed = meets[np.ix_(bottoms, rights)]  # 行: 下の線（上から）、列: 右の線（左から）
+        cols = closed.any(axis=0)
+        if not cols.any():
+            continue
+        c = int(np.argmax(cols))
+        r = int(np.argmax(closed[:, c]))
+        boxes.add((float(left), float(top), float(vx[rights[c]]), float(horizontal[bottoms[r], 0])))
+    return sorted(boxes, key=lambda b: (b[1], b[0]))
+
+
+def _dedupe(boxes, tol):
+    kept = []
+    for b in boxes:
+        if not any(all(abs(p - q) <= tol for p, q in zip(b, k)) for k in kept):
+            kept.append(b)
+    return kept
+
+
+def detect_boxes(page, dpi=DETECT_DPI, min_box_pt=MIN_BOX_PT):
+    """ページ上の枠を [x0, y0, x1, y1]（pt）のリストで返す（上から、同じ高さなら左から）"""
+    gray = render_gray(page, dpi=dpi)
+    horizontal, vertical = detect_lines(gray, dpi)
+    scale = 72 / dpi
+    boxes = boxes_from_lines(horizontal, vertical, min_box_pt / scale)
+    boxes = _dedupe([tuple(round(v * scale, 1) for v in b) for b in boxes], tol=2)
+    return [list(b) for b in boxes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="答案用紙の罫線で囲まれた枠を検出する")
+    parser.add_argument("pdf")
+    parser.add_argument("--page", type=int, default=1, help="ページ番号（1から）")
+    parser.add_argument("--overlay", default=None, help="枠を描いた画像（PNG）の保存先")
+    args = parser.parse_args()
+
+    with fitz.open(args.pdf) as doc:
+        page = doc[args.page - 1]
+        boxes = detect_boxes(page)
+        print(f"🔲 {len(boxes)}個の枠（p{args.page}）")
+        for k, b in enumerate(boxes, 1):
+            print(f"   {k:3d}: [{args.page - 1}, {round(b[0])}, {round(b[1])}, {round(b[2])}, {round(b[3])}]")
+        if args.overlay:
+            for b in boxes:
+                page.draw_rect(fitz.Rect(b) + (page.rect.x0, page.rect.y0, page.rect.x0, page.rect.y0),
+                               color=(1, 0, 0), width=1)
+            page.get_pixmap(dpi=DETECT_DPI).save(args.overlay)
+            print(f"🖼️ {args.overlay} に保存しました")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
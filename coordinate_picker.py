@@ -5,6 +5,11 @@ import fitz
 from PIL import Image, ImageTk
 import json
 import os
+from collections import OrderedDict
+try:
+    import box_detector  # 枠の自動検出（numpy が必要。なければ手でドラッグするだけ）
+except ImportError:
+    box_detector = None
 
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
@@ -26,6 +31,13 @@ TEXT_3     = "#64748b"
 BORDER     = "#2a3050"
 FONT_JP    = "Yu Gothic UI"
 
+# 表示倍率（画面に合わせた倍率に対する比）。Ctrl+ホイールで切り替える
+ZOOM_STEPS = (1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 6.0, 8.0)
+PYRAMID_LEVELS = (1.0, 2.0)  # ページ全体を描画してキャッシュしておく倍率。これ以下は縮小して使う
+TILE_SIZE = 512              # これより大きい倍率は、見えている部分だけこの大きさのタイルで描画する
+CACHE_IMAGES = 12
+CACHE_TILES = 200
+
 
 def jp(size=12, weight="normal"):
     return ctk.CTkFont(family=FONT_JP, size=size, weight=weight)
@@ -166,6 +178,74 @@ class SetupDialog:
         self.root.quit()
 
 
+# ============================================================
+# ページ画像のキャッシュ
+# ============================================================
+class PageRenderer:
+    """
+    ページ画像のピラミッド（PYRAMID_LEVELS の倍率でページ全体を描画したもの）と、
+    高倍率用のタイルを LRU でキャッシュする。ページの行き来や拡大・縮小で get_pixmap をやり直さない。
+    """
+    def __init__(self, doc):
+        self.doc = doc
+        self._levels = OrderedDict()  # (ページ, 倍率) -> PIL.Image
+        self._photos = OrderedDict()  # (ページ, 倍率) -> PhotoImage（ページ全体）
+        self._tiles = OrderedDict()   # (ページ, 倍率, tx, ty) -> PhotoImage
+
+    @staticmethod
+    def _put(cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+        return value
+
+    @staticmethod
+    def _to_image(pix):
+        return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+    def _level(self, page_idx, zoom):
+        key = (page_idx, round(zoom, 4))
+        img = self._levels.get(key)
+        if img is None:
+            pix = self.doc[page_idx].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            img = self._put(self._levels, key, self._to_image(pix), CACHE_IMAGES)
+        else:
+            self._levels.move_to_end(key)
+        return img
+
+    def page_photo(self, page_idx, fit_zoom, step):
+        """ページ全体の画像（倍率 fit_zoom × step）。ピラミッドの1つ上の段を縮小して作る"""
+        key = (page_idx, round(fit_zoom, 4), step)
+        photo = self._photos.get(key)
+        if photo is not None:
+            self._photos.move_to_end(key)
+            return photo
+        level = next((lv for lv in PYRAMID_LEVELS if lv >= step), PYRAMID_LEVELS[-1])
+        img = self._level(page_idx, fit_zoom * level)
+        if level != step:
+            page = self.doc[page_idx]
+            size = (max(1, round(page.rect.width * fit_zoom * step)), max(1, round(page.rect.height * fit_zoom * step)))
+            img = img.resize(size, Image.BILINEAR)
+        return self._put(self._photos, key, ImageTk.PhotoImage(img), CACHE_IMAGES)
+
+    def tile(self, page_idx, zoom, tx, ty):
+        """倍率 zoom で描画したページの (tx, ty) 番目のタイル。ページの外なら None"""
+        key = (page_idx, round(zoom, 4), tx, ty)
+        photo = self._tiles.get(key)
+        if photo is not None:
+            self._tiles.move_to_end(key)
+            return photo
+        page = self.doc[page_idx]
+        r = page.rect
+        clip = fitz.Rect(r.x0 + tx * TILE_SIZE / zoom, r.y0 + ty * TILE_SIZE / zoom,
+                         r.x0 + (tx + 1) * TILE_SIZE / zoom, r.y0 + (ty + 1) * TILE_SIZE / zoom) & r
+        if clip.is_empty:
+            return None
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+        return self._put(self._tiles, key, ImageTk.PhotoImage(self._to_image(pix)), CACHE_TILES)
+
+
 # ============================================================
 # 座標取得ウィンドウ
 # ============================================================
@@ -187,9 +267,15 @@ class CoordinatePicker:
             pass
 
         self.pdf_doc = None
+        self.renderer = None
         self.current_page_idx = 0
         self.img_tk = None
+        self.fit_zoom = 1.0
+        self.zoom_step = 0
         self.zoom_factor = 1.0
+        self.tile_ids = {}
+        self.proposals = {}  # ページ -> 検出した枠 [[x0, y0, x1, y1], ...]（pt）
+        self.suggested = None
         self.offset_x = 0
         self.offset_y = 0
         self.rect_id = None
@@ -261,10 +347,10 @@ class CoordinatePicker:
         self.canvas = tk.Canvas(main_frame, cursor="cross", bg="#1a1f2e", highlightthickness=0)
         self.canvas.grid(row=0, column=0, sticky="nsew")
 
-        vbar = tk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.canvas.yview,
+        vbar = tk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self._yview,
                             bg=BG_CARD, troughcolor=BG_DARK)
         vbar.grid(row=0, column=1, sticky="ns")
-        hbar = tk.Scrollbar(main_frame, orient=tk.HORIZONTAL, command=self.canvas.xview,
+        hbar = tk.Scrollbar(main_frame, orient=tk.HORIZONTAL, command=self._xview,
                             bg=BG_CARD, troughcolor=BG_DARK)
         hbar.grid(row=1, column=0, sticky="ew")
         self.canvas.config(xscrollcommand=hbar.set, yscrollcommand=vbar.set)
@@ -286,11 +372,25 @@ class CoordinatePicker:
         )
         self.page_label.pack(side="left", padx=20)
         self._nav_button(nav_center, "次のページ  ▶", self._next_page).pack(side="left", padx=10)
+        if box_detector is not None:
+            tk.Label(
+                nav_bar, text="枠をクリックで登録 / Enter: 黄色の候補を採用 / Tab: 次の候補", bg=BG_CARD,
+                fg=TEXT_3, font=(FONT_JP, 11), anchor="w"
+            ).pack(side="left", padx=20)
 
         # バインド
         self.canvas.bind("<ButtonPress-1>", self._on_press)
         self.canvas.bind("<B1-Motion>", self._on_drag)
         self.canvas.bind("<ButtonRelease-1>", self._on_release)
+        # Ctrl+ホイールで拡大・縮小（カーソル位置を中心に）、ホイールで上下・Shift+ホイールで左右、中ボタンのドラッグで移動
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", self._on_wheel)
+        self.canvas.bind("<Button-5>", self._on_wheel)
+        self.canvas.bind("<ButtonPress-2>", lambda e: self.canvas.scan_mark(e.x, e.y))
+        self.canvas.bind("<B2-Motion>", self._on_pan)
+        self.canvas.bind("<Configure>", lambda e: self._draw_tiles())
+        self.root.bind("<Return>", lambda e: self._accept_suggestion())
+        self.root.bind("<Tab>", lambda e: self._next_suggestion() or "break")
 
         self._update_guide()
 
@@ -334,10 +434,13 @@ class CoordinatePicker:
             self.root.destroy()
             return
         self.pdf_doc = fitz.open(path)
+        self.pdf_path = path
+        self.renderer = PageRenderer(self.pdf_doc)
         self.current_page_idx = 0
         self._render_page()
 
     def _render_page(self):
+        """ページを切り替えたとき。画面に合わせた倍率に戻して描画する"""
         if not self.pdf_doc:
             return
         page = self.pdf_doc[self.current_page_idx]
@@ -349,19 +452,173 @@ class CoordinatePicker:
 
         zoom_x = (cw * 0.92) / page.rect.width
         zoom_y = (ch * 0.92) / page.rect.height
-        self.zoom_factor = min(zoom_x, zoom_y)
-
-        mat = fitz.Matrix(self.zoom_factor, self.zoom_factor)
-        pix = page.get_pixmap(matrix=mat)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        self.img_tk = ImageTk.PhotoImage(img)
+        self.fit_zoom = min(zoom_x, zoom_y)
+        self.zoom_step = 0
+        self.suggested = None
+        self._draw()
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+
+    def _draw(self):
+        """今の倍率でページを描き直す（画像はキャッシュから）"""
+        page = self.pdf_doc[self.current_page_idx]
+        step = ZOOM_STEPS[self.zoom_step]
+        self.zoom_factor = self.fit_zoom * step
+        cw = self.canvas.winfo_width() or 1200
+        ch = self.canvas.winfo_height() or 800
+        pw, ph = page.rect.width * self.zoom_factor, page.rect.height * self.zoom_factor
 
         self.canvas.delete("all")
-        self.offset_x = max(0, (cw - pix.width) / 2)
-        self.offset_y = max(0, (ch - pix.height) / 2)
-        self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.NW, image=self.img_tk)
-        self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
+        self.tile_ids = {}
         self.rect_id = None
+        self.offset_x = max(0, (cw - pw) / 2)
+        self.offset_y = max(0, (ch - ph) / 2)
+        self.canvas.config(scrollregion=(0, 0, max(cw, pw), max(ch, ph)))
+        if step <= PYRAMID_LEVELS[-1]:
+            self.img_tk = self.renderer.page_photo(self.current_page_idx, self.fit_zoom, step)
+            self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.NW, image=self.img_tk, tags="page")
+        else:
+            self.img_tk = None
+            self._draw_tiles()
+        self._draw_proposals()
+
+    def _draw_tiles(self):
+        """高倍率のとき、見えている範囲でまだ置いていないタイルだけ描画する"""
+        if not self.pdf_doc or ZOOM_STEPS[self.zoom_step] <= PYRAMID_LEVELS[-1]:
+            return
+        x0 = self.canvas.canvasx(0) - self.offset_x
+        y0 = self.canvas.canvasy(0) - self.offset_y
+        x1 = x0 + self.canvas.winfo_width()
+        y1 = y0 + self.canvas.winfo_height()
+        for ty in range(max(0, int(y0 // TILE_SIZE)), int(y1 // TILE_SIZE) + 1):
+            for tx in range(max(0, int(x0 // TILE_SIZE)), int(x1 // TILE_SIZE) + 1):
+                if (tx, ty) in self.tile_ids:
+                    continue
+                photo = self.renderer.tile(self.current_page_idx, self.zoom_factor, tx, ty)
+                self.tile_ids[(tx, ty)] = photo and self.canvas.create_image(
+                    self.offset_x + tx * TILE_SIZE, self.offset_y + ty * TILE_SIZE,
+                    anchor=tk.NW, image=photo, tags="page")
+        self.canvas.tag_lower("page")
+
+    # ── 枠の候補 ──
+
+    def _page_proposals(self):
+        if box_detector is None or not self.pdf_doc:
+            return []
+        boxes = self.proposals.get(self.current_page_idx)
+        if boxes is None:
+            try:
+                boxes = box_detector.detect_boxes(self.pdf_doc[self.current_page_idx])
+            except Exception as e:
+                print(f"⚠️ 枠の検出に失敗しました: {e}")
+                boxes = []
+            self.proposals[self.current_page_idx] = boxes
+        return boxes
+
+    def _used_boxes(self):
+        """このページで登録済みの座標（x0, y0, x1, y1）"""
+        used = []
+
+        def walk(v):
+            if isinstance(v, list) and len(v) == 5:
+                if v[0] == self.current_page_idx:
+                    used.append(tuple(v[1:]))
+            elif isinstance(v, dict):
+                for x in v.values():
+                    walk(x)
+        walk(self.coord_data)
+        return used
+
+    @staticmethod
+    def _same_box(box, used):
+        return any(all(abs(a - b) <= 2 for a, b in zip(box, u)) for u in used)
+
+    def _free_proposals(self):
+        used = self._used_boxes()
+        return [i for i, b in enumerate(self._page_proposals()) if not self._same_box(b, used)]
+
+    def _suggest(self):
+        """次のステップの候補：最後に登録した枠より後ろ（上から・左から）で、まだ使っていない最初の枠"""
+        free = self._free_proposals()
+        if not free or self.step_index >= len(self.steps):
+            return None
+        if self.suggested in free:
+            return self.suggested
+        boxes = self._page_proposals()
+        last = max(((u[1], u[0]) for u in self._used_boxes()), default=None)
+        after = [i for i in free if last is None or (boxes[i][1], boxes[i][0]) > last]
+        return (after or free)[0]
+
+    def _next_suggestion(self):
+        free = self._free_proposals()
+        if free:
+            later = [i for i in free if self.suggested is None or i > self.suggested]
+            self.suggested = (later or free)[0]
+            self._draw_proposals()
+
+    def _draw_proposals(self):
+        self.canvas.delete("proposal")
+        boxes = self._page_proposals()
+        if not boxes:
+            return
+        self.suggested = self._suggest()
+        used = self._used_boxes()
+        z = self.zoom_factor
+        for i, (x0, y0, x1, y1) in enumerate(boxes):
+            if i == self.suggested:
+                style = dict(outline="#facc15", width=3)
+            elif self._same_box((x0, y0, x1, y1), used):
+                style = dict(outline="#16a34a", width=2)
+            else:
+                style = dict(outline="#60a5fa", width=1, dash=(3, 3))
+            self.canvas.create_rectangle(self.offset_x + x0 * z, self.offset_y + y0 * z,
+                                         self.offset_x + x1 * z, self.offset_y + y1 * z,
+                                         tags="proposal", **style)
+
+    def _accept_suggestion(self):
+        boxes = self._page_proposals()
+        if self.step_index < len(self.steps) and self.suggested is not None and self.suggested < len(boxes):
+            self._accept_box(boxes[self.suggested])
+
+    def _accept_box(self, box):
+        self._accept([self.current_page_idx] + [round(v) for v in box])
+
+    def _xview(self, *args):
+        self.canvas.xview(*args)
+        self._draw_tiles()
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._draw_tiles()
+
+    def _on_pan(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self._draw_tiles()
+
+    def _on_wheel(self, event):
+        if not self.pdf_doc:
+            return
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        if event.state & 0x0004:  # Ctrl
+            self._zoom_at(event, 1 if up else -1)
+        elif event.state & 0x0001:  # Shift
+            self._xview("scroll", -3 if up else 3, "units")
+        else:
+            self._yview("scroll", -3 if up else 3, "units")
+
+    def _zoom_at(self, event, direction):
+        """カーソルの下のPDF上の点が動かないように倍率を1段変える"""
+        new_step = min(max(self.zoom_step + direction, 0), len(ZOOM_STEPS) - 1)
+        if new_step == self.zoom_step:
+            return
+        px = (self.canvas.canvasx(event.x) - self.offset_x) / self.zoom_factor
+        py = (self.canvas.canvasy(event.y) - self.offset_y) / self.zoom_factor
+        self.zoom_step = new_step
+        self._draw()
+        _, _, sw, sh = (float(v) for v in str(self.canvas.cget("scrollregion")).split())
+        self.canvas.xview_moveto(max(0, (self.offset_x + px * self.zoom_factor - event.x) / sw))
+        self.canvas.yview_moveto(max(0, (self.offset_y + py * self.zoom_factor - event.y) / sh))
+        self._draw_tiles()
 
     def _prev_page(self):
         if self.current_page_idx > 0:
@@ -394,16 +651,31 @@ class CoordinatePicker:
         
         end_x = self.canvas.canvasx(event.x)
         end_y = self.canvas.canvasy(event.y)
+        if abs(end_x - self.start_x) < 4 and abs(end_y - self.start_y) < 4:
+            # ドラッグせずにクリックしたときは、その点を含む一番小さい候補の枠を使う
+            self.canvas.delete(self.rect_id)
+            self.rect_id = None
+            px = (end_x - self.offset_x) / self.zoom_factor
+            py = (end_y - self.offset_y) / self.zoom_factor
+            hits = [b for b in self._page_proposals() if b[0] <= px <= b[2] and b[1] <= py <= b[3]]
+            if hits:
+                self._accept_box(min(hits, key=lambda b: (b[2] - b[0]) * (b[3] - b[1])))
+            return
         x0 = max(0, (min(self.start_x, end_x) - self.offset_x) / self.zoom_factor)
         y0 = max(0, (min(self.start_y, end_y) - self.offset_y) / self.zoom_factor)
         x1 = max(0, (max(self.start_x, end_x) - self.offset_x) / self.zoom_factor)
         y1 = max(0, (max(self.start_y, end_y) - self.offset_y) / self.zoom_factor)
 
         coord = [self.current_page_idx, round(x0), round(y0), round(x1), round(y1)]
+        self._accept(coord)
+
+    def _accept(self, coord):
         _, key_path = self.steps[self.step_index]
         self._store(key_path, coord)
         self.step_index += 1
+        self.suggested = None
         self._update_guide()
+        self._draw_proposals()
         if self.step_index >= len(self.steps):
             self._save_json()
 
@@ -426,24 +698,47 @@ class CoordinatePicker:
                 del qs[q_key][field]
         else:
             self.coord_data.pop(key_path, None)
+        self.suggested = None
         self._update_guide()
+        self._draw_proposals()
 
     def _skip_step(self):
         if self.step_index >= len(self.steps):
             return
         self.step_index += 1
         self._update_guide()
+        self._draw_proposals()
         if self.step_index >= len(self.steps):
             self._save_json()
 
     def _save_json(self):
         os.makedirs(COORD_DB_DIR, exist_ok=True)
         out_path = os.path.join(COORD_DB_DIR, f"{self.master_id}.json")
+        self._save_reference()
         with open(out_path, "w", encoding="utf-8") as f:
             json.dump(self.coord_data, f, ensure_ascii=False, indent=2)
         messagebox.showinfo("保存完了", f"座標データを保存しました:\n{out_path}")
         self.root.destroy()
 
+    def _save_reference(self):
+        # 参照PDFとして残す（master_index.py のマスターID判定と scan_registration.py の位置合わせで使う）
+        if not self.pdf_doc:
+            return
+        rel = f"references/{self.master_id}.pdf"
+        path = os.path.join(COORD_DB_DIR, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        ref = fitz.open()
+        try:
+            ref.insert_pdf(self.pdf_doc)
+            ref.save(path, garbage=3, deflate=True)
+        except Exception as e:
+            print(f"⚠️ 参照PDFを保存できませんでした: {e}")
+            return
+        finally:
+            ref.close()
+        self.coord_data["master_id"] = self.master_id
+        self.coord_data["reference_pdf"] = rel
+
 
 # ============================================================
 # エントリーポイント
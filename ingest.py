@@ -0,0 +1,177 @@
+"""
+答案PDFの取り込み（ZIP・単体PDF）
+ZIPのメンバーを一時フォルダに展開せず、アーカイブから直接ストリームで読みながら
+SHA-256を計算して inputs/ に書き出す。
+
+- inputs/ にある・done/ アーカイブ（archive_index.py）にあるのとバイト単位で同じPDFは取り込まない
+  （同じスキャンを2回アップロードしても二重に処理しない）
+- ZIP内の別フォルダに同じファイル名がある場合などは「名前_2.pdf」のように名前を変えて両方取り込む
+- iter_zip() はメンバーのbytesも一緒に返すので、Step1がディスクから読み直さずにそのまま処理できる
+
+使い方:
+    python ingest.py scans.zip
+    python ingest.py scan1.pdf scan2.pdf
+"""
+import os
+import sys
+import json
+import glob
+import hashlib
+import zipfile
+import argparse
+
+from archive_index import ArchiveIndex, sha256_file
+
+CHUNK = 1024 * 1024
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+class IngestResult:
+    """取り込み1件の結果。status は added / duplicate"""
+    __slots__ = ("source", "name", "path", "sha256", "status", "duplicate_of", "data")
+
+    def __init__(self, source, name, path, sha256, status, duplicate_of=None, data=None):
+        self.source = source
+        self.name = name
+        self.path = path
+        self.sha256 = sha256
+        self.status = status
+        self.duplicate_of = duplicate_of
+        self.data = data
+
+    @property
+    def renamed(self):
+        return self.status == "added" and self.name != os.path.basename(self.source)
+
+
+class Ingestor:
+    def __init__(self, input_dir, archive_index=None):
+        self.input_dir = input_dir
+        self.archive_index = archive_index
+        os.makedirs(input_dir, exist_ok=True)
+        self._known = None  # sha256 -> 既存ファイルの名前（inputs/ 分）
+
+    def _known_hashes(self):
+        if self._known is None:
+            self._known = {}
+            for path in glob.glob(os.path.join(self.input_dir, "*.pdf")):
+                try:
+                    self._known.setdefault(sha256_file(path), os.path.basename(path))
+                except OSError:
+                    pass
+        return self._known
+
+    def find_duplicate(self, sha):
+        """同じ内容のPDFの場所（inputs/xxx.pdf や done/YYYYMMDD/xxx.pdf）。なければ None"""
+        name = self._known_hashes().get(sha)
+        if name:
+            return f"inputs/{name}"
+        if self.archive_index is not None:
+            row = self.archive_index.find_by_hash(sha)
+            if row:
+                return f"done/{row['folder']}/{row['name']}"
+        return None
+
+    def _free_name(self, name):
+        """inputs/ で使われていない名前（衝突したら 名前_2.pdf, 名前_3.pdf, ...）"""
+        stem, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while os.path.exists(os.path.join(self.input_dir, candidate)):
+            n += 1
+            candidate = f"{stem}_{n}{ext}"
+        return candidate
+
+    def _write(self, source, name, stream, keep_bytes=False):
+        """stream を読みながらハッシュを計算して inputs/ に書き出す"""
+        h = hashlib.sha256()
+        part = os.path.join(self.input_dir, f".{name}.part")
+        buf = [] if keep_bytes else None
+        try:
+            with open(part, "wb") as out:
+                for chunk in iter(lambda: stream.read(CHUNK), b""):
+                    h.update(chunk)
+                    out.write(chunk)
+                    if buf is not None:
+                        buf.append(chunk)
+            sha = h.hexdigest()
+            dup = self.find_duplicate(sha)
+            if dup:
+                os.remove(part)
+                return IngestResult(source, name, None, sha, "duplicate", duplicate_of=dup)
+            final = self._free_name(name)
+            os.replace(part, os.path.join(self.input_dir, final))
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        self._known_hashes()[sha] = final
+        return IngestResult(source, final, os.path.join(self.input_dir, final), sha, "added",
+                            data=b"".join(buf) if buf is not None else None)
+
+    def iter_zip(self, zip_path, keep_bytes=False):
+        """ZIP内のPDFを1件ずつ取り込み、IngestResult を順に返す"""
+        with zipfile.ZipFile(zip_path) as z:
+            for info in self.zip_members(z):
+                with z.open(info) as stream:
+                    yield self._write(info.filename, os.path.basename(info.filename), stream, keep_bytes)
+
+    @staticmethod
+    def zip_members(z):
+        return [i for i in z.infolist()
+                if not i.is_dir() and i.filename.lower().endswith(".pdf")
+                and not i.filename.startswith("__MACOSX/") and not os.path.basename(i.filename).startswith("._")]
+
+    def ingest_zip(self, zip_path):
+        return list(self.iter_zip(zip_path))
+
+    def ingest_file(self, pdf_path):
+        with open(pdf_path, "rb") as stream:
+            return self._write(pdf_path, os.path.basename(pdf_path), stream)
+
+    def ingest_stream(self, name, stream):
+        """read() できるストリーム（HTTPのアップロードなど）からPDFを1件取り込む"""
+        return self._write(name, os.path.basename(name), stream)
+
+
+def summarize(results):
+    """(取り込み件数, 重複でスキップした件数, 名前を変えた件数)"""
+    added = [r for r in results if r.status == "added"]
+    return len(added), len(results) - len(added), sum(r.renamed for r in added)
+
+
+def _config():
+    cfg = {"input_dir": "./inputs", "done_dir": "./done"}
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    except Exception:
+        pass
+    return cfg
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ZIP・PDFを重複チェックしながら inputs/ に取り込む")
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    cfg = _config()
+    index = ArchiveIndex(cfg["done_dir"]) if os.path.isdir(cfg["done_dir"]) else None
+    if index:
+        index.refresh()
+        index.backfill_hashes()
+    ingestor = Ingestor(cfg["input_dir"], index)
+    results = []
+    for path in args.paths:
+        results += ingestor.ingest_zip(path) if path.lower().endswith(".zip") else [ingestor.ingest_file(path)]
+    for r in results:
+        if r.status == "duplicate":
+            print(f"⏭️ {r.source} は {r.duplicate_of} と同じ内容のためスキップ")
+        elif r.renamed:
+            print(f"📄 {r.source} → {r.name}（同名ファイルがあるため改名）")
+    added, dups, renamed = summarize(results)
+    print(f"📦 取り込み {added}件, 重複スキップ {dups}件, 改名 {renamed}件")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
@@ -0,0 +1,650 @@
+"""
+分散ジョブキュー（複数ワーカーでの並列処理）
+模試1学年分のように1台のAPI上限・CPUでは追いつかない量を、複数のワーカープロセス・PCで分担する。
+Step1（テキスト抽出）・Step2/3（採点・印字）の答案1件ずつを「タスク」としてキューに積み、
+各ワーカーが取り出して処理し、結果をキューに書き戻す。まとめ役（コーディネーター）が
+結果を step1_texts/ と step3_final/ に書き出し、採点結果ストアに記録する。
+
+- キューの実装は SQLite（SqliteTaskQueue）。TaskQueue を実装すれば別の実装（Redisなど）に差し替えられる
+- 入力PDF・Step1テキスト・印字済みPDFはDBに入れるので、ワーカーは inputs/ を共有しなくてよい
+  （masters/・coord_db/・rubric_txts/ と config.json は各ワーカーの手元のものを使う）
+- タスクは「リース」（期限付きの貸し出し）で取り出す。ワーカーが落ちて期限が切れたタスクは別のワーカーが拾う
+- 失敗したタスクは間隔を空けて max_attempts 回まで再実行する
+- 結果の書き込みは冪等（同じタスクの結果は最初の1件だけを採用する）。
+  期限切れ後に遅れて終わったワーカーの結果が二重に反映されることはない
+
+使い方:
+    python job_queue.py run-local --workers 4                # inputs/ の全件を4プロセスで Step1→Step2/3
+    python job_queue.py submit --kind step1 --batch mock_0601 # inputs/ の全件をキューに積む
+    python job_queue.py worker --id pc2-a                     # 別のPC・プロセスでワーカーを起動
+    python job_queue.py merge --batch mock_0601 --chain       # 結果を書き出し、Step1が終わった分をStep2/3に回す
+    python job_queue.py status --batch mock_0601
+
+DBの場所は config.json の "job_queue_db"（既定 ./job_queue.db）か --db で指定する。
+既定の WAL モードは共有メモリを使うので、1台のPCの中（複数プロセス）でしか使えない。
+複数のPCで使う場合は全員が同じDBファイルを開ける共有フォルダに置き、config.json の "job_queue_shared": true
+（UNCパス \\\\server\\... なら自動）で従来のロールバックジャーナルにする。それでもファイルロックが
+当てにならない共有（NFSなど）では壊れることがあるので、その場合は1台のPCで run-local を使う。
+"""
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import profiling
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+DEFAULT_DB_PATH = "./job_queue.db"
+KINDS = ("step1", "step23")
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 10  # 再実行までの待ち時間（10秒, 20秒, 40秒, ...）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id            TEXT PRIMARY KEY,
+    batch         TEXT NOT NULL,
+    kind          TEXT NOT NULL,
+    name          TEXT NOT NULL,
+    pdf           BLOB,
+    text          TEXT,
+    status        TEXT NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL,
+    available_at  REAL NOT NULL,
+    lease_owner   TEXT,
+    lease_until   REAL,
+    last_error    TEXT,
+    created_at    TEXT NOT NULL,
+    updated_at    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_ready ON tasks(kind, status, available_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_batch ON tasks(batch, kind);
+CREATE TABLE IF NOT EXISTS task_results (
+    task_id     TEXT PRIMARY KEY,
+    batch       TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    text        TEXT,
+    pdf         BLOB,
+    meta        TEXT NOT NULL,
+    worker      TEXT,
+    merged_at   TEXT,
+    created_at  TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_results_merge ON task_results(batch, merged_at);
+"""
+
+
+def default_db_path() -> str:
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f).get("job_queue_db", DEFAULT_DB_PATH)
+    except Exception:
+        return DEFAULT_DB_PATH
+
+
+def is_shared_path(path) -> bool:
+    """複数のPCから開くDBか（config.json の "job_queue_shared"、または UNC パス）"""
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            if json.load(f).get("job_queue_shared"):
+                return True
+    except Exception:
+        pass
+    return path.startswith("\\\\") or path.startswith("//")
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _now_iso():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class RetryableError(Exception):
+    """再実行すれば成功する見込みのある失敗（API障害・読み取りエラーなど）"""
+
+
+class Task:
+    __slots__ = ("id", "batch", "kind", "name", "pdf", "text", "attempts", "max_attempts")
+
+    def __init__(self, row):
+        for key in self.__slots__:
+            setattr(self, key, row[key])
+
+    @property
+    def last_attempt(self):
+        return self.attempts >= self.max_attempts
+
+
+class TaskQueue:
+    """キューの操作。SqliteTaskQueue 以外の実装もこのメソッドをそろえる"""
+
+    def submit(self, batch, kind, name, pdf=None, text=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        raise NotImplementedError
+
+    def lease(self, worker_id, kinds=KINDS, lease_seconds=DEFAULT_LEASE_SECONDS):
+        raise NotImplementedError
+
+    def heartbeat(self, task_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        raise NotImplementedError
+
+    def complete(self, task, worker_id, status, text=None, pdf=None, meta=None):
+        raise NotImplementedError
+
+    def fail(self, task, worker_id, error):
+        raise NotImplementedError
+
+    def unmerged(self, batch=None):
+        raise NotImplementedError
+
+    def mark_merged(self, task_id):
+        raise NotImplementedError
+
+    def counts(self, batch=None):
+        raise NotImplementedError
+
+
+class SqliteTaskQueue(TaskQueue):
+    def __init__(self, path=None, shared=None):
+        self.path = path or default_db_path()
+        self.shared = is_shared_path(self.path) if shared is None else shared
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # リースの取り合いは BEGIN IMMEDIATE で直列化するので、自動トランザクションは使わない
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if self.shared:
+            # WAL は共有メモリ（-shm）を使うので、ネットワーク越しのPCどうしでは正しく排他できない
+            self._conn.execute("PRAGMA journal_mode=DELETE")
+            self._conn.execute("PRAGMA synchronous=FULL")
+        else:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _tx(self, fn):
+        """書き込みロックを取ってから fn(conn) を実行する"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    # ── 投入 ──
+
+    def submit(self, batch, kind, name, pdf=None, text=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        タスクを1件積み、タスクIDを返す。同じ batch・kind・name のタスクが既にあれば何もしない
+        （投入を何度やり直しても二重に処理しない）
+        """
+        task_id = f"{batch}/{kind}/{name}"
+        now = _now_iso()
+        self._tx(lambda c: c.execute(
+            "INSERT OR IGNORE INTO tasks (id, batch, kind, name, pdf, text, max_attempts, available_at,"
+            " created_at, updated_at) VALUES (?,?,?,?,?,?,?,?,?,?)",
+            (task_id, batch, kind, name, pdf, text, max_attempts, time.time(), now, now)))
+        return task_id
+
+    # ── ワーカー側 ──
+
+    def lease(self, worker_id, kinds=KINDS, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """実行できるタスクを1件借りる。なければ None"""
+        kinds = list(kinds)
+        marks = ",".join("?" * len(kinds))
+
+        def take(c):
+            now = time.time()
+            # 期限切れのリースで、もう再実行できないものは失敗にする
+            c.execute("UPDATE tasks SET status = 'failed', last_error = COALESCE(last_error, 'lease expired'),"
+                      " lease_owner = NULL, updated_at = ? WHERE status = 'leased' AND lease_until < ?"
+                      " AND attempts >= max_attempts", (_now_iso(), now))
+            row = c.execute(
+                f"SELECT * FROM tasks WHERE kind IN ({marks}) AND available_at <= ?"
+                " AND (status = 'pending' OR (status = 'leased' AND lease_until < ?))"
+                " ORDER BY available_at, created_at LIMIT 1", (*kinds, now, now)).fetchone()
+            if row is None:
+                return None
+            c.execute("UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_owner = ?,"
+                      " lease_until = ?, updated_at = ? WHERE id = ?",
+                      (worker_id, now + lease_seconds, _now_iso(), row["id"]))
+            row = dict(row)
+            row["attempts"] += 1
+            return Task(row)
+        return self._tx(take)
+
+    def heartbeat(self, task_id, worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """リースを延長する。他のワーカーに取られていたら False"""
+        cur = self._tx(lambda c: c.execute(
+            "UPDATE tasks SET lease_until = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+            (time.time() + lease_seconds, task_id, worker_id)))
+        return cur.rowcount > 0
+
+    def complete(self, task, worker_id, status, text=None, pdf=None, meta=None):
+        """
+        結果を書き込む。既に同じタスクの結果があれば書き込まずに False を返す
+        （リース切れで2台が同じタスクを処理しても、採用されるのは先に終わった方だけ）
+        """
+        def write(c):
+            cur = c.execute(
+                "INSERT OR IGNORE INTO task_results (task_id, batch, kind, name, status, text, pdf, meta, worker,"
+                " created_at) VALUES (?,?,?,?,?,?,?,?,?,?)",
+                (task.id, task.batch, task.kind, task.name, status, text, pdf,
+                 json.dumps(meta or {}, ensure_ascii=False), worker_id, _now_iso()))
+            c.execute("UPDATE tasks SET status = 'done', lease_owner = NULL, lease_until = NULL, pdf = NULL,"
+                      " updated_at = ? WHERE id = ?", (_now_iso(), task.id))
+            return cur.rowcount > 0
+        return self._tx(write)
+
+    def fail(self, task, worker_id, error):
+        """失敗を記録する。回数が残っていれば待ち時間を空けて再実行、なければ failed"""
+        def write(c):
+            row = c.execute("SELECT status, attempts, max_attempts, lease_owner FROM tasks WHERE id = ?",
+                            (task.id,)).fetchone()
+            if row is None or row["status"] != "leased" or row["lease_owner"] != worker_id:
+                return False  # 期限切れで別のワーカーに渡っている
+            if row["attempts"] >= row["max_attempts"]:
+                c.execute("UPDATE tasks SET status = 'failed', last_error = ?, lease_owner = NULL, lease_until = NULL,"
+                          " updated_at = ? WHERE id = ?", (str(error), _now_iso(), task.id))
+            else:
+                delay = RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1)
+                c.execute("UPDATE tasks SET status = 'pending', last_error = ?, lease_owner = NULL, lease_until = NULL,"
+                          " available_at = ?, updated_at = ? WHERE id = ?",
+                          (str(error), time.time() + delay, _now_iso(), task.id))
+            return True
+        return self._tx(write)
+
+    # ── まとめ役側 ──
+
+    def unmerged(self, batch=None):
+        """まだ書き出していない結果のリスト（pdf は bytes）"""
+        sql = "SELECT * FROM task_results WHERE merged_at IS NULL"
+        params = ()
+        if batch:
+            sql += " AND batch = ?"
+            params = (batch,)
+        with self._lock:
+            rows = [dict(r) for r in self._conn.execute(sql + " ORDER BY created_at", params).fetchall()]
+        for row in rows:
+            row["meta"] = json.loads(row["meta"])
+        return rows
+
+    def mark_merged(self, task_id):
+        self._tx(lambda c: c.execute("UPDATE task_results SET merged_at = ?, pdf = NULL WHERE task_id = ?",
+                                     (_now_iso(), task_id)))
+
+    def counts(self, batch=None):
+        """{kind: {status: 件数}}"""
+        sql = "SELECT kind, status, COUNT(*) AS n FROM tasks"
+        params = ()
+        if batch:
+            sql += " WHERE batch = ?"
+            params = (batch,)
+        out = {}
+        with self._lock:
+            for r in self._conn.execute(sql + " GROUP BY kind, status", params):
+                out.setdefault(r["kind"], {})[r["status"]] = r["n"]
+        return out
+
+    def failures(self, batch=None):
+        sql = "SELECT batch, kind, name, attempts, last_error FROM tasks WHERE status = 'failed'"
+        params = ()
+        if batch:
+            sql += " AND batch = ?"
+            params = (batch,)
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(sql + " ORDER BY updated_at", params).fetchall()]
+
+    def pending(self, batch=None):
+        """待ち・実行中のタスク件数"""
+        sql = "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')"
+        params = ()
+        if batch:
+            sql += " AND batch = ?"
+            params = (batch,)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+
+# ============================
+# ワーカー
+# ============================
+
+class _Handlers:
+    """Stepスクリプトの関数を直接呼んでタスクを処理する（モジュール・クライアントは使い回す）"""
+    def __init__(self):
+        self._step1 = None
+        self._step23 = None
+
+    def step1(self, task):
+        if self._step1 is None:
+            import step1_mark_and_text_v2 as step1
+            import json_cache
+            ids = [f"- {d['meta']['id']}" for _, d in json_cache.load_dir(step1.MASTER_DB_DIR)
+                   if "meta" in d and "id" in d["meta"]]
+            if not ids:
+                raise RuntimeError("マスターIDが取得できませんでした（./masters/ を確認してください）")
+            self._step1 = (step1, "\n".join(ids))
+        step1, master_ids_str = self._step1
+        t0 = time.time()
+        _, text = step1.extract_text_with_ai(task.name, master_ids_str, task.pdf)
+        # 再実行するのはAPIの失敗だけ（白紙・壊れたPDFなどは何度やっても同じ）
+        if "ERROR:" in text and not task.last_attempt and step1.is_api_error(text):
+            raise RetryableError(text.strip().split("\n")[0][:200])
+        return ("error" if "ERROR:" in text else "done"), text, None, {"seconds": round(time.time() - t0, 2)}
+
+    def step23(self, task):
+        if self._step23 is None:
+            import step2_and3_combined as step23
+            self._step23 = step23
+        step23 = self._step23
+        masters = step23.load_all_masters(step23.MASTER_DB_DIR)
+        master = step23.find_matching_master(task.text, masters)
+        if not master:
+            first = task.text.strip().split("\n")[0].strip() if task.text.strip() else "(空)"
+            return "skip", None, None, {"master_id": first}
+        master_id = master["meta"]["id"]
+        t_grade = time.time()
+        data = step23.grade_answer(task.text, master, step23.load_rubric_txt(master_id))
+        grade_seconds = time.time() - t_grade
+        if "error" in data:
+            raise RetryableError(str(data["error"])[:200])
+        data["master_id"] = master_id
+        usage = data.pop("usage", {})
+        lines = task.text.strip().split("\n")
+        meta = {"master_id": master_id, "data": data, "usage": usage, "model": step23.MODEL_NAME,
+                "student_id": data.get("student_id") or (lines[1].strip() if len(lines) > 1 else None),
+                "grade_seconds": round(grade_seconds, 2)}
+        with tempfile.TemporaryDirectory(prefix="job_queue_") as tmp:
+            src = os.path.join(tmp, "in", task.name)
+            os.makedirs(os.path.dirname(src))
+            with open(src, "wb") as f:
+                f.write(task.pdf)
+            t_stamp = time.time()
+            if not step23.write_to_pdf(data, master_id, src, step23.load_coord_db(step23.COORD_DB_DIR),
+                                       output_dir=os.path.join(tmp, "out")):
+                return "error", None, None, meta  # 座標データがないのは再実行しても直らない
+            meta["stamp_seconds"] = round(time.time() - t_stamp, 2)
+            with open(os.path.join(tmp, "out", task.name), "rb") as f:
+                pdf = f.read()
+        return "done", None, pdf, meta
+
+
+def run_worker(queue, worker_id=None, kinds=KINDS, lease_seconds=DEFAULT_LEASE_SECONDS, poll=2.0,
+               idle_exit=None, stop=None):
+    """
+    キューからタスクを借りて処理し続ける。
+    idle_exit 秒タスクがなければ終了する（None なら止められるまで待つ）。
+    """
+    worker_id = worker_id or default_worker_id()
+    handlers = _Handlers()
+    stop = stop or threading.Event()
+    idle_since = time.time()
+    print(f"👷 ワーカー {worker_id} 起動（{', '.join(kinds)}）")
+    while not stop.is_set():
+        task = queue.lease(worker_id, kinds, lease_seconds)
+        if task is None:
+            if idle_exit is not None and time.time() - idle_since >= idle_exit:
+                break
+            stop.wait(poll)
+            continue
+
+        # 処理中はリースを延長し続ける
+        done = threading.Event()
+
+        def keep_alive():
+            while not done.wait(lease_seconds / 3):
+                if not queue.heartbeat(task.id, worker_id, lease_seconds):
+                    break
+        threading.Thread(target=keep_alive, daemon=True).start()
+        t0 = time.time()
+        try:
+            with profiling.profile_run(task.kind):
+                status, text, pdf, meta = getattr(handlers, task.kind)(task)
+        except Exception as e:
+            done.set()
+            queue.fail(task, worker_id, f"{type(e).__name__}: {e}")
+            retry = "" if task.last_attempt else f"（{task.attempts}/{task.max_attempts}回目・再実行します）"
+            print(f"⚠️ {task.kind} {task.name}: {e}{retry}")
+        else:
+            done.set()
+            if queue.complete(task, worker_id, status, text=text, pdf=pdf, meta=meta):
+                print(f"✅ {task.kind} {task.name}: {status}（{time.time() - t0:.1f}秒）")
+            else:
+                print(f"⏭️ {task.kind} {task.name}: 別のワーカーの結果が先に登録済み")
+        idle_since = time.time()
+    print(f"👷 ワーカー {worker_id} 終了")
+
+
+# ============================
+# まとめ役（コーディネーター）
+# ============================
+
+def _config():
+    cfg = {"input_dir": "./inputs", "text_dir": "./step1_texts", "output_dir": "./step3_final"}
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    except Exception:
+        pass
+    return cfg
+
+
+def submit_inputs(queue, batch, kind="step1", files=None, cfg=None):
+    """inputs/ のPDF（step23 なら step1_texts/ のテキストとPDFの組）をキューに積み、件数を返す"""
+    cfg = cfg or _config()
+    if files is None:
+        files = sorted(os.path.basename(p) for p in glob.glob(os.path.join(cfg["input_dir"], "*.pdf")))
+    n = 0
+    for name in files:
+        pdf_path = os.path.join(cfg["input_dir"], name)
+        if not os.path.exists(pdf_path):
+            continue
+        with open(pdf_path, "rb") as f:
+            pdf = f.read()
+        text = None
+        if kind == "step23":
+            txt_path = os.path.join(cfg["text_dir"], f"{os.path.splitext(name)[0]}_draft.txt")
+            if not os.path.exists(txt_path):
+                continue
+            with open(txt_path, "r", encoding="utf-8") as f:
+                text = f.read()
+        queue.submit(batch, kind, name, pdf=pdf, text=text)
+        n += 1
+    return n
+
+
+def merge(queue, batch=None, chain=False, cfg=None, store=None):
+    """
+    ワーカーの結果を書き出す。
+    step1 → step1_texts/<名前>_draft.txt（chain=True なら続けて step23 タスクを積む）
+    step23 → step3_final/<名前>.pdf と採点結果ストア（実行IDはバッチ名）
+    書き出した件数を {kind: 件数} で返す。
+    """
+    cfg = cfg or _config()
+    merged = {}
+    for row in queue.unmerged(batch):
+        name = row["name"]
+        base = os.path.splitext(name)[0]
+        if row["kind"] == "step1":
+            os.makedirs(cfg["text_dir"], exist_ok=True)
+            with open(os.path.join(cfg["text_dir"], f"{base}_draft.txt"), "w", encoding="utf-8") as f:
+                f.write(row["text"] or "")
+            if chain and row["status"] == "done":
+                pdf_path = os.path.join(cfg["input_dir"], name)
+                pdf = None
+                if os.path.exists(pdf_path):
+                    with open(pdf_path, "rb") as f:
+                        pdf = f.read()
+                if pdf is not None:
+                    queue.submit(row["batch"], "step23", name, pdf=pdf, text=row["text"])
+        elif row["kind"] == "step23" and row["status"] == "done":
+            os.makedirs(cfg["output_dir"], exist_ok=True)
+            tmp = os.path.join(cfg["output_dir"], f".{name}.part")
+            with open(tmp, "wb") as f:
+                f.write(row["pdf"])
+            os.replace(tmp, os.path.join(cfg["output_dir"], name))
+            if store is not None:
+                meta = row["meta"]
+                try:
+                    store.save(row["batch"], base, meta["master_id"], meta["data"], student_id=meta.get("student_id"),
+                               model=meta.get("model"), usage=meta.get("usage"),
+                               grade_seconds=meta.get("grade_seconds"), stamp_seconds=meta.get("stamp_seconds"),
+                               stamped=True)
+                except Exception as e:
+                    print(f"⚠️ 採点結果の保存に失敗しました ({name}): {e}")
+        queue.mark_merged(row["task_id"])
+        merged[row["kind"]] = merged.get(row["kind"], 0) + 1
+    return merged
+
+
+def run_local(db_path, batch, workers=2, files=None, kinds=("step1", "step23"), poll=1.0):
+    """
+    このPCでワーカーを workers プロセス起動して、inputs/ の答案を最後まで処理する。
+    終わったら書き出した件数と失敗したタスクのリストを返す。
+    """
+    import results_store
+    queue = SqliteTaskQueue(db_path)
+    first = kinds[0]
+    n = submit_inputs(queue, batch, first, files)
+    print(f"📥 {n}件を {first} としてキューに積みました（バッチ: {batch}）")
+    script = os.path.abspath(__file__)
+    procs = [subprocess.Popen([sys.executable, script, "--db", db_path, "worker",
+                               "--id", f"{socket.gethostname()}-local{i + 1}", "--kinds", *kinds])
+             for i in range(workers)]
+    try:
+        store = results_store.ResultsStore()
+    except Exception as e:
+        print(f"⚠️ 採点結果ストアを開けませんでした（保存せずに続行します）: {e}")
+        store = None
+    chain = "step23" in kinds
+    total = {}
+    try:
+        while True:
+            for kind, k in merge(queue, batch, chain=chain, store=store).items():
+                total[kind] = total.get(kind, 0) + k
+            if queue.pending(batch) == 0 and not queue.unmerged(batch):
+                break
+            if all(p.poll() is not None for p in procs):
+                print("❌ ワーカーがすべて終了しました")
+                break
+            time.sleep(poll)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+        if store:
+            store.close()
+    failed = queue.failures(batch)
+    queue.close()
+    return total, failed
+
+
+def _print_status(queue, batch):
+    counts = queue.counts(batch)
+    if not counts:
+        print("タスクはありません")
+    for kind in sorted(counts):
+        parts = ", ".join(f"{s}:{n}" for s, n in sorted(counts[kind].items()))
+        print(f"{kind:7s} {parts}")
+    for f in queue.failures(batch):
+        print(f"❌ {f['kind']} {f['name']}（{f['attempts']}回）: {f['last_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step1・Step2/3を複数ワーカーで処理するジョブキュー")
+    parser.add_argument("--db", default=None, help="キューのDB（省略時は config.json の job_queue_db）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("worker", help="タスクを取り出して処理し続ける")
+    p.add_argument("--id", default=None)
+    p.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    p.add_argument("--lease", type=int, default=DEFAULT_LEASE_SECONDS)
+    p.add_argument("--idle-exit", type=float, default=None, help="この秒数タスクがなければ終了")
+
+    p = sub.add_parser("submit", help="inputs/ の答案をキューに積む")
+    p.add_argument("--batch", default=None)
+    p.add_argument("--kind", choices=KINDS, default="step1")
+    p.add_argument("--files", nargs="*", default=None)
+
+    p = sub.add_parser("merge", help="結果を step1_texts/・step3_final/ に書き出す")
+    p.add_argument("--batch", default=None)
+    p.add_argument("--chain", action="store_true", help="Step1が終わった答案をStep2/3に回す")
+    p.add_argument("--follow", action="store_true", help="待ちタスクがなくなるまで繰り返す")
+
+    p = sub.add_parser("run-local", help="このPCでワーカーを起動して最後まで処理する")
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--batch", default=None)
+    p.add_argument("--files", nargs="*", default=None)
+    p.add_argument("--only", choices=KINDS, default=None, help="片方のStepだけ実行する")
+
+    p = sub.add_parser("status", help="タスクの件数と失敗を表示する")
+    p.add_argument("--batch", default=None)
+
+    args = parser.parse_args()
+    db_path = args.db or default_db_path()
+
+    if args.command == "run-local":
+        import results_store
+        batch = args.batch or results_store.new_run_id()
+        kinds = (args.only,) if args.only else KINDS
+        t0 = time.time()
+        total, failed = run_local(db_path, batch, args.workers, args.files, kinds)
+        print(f"\n🎉 完了！ {', '.join(f'{k}:{n}件' for k, n in total.items()) or '0件'} | "
+              f"失敗:{len(failed)}件 | 所要時間: {time.time() - t0:.1f}秒")
+        for f in failed:
+            print(f"❌ {f['kind']} {f['name']}: {f['last_error']}")
+        return
+
+    with SqliteTaskQueue(db_path) as queue:
+        if args.command == "worker":
+            run_worker(queue, args.id, args.kinds, args.lease, idle_exit=args.idle_exit)
+        elif args.command == "submit":
+            import results_store
+            batch = args.batch or results_store.new_run_id()
+            n = submit_inputs(queue, batch, args.kind, args.files)
+            print(f"📥 {n}件を {args.kind} としてキューに積みました（バッチ: {batch}）")
+        elif args.command == "merge":
+            import results_store
+            with results_store.ResultsStore() as store:
+                while True:
+                    merged = merge(queue, args.batch, chain=args.chain, store=store)
+                    if merged:
+                        print(f"📤 書き出し: {', '.join(f'{k}:{n}件' for k, n in merged.items())}")
+                    if not args.follow or (queue.pending(args.batch) == 0 and not queue.unmerged(args.batch)):
+                        break
+                    time.sleep(2)
+        elif args.command == "status":
+            _print_status(queue, args.batch)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
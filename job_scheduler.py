@@ -0,0 +1,292 @@
+"""
+Stepのジョブキュー・スケジューラ
+答案のまとまり（バッチ）を「ジョブ」として受け付け、レーンごとに優先度順で実行する。
+
+- レーンは step1 と step23 の2本。別レーンのジョブは同時に動く
+  （バッチAの採点中に、バッチBのテキスト抽出を進められる）
+- ジョブはファイル1件ずつ実行する（Stepスクリプトに --files で1件ずつ渡す）。
+  そのため途中でキャンセルしても、処理が終わったファイルの結果はそのまま残る
+- 進捗イベントは Job.note_event() でジョブ全体の通し番号に付け替える（画面上はジョブ1本の進捗になる）。
+  file イベントを出さずに終わったファイルは、採点されていないものとしてエラーにする
+- ファイル単位・ジョブ単位でキャンセルできる
+
+実際の実行は runner(job, unit, args) に任せる（backend.py が常駐ワーカーで実行する）。
+runner は unit.proc に実行中のプロセス（terminate() を持つもの）をセットし、成否を返す。
+"""
+import heapq
+import itertools
+import threading
+import time
+
+LANES = ("step1", "step23")
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+_HISTORY = 50  # 終了したジョブを何件まで状態一覧に残すか
+
+
+class Unit:
+    """ジョブの中の1回の実行（通常はファイル1件）"""
+    def __init__(self, job, file=None):
+        self.job = job
+        self.file = file
+        self.proc = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        proc = self.proc
+        if proc is not None:
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+
+
+class Job:
+    def __init__(self, job_id, kind, lane, script, label, files, args, priority, on_finish):
+        self.id = job_id
+        self.kind = kind
+        self.lane = lane
+        self.script = script
+        self.label = label
+        self.files = list(files) if files is not None else None
+        self.args = list(args or [])
+        self.priority = priority
+        self.on_finish = on_finish
+        self.status = "queued"  # queued / running / done / failed / cancelled
+        self.file_status = {f: "queued" for f in self.files or []}
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self.current = None  # 実行中の Unit
+        self._stage = None  # 画面に送った stage_start の stage 名
+        self._reported = 0  # 画面に送った file イベントの件数（ジョブ内の通し番号）
+        self._done = threading.Event()
+
+    @property
+    def ok(self):
+        """1件でも処理できたか（ファイル指定なしのジョブは正常終了したか）"""
+        if self.files is None:
+            return self.status == "done"
+        return any(s == "done" for s in self.file_status.values())
+
+    def done_files(self):
+        return [f for f, s in self.file_status.items() if s == "done"]
+
+    def note_event(self, ev):
+        """
+        Stepスクリプトのイベントでファイルごとの状態を更新し、画面に送るイベントを返す（送らないときは None）。
+        ファイル1件ずつ実行するので、stage_start はジョブの最初の1回だけ通し、file イベントの index/total は
+        ジョブ内の通し番号に付け替える。stage_end はジョブの終了時に stage_end_event() でまとめて出す。
+        """
+        if self.files is None:
+            return ev
+        kind = ev.get("event")
+        if kind == "stage_start":
+            if self._stage is not None:
+                return None
+            self._stage = ev.get("stage") or self.kind
+            return {**ev, "total": len(self.files)}
+        if kind == "stage_end":
+            return None
+        if kind == "file":
+            if self.file_status.get(ev.get("file")) == "running":
+                self.file_status[ev["file"]] = ev.get("status", "done")
+            self._reported += 1
+            return {**ev, "index": self._reported, "total": len(self.files)}
+        return ev
+
+    def missing_events(self, file):
+        """file イベントを出さずに終わったファイルをエラーにし、画面に送るイベントを返す"""
+        now = round(time.time(), 3)
+        events = []
+        if self._stage is None:
+            events.append(self.note_event({"event": "stage_start", "t": now, "stage": self.kind, "total": 1}))
+        events.append(self.note_event({"event": "file", "t": now, "stage": self._stage, "file": file,
+                                       "status": "error"}))
+        return events
+
+    def stage_end_event(self):
+        """ジョブ全体の stage_end イベント（ファイル指定なしのジョブ、何も画面に送っていないときは None）"""
+        if self.files is None or self._stage is None:
+            return None
+        statuses = list(self.file_status.values())
+        started = self.started or self.created
+        return {"event": "stage_end", "t": round(time.time(), 3), "stage": self._stage,
+                "done": statuses.count("done"), "skipped": statuses.count("skip"),
+                "errors": statuses.count("error"), "seconds": round((self.finished or time.time()) - started, 1)}
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def state(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "lane": self.lane,
+            "label": self.label,
+            "priority": self.priority,
+            "status": self.status,
+            "files": dict(self.file_status),
+            "current_file": self.current.file if self.current else None,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobScheduler:
+    def __init__(self, runner, lanes=LANES):
+        self.runner = runner
+        self._jobs = {}  # id -> Job（受付順）
+        self._queues = {lane: [] for lane in lanes}  # lane -> heap[(-priority, seq, job)]
+        self._running = {lane: None for lane in lanes}
+        self._seq = itertools.count(1)
+        self._cond = threading.Condition()
+        for lane in lanes:
+            threading.Thread(target=self._lane_loop, args=(lane,), daemon=True).start()
+
+    # ── 受付 ──
+
+    def submit(self, kind, script, label, files=None, args=None, priority=PRIORITY_NORMAL,
+               lane=None, on_finish=None):
+        """
+        ジョブを登録して Job を返す。
+        files を渡すとファイル1件ずつ「args + --files <name>」で実行する。None なら args で1回だけ実行する。
+        on_finish(job) は終了（キャンセル含む）時にレーンのスレッドで呼ばれる。
+        """
+        lane = lane or kind
+        with self._cond:
+            seq = next(self._seq)
+            job = Job(f"{kind}-{seq}", kind, lane, script, label, files, args, priority, on_finish)
+            self._jobs[job.id] = job
+            heapq.heappush(self._queues[lane], (-priority, seq, job))
+            self._trim_history()
+            self._cond.notify_all()
+        return job
+
+    def _trim_history(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        for job in finished[:-_HISTORY]:
+            del self._jobs[job.id]
+
+    # ── キャンセル ──
+
+    def cancel_job(self, job_id):
+        """ジョブを取り消す。処理済みのファイルはそのまま残す"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.finished:
+                return False
+            job.cancelled = True
+            for f, s in job.file_status.items():
+                if s == "queued":
+                    job.file_status[f] = "cancelled"
+            unit = job.current
+        if unit:
+            unit.cancel()
+        return True
+
+    def cancel_file(self, job_id, filename):
+        """ジョブの中のファイル1件だけを取り消す（実行中ならその実行を止める）"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job or job.finished or job.file_status.get(filename) not in ("queued", "running"):
+                return False
+            job.file_status[filename] = "cancelled"
+            unit = job.current if job.current and job.current.file == filename else None
+        if unit:
+            unit.cancel()
+        return True
+
+    def cancel_kind(self, kind):
+        """指定した種類の未完了ジョブをすべて取り消し、取り消したジョブのリストを返す"""
+        with self._cond:
+            jobs = [j for j in self._jobs.values() if j.kind == kind and not j.finished]
+        for job in jobs:
+            self.cancel_job(job.id)
+        return jobs
+
+    # ── 参照 ──
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def active_files(self, kind=None):
+        """待ち・実行中のジョブに含まれるファイル名の集合"""
+        with self._cond:
+            return {f for j in self._jobs.values() if not j.finished and (kind is None or j.kind == kind)
+                    for f in j.files or []}
+
+    def busy(self, lane):
+        with self._cond:
+            return self._running[lane] is not None or bool(self._queues[lane])
+
+    def state(self):
+        with self._cond:
+            return {
+                "lanes": {lane: {"running": job.id if job else None, "queued": len(self._queues[lane])}
+                          for lane, job in self._running.items()},
+                "jobs": [j.state() for j in self._jobs.values()],
+            }
+
+    # ── 実行 ──
+
+    def _lane_loop(self, lane):
+        while True:
+            with self._cond:
+                while not self._queues[lane]:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._queues[lane])
+                self._running[lane] = job
+            try:
+                self._run_job(job)
+            finally:
+                with self._cond:
+                    self._running[lane] = None
+                    job.finished = time.time()
+                if job.on_finish:
+                    try:
+                        job.on_finish(job)
+                    except Exception:
+                        pass
+                job._done.set()
+
+    def _run_job(self, job):
+        job.started = time.time()
+        if job.cancelled:
+            job.status = "cancelled"
+            return
+        job.status = "running"
+        if job.files is None:
+            unit = Unit(job)
+            job.current = unit
+            ok = self._run_unit(unit, job.args)
+            job.current = None
+            job.status = "cancelled" if job.cancelled else ("done" if ok else "failed")
+            return
+
+        for f in job.files:
+            with self._cond:
+                if job.cancelled or job.file_status.get(f) != "queued":
+                    continue
+                job.file_status[f] = "running"
+                unit = Unit(job, f)
+                job.current = unit
+            self._run_unit(unit, job.args + ["--files", f])
+            with self._cond:
+                job.current = None
+                if unit.cancelled:
+                    job.file_status[f] = "cancelled"
+                elif job.file_status.get(f) == "running":  # file イベントが来なかった場合は採点されていない
+                    job.file_status[f] = "error"
+        job.status = "cancelled" if job.cancelled else ("done" if job.ok else "failed")
+
+    def _run_unit(self, unit, args):
+        try:
+            return bool(self.runner(unit.job, unit, args))
+        except Exception:
+            return False
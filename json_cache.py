@@ -0,0 +1,48 @@
+"""
+masters/ ・ coord_db/ のJSON読み込みキャッシュ
+常駐ワーカー（step_worker.py）で同じプロセスが何度もStepを実行するとき、
+変更のないJSONを毎回パースし直さないようにする。
+キーはファイルパスで、mtime・サイズが変わったら読み直す。
+
+返すdictはキャッシュ本体なので、呼び出し側で書き換えないこと。
+"""
+import os
+import json
+import glob
+import threading
+
+_lock = threading.Lock()
+_cache = {}  # path -> ((mtime_ns, size), data)
+
+
+def load_json(path):
+    """JSONファイルを読み込む（未変更ならキャッシュを返す）。読めなければ例外"""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        entry = _cache.get(path)
+        if entry and entry[0] == stamp:
+            return entry[1]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    with _lock:
+        _cache[path] = (stamp, data)
+    return data
+
+
+def load_dir(db_dir, on_error=None):
+    """フォルダ内の *.json を [(path, data), ...] で返す。読めないファイルは on_error(path, e) を呼んで飛ばす"""
+    items = []
+    for path in sorted(glob.glob(os.path.join(db_dir, "*.json"))):
+        try:
+            items.append((path, load_json(path)))
+        except Exception as e:
+            if on_error:
+                on_error(path, e)
+    return items
+
+
+def clear():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,348 @@
+"""
+LLMクライアント共通層
+Step1（Gemini）とStep2（Claude）の両方から使う。
+
+- HTTP接続プール（keep-alive）をプロセス内で共有
+- ジッター付き指数バックオフ（Retry-After / RetryInfo などサーバーの指示を優先）
+- プロバイダーごとの同時実行数制限
+- タイムアウト
+- トランスポート差し替え（ローカルのモックサーバーで両プロバイダーを代替できる）
+- 呼び出しごとの所要時間・リトライ回数・トークン使用量を metrics.py に記録
+
+設定は config.json の "llm" キー、または環境変数で上書きできる。
+    LLM_MOCK_URL        両プロバイダーの接続先をまとめて差し替える（下の2つより優先。例: http://127.0.0.1:8765）
+    GEMINI_BASE_URL     Geminiの接続先
+    ANTHROPIC_BASE_URL  Claudeの接続先
+"""
+import os
+import json
+import time
+import random
+import threading
+import httpx
+import metrics
+from dotenv import load_dotenv
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+
+# ============================
+# 設定エリア
+# ============================
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+_DEFAULT_LLM_CONFIG = {
+    "max_retries": 4,          # 最初の1回を除くリトライ回数
+    "backoff_base": 2.0,       # 指数バックオフの初期待機秒
+    "backoff_max": 60.0,       # 待機秒の上限
+    "pool_size": 10,           # keep-aliveで保持する接続数
+    "gemini": {
+        "timeout": 120.0,      # 1リクエストのタイムアウト（秒）
+        "max_concurrency": 4,  # 同時に投げるリクエスト数の上限
+        "min_interval": 0.0,   # リクエスト開始間隔の下限（秒）。無料枠などRPM制限が厳しい場合に使う
+        "base_url": "",
+    },
+    "anthropic": {
+        "timeout": 180.0,
+        "max_concurrency": 4,
+        "min_interval": 0.0,
+        "base_url": "",
+    },
+}
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# ============================
+
+
+class LLMError(Exception):
+    """リトライしても成功しなかった、またはリトライ対象外のエラー"""
+    def __init__(self, provider, message, status=None):
+        super().__init__(f"[{provider}] {message}")
+        self.provider = provider
+        self.status = status
+
+
+def _load_llm_config() -> dict:
+    cfg = json.loads(json.dumps(_DEFAULT_LLM_CONFIG))
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            user = json.load(f).get("llm", {})
+    except Exception:
+        user = {}
+    for k, v in user.items():
+        if isinstance(v, dict) and isinstance(cfg.get(k), dict):
+            cfg[k].update(v)
+        else:
+            cfg[k] = v
+
+    if os.environ.get("GEMINI_BASE_URL"):
+        cfg["gemini"]["base_url"] = os.environ["GEMINI_BASE_URL"]
+    if os.environ.get("ANTHROPIC_BASE_URL"):
+        cfg["anthropic"]["base_url"] = os.environ["ANTHROPIC_BASE_URL"]
+    # モックは最後に上書きする（プロバイダーごとのURLが残っていても本物のAPIに送らない）
+    mock_url = os.environ.get("LLM_MOCK_URL", "")
+    if mock_url:
+        cfg["gemini"]["base_url"] = mock_url
+        cfg["anthropic"]["base_url"] = mock_url
+    return cfg
+
+
+CFG = _load_llm_config()
+
+_lock = threading.Lock()
+_clients = {}
+_transport = None
+_limiters = {}
+
+
+class _ProviderLimiter:
+    """同時実行数とリクエスト開始間隔を制限する"""
+    def __init__(self, max_concurrency, min_interval):
+        self._sem = threading.BoundedSemaphore(max(1, int(max_concurrency)))
+        self._min_interval = float(min_interval)
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._sem.acquire()
+        if self._min_interval > 0:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._next_start - now
+                self._next_start = max(now, self._next_start) + self._min_interval
+            if wait > 0:
+                time.sleep(wait)
+        return self
+
+    def __exit__(self, *exc):
+        self._sem.release()
+        return False
+
+
+def _limiter(provider) -> _ProviderLimiter:
+    with _lock:
+        if provider not in _limiters:
+            p = CFG[provider]
+            _limiters[provider] = _ProviderLimiter(p["max_concurrency"], p["min_interval"])
+        return _limiters[provider]
+
+
+def set_transport(transport):
+    """
+    httpxのトランスポートを差し替える（モックやテスト用）。
+    既に作成済みのクライアントは破棄し、次回アクセス時に作り直す。
+    None を渡すと通常のネットワーク接続に戻る。
+    """
+    global _transport
+    with _lock:
+        _transport = transport
+        for c in _clients.values():
+            try:
+                c.close()
+            except Exception:
+                pass
+        _clients.clear()
+
+
+def reset():
+    """設定を読み直し、クライアントと制限を作り直す"""
+    global CFG
+    set_transport(_transport)
+    with _lock:
+        CFG = _load_llm_config()
+        _limiters.clear()
+
+
+def _httpx_kwargs(provider) -> dict:
+    kwargs = {
+        "timeout": httpx.Timeout(CFG[provider]["timeout"], connect=10.0),
+        "limits": httpx.Limits(
+            max_connections=max(CFG["pool_size"], CFG[provider]["max_concurrency"]),
+            max_keepalive_connections=CFG["pool_size"],
+            keepalive_expiry=60.0,
+        ),
+    }
+    if _transport is not None:
+        kwargs["transport"] = _transport
+    return kwargs
+
+
+# ============================
+# クライアント取得
+# ============================
+
+def gemini():
+    """共有のgenai.Clientを返す（初回呼び出し時に作成）"""
+    with _lock:
+        if "gemini" not in _clients:
+            from google import genai
+            from google.genai import types
+            p = CFG["gemini"]
+            http_options = types.HttpOptions(
+                timeout=int(p["timeout"] * 1000),  # ミリ秒指定
+                client_args=_httpx_kwargs("gemini"),
+            )
+            if p["base_url"]:
+                http_options.base_url = p["base_url"]
+            _clients["gemini"] = genai.Client(
+                api_key=os.environ.get("GOOGLE_API_KEY", ""),
+                http_options=http_options,
+            )
+        return _clients["gemini"]
+
+
+def anthropic_client():
+    """共有のanthropic.Anthropicを返す（初回呼び出し時に作成）"""
+    with _lock:
+        if "anthropic" not in _clients:
+            import anthropic
+            p = CFG["anthropic"]
+            kwargs = {
+                "api_key": os.environ.get("ANTHROPIC_API_KEY", ""),
+                "timeout": p["timeout"],
+                "max_retries": 0,  # リトライはこのモジュールで一元管理する
+                "http_client": anthropic.DefaultHttpxClient(**_httpx_kwargs("anthropic")),
+            }
+            if p["base_url"]:
+                kwargs["base_url"] = p["base_url"]
+            _clients["anthropic"] = anthropic.Anthropic(**kwargs)
+        return _clients["anthropic"]
+
+
+# ============================
+# リトライ
+# ============================
+
+def _status_of(e):
+    for attr in ("status_code", "code", "status"):
+        v = getattr(e, attr, None)
+        if isinstance(v, int):
+            return v
+    resp = getattr(e, "response", None)
+    v = getattr(resp, "status_code", None)
+    return v if isinstance(v, int) else None
+
+
+def _parse_seconds(value):
+    if value is None:
+        return None
+    s = str(value).strip().lower()
+    try:
+        if s.endswith("ms"):
+            return float(s[:-2]) / 1000.0
+        if s.endswith("s"):
+            return float(s[:-1])
+        return float(s)
+    except ValueError:
+        return None
+
+
+def server_retry_hint(e):
+    """エラーからサーバー指定の待機秒数を取り出す（なければNone）"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            ms = headers.get("retry-after-ms")
+            if ms is not None:
+                return float(ms) / 1000.0
+            hint = _parse_seconds(headers.get("retry-after"))
+            if hint is not None:
+                return hint
+        except Exception:
+            pass
+    # Gemini: error.details[].retryDelay = "30s"
+    details = getattr(e, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details", [])
+    if isinstance(details, list):
+        for d in details:
+            if isinstance(d, dict) and "retryDelay" in d:
+                return _parse_seconds(d["retryDelay"])
+    return None
+
+
+def is_retryable(e) -> bool:
+    if isinstance(e, (httpx.TimeoutException, httpx.TransportError)):
+        return True
+    name = type(e).__name__
+    if name in ("APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError"):
+        return True
+    status = _status_of(e)
+    return status in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt, hint=None) -> float:
+    """attempt回目（0始まり）のリトライ前の待機秒数（フルジッター）"""
+    if hint is not None:
+        return min(CFG["backoff_max"], hint) + random.uniform(0, 1.0)
+    cap = min(CFG["backoff_max"], CFG["backoff_base"] * (2 ** attempt))
+    return random.uniform(cap / 2, cap)
+
+
+def call_with_retry(provider, fn, *args, label="", **kwargs):
+    """
+    fn(*args, **kwargs) をプロバイダーの同時実行制限下で呼び、
+    一時的なエラーはバックオフしながらリトライする。
+    リトライ対象外・上限到達時は LLMError を送出する。
+    """
+    max_retries = int(CFG["max_retries"])
+    stage = f"{provider}.{label or 'request'}"
+    for attempt in range(max_retries + 1):
+        try:
+            with _limiter(provider), metrics.timer(stage):
+                return fn(*args, **kwargs)
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            status = _status_of(e)
+            if not is_retryable(e) or attempt >= max_retries:
+                metrics.inc("llm_errors", provider=provider, reason=status or type(e).__name__)
+                raise LLMError(provider, f"{label or 'request'}: {e}", status) from e
+            metrics.inc("llm_retries", provider=provider, reason=status or type(e).__name__)
+            wait = backoff_delay(attempt, server_retry_hint(e))
+            kind = "レート制限" if status == 429 else "一時エラー"
+            print(f"\n⚠️ {provider} {kind} (試行 {attempt+1}/{max_retries+1}): {e}")
+            print(f"⏳ {wait:.1f}秒待機してリトライします...")
+            time.sleep(wait)
+    raise LLMError(provider, "Max retries exceeded")
+
+
+# ============================
+# プロバイダー別ヘルパー
+# ============================
+
+def gemini_generate(model, contents, response_mime_type="text/plain"):
+    """generate_content を呼んでレスポンスを返す"""
+    from google.genai import types
+    client = gemini()
+    response = call_with_retry(
+        "gemini", client.models.generate_content,
+        model=model,
+        contents=contents,
+        config=types.GenerateContentConfig(response_mime_type=response_mime_type),
+        label="generate_content",
+    )
+    metrics.record_usage("gemini", model, response)
+    return response
+
+
+def gemini_upload(path, mime_type="image/png", poll_interval=1.0):
+    """ファイルをアップロードし、PROCESSINGが終わるまで待ってから返す"""
+    from google.genai import types
+    client = gemini()
+    uf = call_with_retry(
+        "gemini", client.files.upload,
+        file=path,
+        config=types.UploadFileConfig(mime_type=mime_type),
+        label="files.upload",
+    )
+    with metrics.timer("gemini.upload_poll"):
+        while uf.state.name == "PROCESSING":
+            time.sleep(poll_interval)
+            # ポーリングは同時実行枠を使わない（待機中に他ファイルのアップロードを止めないため）
+            uf = client.files.get(name=uf.name)
+    return uf
+
+
+def anthropic_create(**kwargs):
+    """beta.messages.create を呼んでレスポンスを返す"""
+    client = anthropic_client()
+    response = call_with_retry("anthropic", client.beta.messages.create, label="messages.create", **kwargs)
+    metrics.record_usage("anthropic", kwargs.get("model", ""), response)
+    return response
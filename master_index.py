@@ -0,0 +1,211 @@
+"""
+ヘッダーの指紋によるマスターIDの判定
+Step1 は答案の1行目のマスターIDをLLMにリストから選ばせているが、写し間違いや「UNKNOWN」だと Step2 で飛ばされてしまう。
+そこで coord_db の各マスターに「参照PDF」（座標を取ったときのPDF）を持たせ、1ページ目のヘッダー部分（ページ上部）の
+差分ハッシュを索引にしておく。答案の1ページ目のヘッダーと比べて、十分近く、2番目の候補と十分離れていれば
+その場でマスターIDが決まる（1件数ミリ秒）。決まらなければ今まで通りLLMに任せる。
+masters/ のマスターのうち参照PDFのないものが1つでもあれば、その用紙を別のマスターと取り違えかねないので判定しない。
+Step1 はLLMが読んだIDとも突き合わせ、LLMが読めなかった（UNKNOWN など）ときの補完に使う。
+
+参照PDFは coord_db/<マスターID>.json の "reference_pdf"（coord_db からの相対パス）。
+coordinate_picker.py で座標を保存すると coord_db/references/<マスターID>.pdf に保存される
+（scan_registration.py の位置合わせでも使う）。
+既存のマスターには add で後から登録できる。
+指紋は coord_db/references/index.json にキャッシュし、参照PDFが変わったものだけ計算し直す。
+
+使い方:
+    python master_index.py add 2025_1_1 blank_2025_1_1.pdf
+    python master_index.py build
+    python master_index.py match inputs/*.pdf
+"""
+import os
+import sys
+import json
+import argparse
+from collections import namedtuple
+
+import fitz
+import json_cache
+from page_features import render_gray, top_band, dhash, hamming
+
+COORD_DB_DIR = "./coord_db"
+MASTER_DB_DIR = "./masters"
+REFERENCE_DIR = "references"   # coord_db の中
+INDEX_FILE = "index.json"      # REFERENCE_DIR の中（coord_db 直下の *.json は座標データとして読まれるため）
+HEADER_FRACTION = 0.15  # ヘッダーとみなすページ上部の割合
+INDEX_DPI = 50
+HASH_SIZE = 16          # 256ビット
+MAX_DISTANCE = 32       # これより違うものは同じ用紙とみなさない（256ビット中。スキャン相当の合成答案で 12〜27）
+MIN_MARGIN = 16         # 2番目に近い候補とこれ以上離れていなければ判定しない（年度違いなど似た用紙の取り違え防止）
+                        # 候補が1つだけのときは MAX_DISTANCE との間にこれだけの余裕を求める
+
+Match = namedtuple("Match", "master_id distance margin")
+
+
+def fingerprint(page, fraction=HEADER_FRACTION):
+    """ページのヘッダー部分の差分ハッシュ"""
+    return dhash(render_gray(page, dpi=INDEX_DPI, clip=top_band(page, fraction)), size=HASH_SIZE)
+
+
+def master_ids(master_db_dir=MASTER_DB_DIR):
+    """masters/ に登録されているマスターIDの集合"""
+    return {d["meta"]["id"] for _, d in json_cache.load_dir(master_db_dir) if "id" in d.get("meta", {})}
+
+
+def save_reference(doc, master_id, coord_db_dir=COORD_DB_DIR):
+    """doc を参照PDFとして保存し、coord_db に書く相対パスを返す"""
+    rel = f"{REFERENCE_DIR}/{master_id}.pdf"
+    path = os.path.join(coord_db_dir, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    out = fitz.open()
+    try:
+        out.insert_pdf(doc)
+        out.save(path + ".part", garbage=3, deflate=True)
+    finally:
+        out.close()
+    os.replace(path + ".part", path)
+    return rel
+
+
+class MasterIndex:
+    """coord_db の参照PDFのヘッダー指紋の索引"""
+    def __init__(self, coord_db_dir=COORD_DB_DIR, max_distance=MAX_DISTANCE, min_margin=MIN_MARGIN,
+                 fraction=HEADER_FRACTION):
+        self.coord_db_dir = coord_db_dir
+        self.max_distance = max_distance
+        self.min_margin = min_margin
+        self.fraction = fraction
+        self.cache_path = os.path.join(coord_db_dir, REFERENCE_DIR, INDEX_FILE)
+        self.entries = {}  # マスターID -> 指紋（int）
+        self._cache = self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp = self.cache_path + ".part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.cache_path)
+
+    def refresh(self):
+        """coord_db を読み直し、参照PDFが追加・変更されたマスターだけ指紋を計算する。self を返す"""
+        entries, changed = {}, False
+        for path, coords in json_cache.load_dir(self.coord_db_dir):
+            ref = coords.get("reference_pdf")
+            if not ref:
+                continue
+            master_id = coords.get("master_id") or os.path.splitext(os.path.basename(path))[0]
+            ref_path = os.path.join(self.coord_db_dir, ref)
+            try:
+                st = os.stat(ref_path)
+            except OSError:
+                print(f"⚠️ {master_id} の参照PDFが見つかりません: {ref_path}")
+                continue
+            key = [ref, st.st_mtime_ns, st.st_size, self.fraction]
+            cached = self._cache.get(master_id)
+            if cached and cached.get("key") == key:
+                entries[master_id] = int(cached["hash"], 16)
+                continue
+            try:
+                with fitz.open(ref_path) as doc:
+                    h = fingerprint(doc[0], self.fraction)
+            except Exception as e:
+                print(f"⚠️ {master_id} の参照PDFを読めませんでした: {e}")
+                continue
+            self._cache[master_id] = {"key": key, "hash": f"{h:x}"}
+            entries[master_id] = h
+            changed = True
+        for master_id in set(self._cache) - set(entries):
+            del self._cache[master_id]
+            changed = True
+        if changed:
+            self._save_cache()
+        self.entries = entries
+        return self
+
+    def missing(self, ids):
+        """ids のうち参照PDFの指紋がないマスターID（空でなければ判定してはいけない）"""
+        return sorted(set(ids) - set(self.entries))
+
+    def rank(self, fp):
+        """[(距離, マスターID), ...] を近い順に返す"""
+        return sorted((hamming(fp, h), master_id) for master_id, h in self.entries.items())
+
+    def match_page(self, page):
+        """判定できれば Match、できなければ None"""
+        if not self.entries:
+            return None
+        ranked = self.rank(fingerprint(page, self.fraction))
+        distance, master_id = ranked[0]
+        margin = ranked[1][0] - distance if len(ranked) > 1 else self.max_distance - distance
+        if distance > self.max_distance or margin < self.min_margin:
+            return None
+        return Match(master_id, distance, margin)
+
+    def match_pdf(self, pdf_path, pdf_bytes=None):
+        """答案PDFの1ページ目で判定する"""
+        if not self.entries:
+            return None
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf") if pdf_bytes is not None else fitz.open(pdf_path)
+        try:
+            return self.match_page(doc[0]) if len(doc) else None
+        finally:
+            doc.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ヘッダーの指紋でマスターIDを判定する索引")
+    parser.add_argument("--coord-db", default=COORD_DB_DIR)
+    parser.add_argument("--masters", default=MASTER_DB_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("add", help="既存のマスターに参照PDF（白紙の答案用紙など）を登録する")
+    p.add_argument("master_id")
+    p.add_argument("pdf")
+    sub.add_parser("build", help="索引を作り直して一覧を表示する")
+    p = sub.add_parser("match", help="答案PDFを判定してみる")
+    p.add_argument("pdfs", nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd == "add":
+        coord_path = os.path.join(args.coord_db, f"{args.master_id}.json")
+        if not os.path.exists(coord_path):
+            print(f"❌ 座標データがありません: {coord_path}")
+            sys.exit(1)
+        with open(coord_path, "r", encoding="utf-8") as f:
+            coords = json.load(f)
+        with fitz.open(args.pdf) as doc:
+            coords["reference_pdf"] = save_reference(doc, args.master_id, args.coord_db)
+        with open(coord_path, "w", encoding="utf-8") as f:
+            json.dump(coords, f, ensure_ascii=False, indent=2)
+        print(f"✅ {args.master_id} の参照PDFを登録しました: {coords['reference_pdf']}")
+        return
+
+    index = MasterIndex(args.coord_db).refresh()
+    missing = index.missing(master_ids(args.masters))
+    if missing:
+        print(f"⚠️ 参照PDFのないマスターがあるため、Step1 はヘッダーで判定しません: {', '.join(missing)}")
+    if args.cmd == "build":
+        print(f"🧭 参照PDFのあるマスター: {len(index.entries)}件")
+        for master_id in sorted(index.entries):
+            others = [hamming(index.entries[master_id], h) for m, h in index.entries.items() if m != master_id]
+            closest = f"（最も近い他のマスターとの差 {min(others)}）" if others else ""
+            print(f"   {master_id}{closest}")
+        return
+
+    for pdf in args.pdfs:
+        with fitz.open(pdf) as doc:
+            ranked = index.rank(fingerprint(doc[0], index.fraction)) if len(doc) else []
+            m = index.match_page(doc[0]) if len(doc) else None
+        top = ", ".join(f"{mid}={d}" for d, mid in ranked[:3])
+        print(f"{'✅' if m else '❓'} {os.path.basename(pdf)}: {m.master_id if m else '判定できず（LLMに任せる）'}  [{top}]")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
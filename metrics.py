@@ -0,0 +1,375 @@
+"""
+処理時間・トークン・コストの計測
+Stepスクリプトの各工程（画像化・アップロード・LLM呼び出し・JSON解析・印字など）の所要時間、
+LLMのトークン使用量（キャッシュ読み込みを含む）、リトライ回数をプロセス内に集計し、
+実行ごとのレポート（reports/ にJSONとPrometheus形式のテキスト）として書き出す。
+
+    with metrics.timer("rasterize"):
+        ...
+    metrics.record_usage("anthropic", model, response)
+    metrics.inc("llm_retries", provider="gemini", reason="429")
+
+backend から起動されたとき（progress.enabled()）は、集計結果を metrics イベントで backend に渡し、
+backend がジョブ単位（ファイル1件ずつの実行をまとめたもの）でレポートを書く。
+コマンドラインから直接実行したときはスクリプト自身がレポートを書く。
+
+料金（100万トークンあたりのUSD）は目安。config.json の "pricing" で上書きできる。
+    "pricing": {"claude-sonnet-4-5": {"input": 3.0, "output": 15.0, "cache_read": 0.3, "cache_write": 3.75}}
+"""
+import os
+import sys
+import json
+import time
+import glob
+import bisect
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import progress
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+REPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reports")
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+_MAX_SAMPLES = 5000  # パーセンタイル計算用に残す値の上限（系列ごと）
+TOKEN_TYPES = ("input", "output", "cache_read", "cache_write")
+
+_DEFAULT_PRICES = {
+    "claude-sonnet-4-5": {"input": 3.0, "output": 15.0, "cache_read": 0.30, "cache_write": 3.75},
+    "claude-opus-4":     {"input": 15.0, "output": 75.0, "cache_read": 1.50, "cache_write": 18.75},
+    "claude-haiku-4-5":  {"input": 1.0, "output": 5.0, "cache_read": 0.10, "cache_write": 1.25},
+    "gemini-2.5-flash":  {"input": 0.30, "output": 2.50, "cache_read": 0.075, "cache_write": 0.0},
+    "gemini-2.5-pro":    {"input": 1.25, "output": 10.0, "cache_read": 0.31, "cache_write": 0.0},
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> 値
+_hists = {}     # (name, labels) -> _Histogram
+
+
+class _Histogram:
+    __slots__ = ("count", "sum", "max", "buckets", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # 最後は +Inf
+        self.samples = []
+
+    def observe(self, v):
+        self.count += 1
+        self.sum += v
+        self.max = max(self.max, v)
+        self.buckets[bisect.bisect_left(BUCKETS, v)] += 1
+        if len(self.samples) < _MAX_SAMPLES:
+            self.samples.append(v)
+
+    def merge(self, d):
+        self.count += d["count"]
+        self.sum += d["sum"]
+        self.max = max(self.max, d["max"])
+        self.buckets = [a + b for a, b in zip(self.buckets, d["buckets"])]
+        self.samples.extend(d["samples"][:max(0, _MAX_SAMPLES - len(self.samples))])
+
+    def to_dict(self):
+        return {"count": self.count, "sum": self.sum, "max": self.max,
+                "buckets": list(self.buckets), "samples": list(self.samples)}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+# ============================
+# 記録
+# ============================
+
+def inc(name, value=1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(stage, seconds, **labels):
+    """工程の所要時間（秒）を記録する"""
+    k = _key("stage_seconds", dict(labels, stage=stage))
+    with _lock:
+        h = _hists.get(k)
+        if h is None:
+            h = _hists[k] = _Histogram()
+        h.observe(seconds)
+
+
+@contextmanager
+def timer(stage, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t0, **labels)
+
+
+def usage_of(provider, response):
+    """レスポンスからトークン数を {input, output, cache_read, cache_write} で取り出す"""
+    if provider == "anthropic":
+        u = getattr(response, "usage", None)
+        if u is None:
+            return {}
+        return {"input": getattr(u, "input_tokens", 0) or 0,
+                "output": getattr(u, "output_tokens", 0) or 0,
+                "cache_read": getattr(u, "cache_read_input_tokens", 0) or 0,
+                "cache_write": getattr(u, "cache_creation_input_tokens", 0) or 0}
+    u = getattr(response, "usage_metadata", None)
+    if u is None:
+        return {}
+    cached = getattr(u, "cached_content_token_count", 0) or 0
+    return {"input": (getattr(u, "prompt_token_count", 0) or 0) - cached,
+            "output": (getattr(u, "candidates_token_count", 0) or 0) + (getattr(u, "thoughts_token_count", 0) or 0),
+            "cache_read": cached,
+            "cache_write": 0}
+
+
+def record_usage(provider, model, response):
+    """LLMレスポンスのトークン使用量を記録する"""
+    try:
+        usage = usage_of(provider, response)
+    except Exception:
+        return
+    for t, n in usage.items():
+        if n:
+            inc("tokens", n, provider=provider, model=model, type=t)
+
+
+# ============================
+# 集計結果
+# ============================
+
+def snapshot():
+    """現在の集計結果（JSONにできるdict）"""
+    with _lock:
+        return {
+            "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in _counters.items()],
+            "histograms": [dict(h.to_dict(), name=n, labels=dict(l)) for (n, l), h in _hists.items()],
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _hists.clear()
+
+
+def merge(snapshots):
+    """複数の snapshot() を1つにまとめる（ファイル1件ずつの実行の集計をジョブ単位にする）"""
+    counters, hists = {}, {}
+    for snap in snapshots:
+        for c in snap.get("counters", []):
+            k = _key(c["name"], c["labels"])
+            counters[k] = counters.get(k, 0) + c["value"]
+        for h in snap.get("histograms", []):
+            k = _key(h["name"], h["labels"])
+            hists.setdefault(k, _Histogram()).merge(h)
+    return {
+        "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in counters.items()],
+        "histograms": [dict(h.to_dict(), name=n, labels=dict(l)) for (n, l), h in hists.items()],
+    }
+
+
+def _prices():
+    prices = {k: dict(v) for k, v in _DEFAULT_PRICES.items()}
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            for k, v in json.load(f).get("pricing", {}).items():
+                prices.setdefault(k, {}).update(v)
+    except Exception:
+        pass
+    return prices
+
+
+def _price_for(model, prices):
+    """モデル名の前方一致で一番長く一致する料金（claude-sonnet-4-5-20250929 → claude-sonnet-4-5）"""
+    best = None
+    for prefix in prices:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return prices[best] if best else None
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def summarize(snap):
+    """工程別の時間・トークン・コスト・リトライ回数"""
+    stages = {}
+    for h in snap["histograms"]:
+        if h["name"] != "stage_seconds":
+            continue
+        stage = h["labels"]["stage"]
+        values = sorted(h["samples"])
+        stages[stage] = {
+            "count": h["count"],
+            "total": round(h["sum"], 3),
+            "mean": round(h["sum"] / h["count"], 3) if h["count"] else 0.0,
+            "p50": round(_percentile(values, 0.5), 3),
+            "p95": round(_percentile(values, 0.95), 3),
+            "max": round(h["max"], 3),
+        }
+
+    prices = _prices()
+    tokens, cost, unpriced, retries, counters = {}, 0.0, set(), {}, {}
+    for c in snap["counters"]:
+        labels = c["labels"]
+        if c["name"] == "tokens":
+            model = labels["model"]
+            tokens.setdefault(model, {t: 0 for t in TOKEN_TYPES})[labels["type"]] += c["value"]
+            price = _price_for(model, prices)
+            if price is None:
+                unpriced.add(model)
+            else:
+                cost += c["value"] * price.get(labels["type"], 0.0) / 1_000_000
+        elif c["name"] == "llm_retries":
+            retries[labels["provider"]] = retries.get(labels["provider"], 0) + c["value"]
+        else:
+            key = c["name"] + "".join(f"[{k}={v}]" for k, v in sorted(labels.items()))
+            counters[key] = counters.get(key, 0) + c["value"]
+    return {"stages": stages, "tokens": tokens, "cost_usd": round(cost, 4), "unpriced_models": sorted(unpriced),
+            "retries": retries, "counters": counters}
+
+
+def to_prometheus(snap, run=None):
+    """Prometheus のテキスト形式（textfile collector で読める）"""
+    base = {"run": run} if run else {}
+
+    def fmt(labels):
+        labels = dict(base, **labels)
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+    lines = []
+    by_name = {}
+    for c in snap["counters"]:
+        by_name.setdefault(c["name"], []).append(c)
+    for name, items in sorted(by_name.items()):
+        metric = f"grading_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for c in items:
+            lines.append(f"{metric}{fmt(c['labels'])} {c['value']}")
+    hists = [h for h in snap["histograms"] if h["name"] == "stage_seconds"]
+    if hists:
+        lines.append("# TYPE grading_stage_seconds histogram")
+    for h in hists:
+        acc = 0
+        for le, n in zip(list(BUCKETS) + ["+Inf"], h["buckets"]):
+            acc += n
+            lines.append(f"grading_stage_seconds_bucket{fmt(dict(h['labels'], le=le))} {acc}")
+        lines.append(f"grading_stage_seconds_sum{fmt(h['labels'])} {h['sum']:.6f}")
+        lines.append(f"grading_stage_seconds_count{fmt(h['labels'])} {h['count']}")
+    summary = summarize(snap)
+    lines.append("# TYPE grading_cost_usd gauge")
+    lines.append(f"grading_cost_usd{fmt({})} {summary['cost_usd']}")
+    return "\n".join(lines) + "\n"
+
+
+# ============================
+# レポート
+# ============================
+
+def build_report(run, stage, snap, sheets=0, seconds=None, **extra):
+    report = {
+        "run": run,
+        "stage": stage,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "sheets": sheets,
+        "seconds": round(seconds, 2) if seconds is not None else None,
+        "sheets_per_min": round(sheets / seconds * 60, 2) if seconds else None,
+        **extra,
+    }
+    report.update(summarize(snap))
+    return report
+
+
+def write_report(run, stage, snap, sheets=0, seconds=None, report_dir=None, **extra):
+    """reports/<run>_<stage>.json と .prom を書き出し、JSONのパスを返す"""
+    report_dir = report_dir or REPORT_DIR
+    os.makedirs(report_dir, exist_ok=True)
+    name = f"{run}_{stage}"
+    report = build_report(run, stage, snap, sheets, seconds, **extra)
+    path = os.path.join(report_dir, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(report_dir, f"{name}.prom"), "w", encoding="utf-8") as f:
+        f.write(to_prometheus(snap, run=name))
+    return path
+
+
+def finish(stage, run=None, sheets=0, seconds=None, **extra):
+    """
+    Stepスクリプトの最後に呼ぶ。backend から起動されていれば metrics イベントで集計結果を渡し、
+    そうでなければレポートを書いて表示する。どちらの場合も集計はリセットする
+    （常駐ワーカーで次の実行に持ち越さないため）。
+    """
+    snap = snapshot()
+    reset()
+    if progress.enabled():
+        progress.emit("metrics", stage=stage, snapshot=snap, sheets=sheets, seconds=seconds, **extra)
+        return None
+    run = run or datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = write_report(run, stage, snap, sheets, seconds, **extra)
+    print_summary(build_report(run, stage, snap, sheets, seconds, **extra))
+    print(f"📊 レポート: {path}")
+    return path
+
+
+def print_summary(report):
+    stages = sorted(report["stages"].items(), key=lambda kv: -kv[1]["total"])
+    if stages:
+        print("⏱️ 工程別の所要時間（合計 / 平均 / p95, 秒）")
+        for name, s in stages:
+            print(f"   {name:28s} {s['total']:8.1f} / {s['mean']:6.2f} / {s['p95']:6.2f}  ×{s['count']}")
+    for model, t in report["tokens"].items():
+        print(f"🔤 {model}: 入力 {t['input']:,} / 出力 {t['output']:,} / キャッシュ読込 {t['cache_read']:,}"
+              f" / キャッシュ書込 {t['cache_write']:,}")
+    if report["tokens"]:
+        print(f"💰 推定コスト: ${report['cost_usd']:.4f}")
+    if report["retries"]:
+        print(f"🔁 リトライ: {', '.join(f'{p} {n}回' for p, n in report['retries'].items())}")
+    if report.get("sheets_per_min"):
+        print(f"📈 処理速度: {report['sheets_per_min']:.1f}枚/分（{report['sheets']}枚）")
+
+
+def list_reports(limit=20, report_dir=None):
+    """新しい順のレポート一覧（JSONの中身）"""
+    report_dir = report_dir or REPORT_DIR
+    paths = sorted(glob.glob(os.path.join(report_dir, "*.json")), key=os.path.getmtime, reverse=True)
+    reports = []
+    for path in paths[:limit]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                reports.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return reports
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="実行レポート（reports/）を表示する")
+    parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+    reports = list_reports(args.limit)
+    if not reports:
+        print("レポートはまだありません")
+    for report in reports:
+        print(f"\n=== {report['run']} ({report['stage']}) {report['created_at']} ===")
+        print_summary(report)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
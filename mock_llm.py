@@ -0,0 +1,383 @@
+"""
+オフライン用のモックLLMサーバー
+Gemini（ファイルアップロード → generateContent）と Anthropic（messages）の
+HTTPエンドポイントをローカルで再現する。APIの課金やネットワークの揺らぎなしに
+パイプライン全体のスループットを計測するためのもの。
+
+使い方:
+    python mock_llm.py --port 8765 --latency 0.5 --rate-limit-rate 0.05
+    LLM_MOCK_URL=http://127.0.0.1:8765 python step1_mark_and_text_v2.py
+
+応答は --recordings で指定したフォルダの記録を順番に再生する（なければ自動生成）。
+    gemini_text*.txt      記述式の読み取り結果
+    gemini_marks*.txt     マークシートの読み取り結果
+    gemini_box*.json      マークシートの座標検出結果
+    anthropic*.json       採点結果JSON（messagesのtext部分）
+"""
+import os
+import re
+import sys
+import json
+import glob
+import time
+import uuid
+import random
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class MockOptions:
+    def __init__(self, latency=0.2, jitter=0.5, upload_latency=0.05, processing_time=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1.0, recordings_dir=None, seed=None):
+        self.latency = latency                  # generate / messages の平均応答時間（秒）
+        self.jitter = jitter                    # 応答時間の揺らぎ（平均に対する割合）
+        self.upload_latency = upload_latency    # アップロードの応答時間（秒）
+        self.processing_time = processing_time  # アップロード後にPROCESSINGのままにする時間（秒）
+        self.error_rate = error_rate            # 500エラーを返す確率
+        self.rate_limit_rate = rate_limit_rate  # 429を返す確率
+        self.retry_after = retry_after          # 429のRetry-Afterヘッダー（秒）
+        self.recordings_dir = recordings_dir
+        self.rng = random.Random(seed)
+
+
+class _Recordings:
+    """記録済み応答を種類ごとにラウンドロビンで返す"""
+    def __init__(self, recordings_dir):
+        self._cycles = {}
+        self._lock = threading.Lock()
+        if not recordings_dir or not os.path.isdir(recordings_dir):
+            return
+        for kind, pattern in [("gemini_text", "gemini_text*.txt"), ("gemini_marks", "gemini_marks*.txt"),
+                              ("gemini_box", "gemini_box*.json"), ("anthropic", "anthropic*.json")]:
+            items = []
+            for path in sorted(glob.glob(os.path.join(recordings_dir, pattern))):
+                with open(path, "r", encoding="utf-8") as f:
+                    items.append(f.read())
+            if items:
+                self._cycles[kind] = itertools.cycle(items)
+
+    def next(self, kind):
+        with self._lock:
+            cycle = self._cycles.get(kind)
+            return next(cycle) if cycle else None
+
+
+# ============================
+# 自動生成する応答
+# ============================
+
+def _default_gemini_text(prompt):
+    m = re.search(r"\[マスターIDの選択肢\]\s*\n\s*-\s*(\S+)", prompt)
+    master_id = m.group(1) if m else "UNKNOWN"
+    student_id = f"{random.randint(0, 99999999):08d}"
+    return (f"{master_id}\n{student_id}\n"
+            "(A) Walking through the forest, she noticed how quietly the animals moved.\n"
+            "(B) He realized that technology alone could not solve the problem.\n"
+            "(C) It is important to think about what we can do for the future.")
+
+
+def _default_grading(request_text, student_id=""):
+    m = re.search(r"【問題データ（配点・採点要素）】\n(\{.*?\})\n", request_text + "\n", re.S)
+    try:
+        sub_questions = json.loads(m.group(1)) if m else {}
+    except json.JSONDecodeError:
+        sub_questions = {}
+    questions = {}
+    for key, q in sub_questions.items():
+        mx = int(q.get("max", 10))
+        score = max(0, mx - 2)
+        questions[key] = {
+            "max": mx,
+            "grading_process": f"{mx} - 2 = {score}",
+            "score": score,
+            "mark": "triangle" if 0 < score < mx else ("circle" if score == mx else "check"),
+            "corrections": ["①「recieve」のスペルは「receive」が正しいです。(-1)",
+                            "②時制の一致ができていません。過去形で揃えましょう。(-1)"],
+            "details_text": "",
+            "sub_results": {},
+        }
+    return {
+        "student_id": student_id,
+        "questions": questions,
+        "comment_parts": {
+            "praise": "構文を正しく理解して英文を組み立てることができています。",
+            "advice": "スペルと時制の一致を最後に見直せると良いですね。",
+            "closing": "これからも頑張ってください。応援しています。",
+        },
+    }
+
+
+# ============================
+# HTTPハンドラ
+# ============================
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-aliveを有効にする
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # ── 共通 ──
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status, obj, headers=None):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sleep(self, base):
+        opts = self.mock.options
+        if base > 0:
+            time.sleep(max(0.0, base * (1 + opts.rng.uniform(-opts.jitter, opts.jitter))))
+
+    def _inject_failure(self, provider):
+        """エラー・レート制限を確率的に注入する。注入したらTrue"""
+        opts = self.mock.options
+        r = opts.rng.random()
+        if r < opts.rate_limit_rate:
+            self.mock.count(provider, "rate_limited")
+            err = {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "mock rate limit"}} \
+                if provider == "gemini" else {"type": "error", "error": {"type": "rate_limit_error", "message": "mock rate limit"}}
+            self._send_json(429, err, {"Retry-After": f"{opts.retry_after:g}"})
+            return True
+        if r < opts.rate_limit_rate + opts.error_rate:
+            self.mock.count(provider, "errors")
+            err = {"error": {"code": 500, "status": "INTERNAL", "message": "mock internal error"}} \
+                if provider == "gemini" else {"type": "error", "error": {"type": "api_error", "message": "mock internal error"}}
+            self._send_json(500, err)
+            return True
+        return False
+
+    # ── ルーティング ──
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/_stats":
+            return self._send_json(200, self.mock.stats())
+        m = re.match(r"^/v1beta/(files/[\w-]+)$", path)
+        if m:
+            return self._gemini_get_file(m.group(1))
+        self._send_json(404, {"error": {"code": 404, "message": f"not found: {path}"}})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        path = parsed.path
+        if path == "/upload/v1beta/files":
+            return self._gemini_upload(parse_qs(parsed.query))
+        m = re.match(r"^/v1beta/models/([^:]+):generateContent$", path)
+        if m:
+            return self._gemini_generate(m.group(1))
+        if path == "/v1/messages":
+            return self._anthropic_messages()
+        self._read_body()
+        self._send_json(404, {"error": {"code": 404, "message": f"not found: {path}"}})
+
+    # ── Gemini ──
+    def _gemini_upload(self, query):
+        body = self._read_body()
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if "start" in command:
+            upload_id = uuid.uuid4().hex
+            self.mock.begin_upload(upload_id, self.headers.get("X-Goog-Upload-Header-Content-Type", "image/png"))
+            host = self.headers.get("Host", f"127.0.0.1:{self.server.server_address[1]}")
+            self.send_response(200)
+            self.send_header("X-Goog-Upload-URL", f"http://{host}/upload/v1beta/files?upload_id={upload_id}")
+            self.send_header("X-Goog-Upload-Status", "active")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        upload_id = (query.get("upload_id") or [""])[0]
+        size, mime_type = self.mock.append_upload(upload_id, len(body))
+        if "finalize" not in command:
+            # 分割アップロードの途中チャンク
+            self.send_response(200)
+            self.send_header("X-Goog-Upload-Status", "active")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._sleep(self.mock.options.upload_latency)
+        if self._inject_failure("gemini"):
+            return
+        file_obj = self.mock.add_file(size, mime_type)
+        self.mock.count("gemini", "uploads")
+        self._send_json(200, {"file": file_obj}, {"X-Goog-Upload-Status": "final"})
+
+    def _gemini_get_file(self, name):
+        file_obj = self.mock.get_file(name)
+        if not file_obj:
+            return self._send_json(404, {"error": {"code": 404, "message": f"{name} not found"}})
+        self.mock.count("gemini", "file_polls")
+        self._send_json(200, file_obj)
+
+    def _gemini_generate(self, model):
+        req = json.loads(self._read_body() or b"{}")
+        self._sleep(self.mock.options.latency)
+        if self._inject_failure("gemini"):
+            return
+        prompt = "\n".join(p.get("text", "") for c in req.get("contents", []) for p in c.get("parts", []))
+        mime = (req.get("generationConfig") or {}).get("responseMimeType", "text/plain")
+        rec = self.mock.recordings
+        if mime == "application/json":
+            text = rec.next("gemini_box") or "[]"
+        elif "マークシート" in prompt and "拡大画像" in prompt:
+            text = rec.next("gemini_marks") or "(27) a, (28) c"
+        else:
+            text = rec.next("gemini_text") or _default_gemini_text(prompt)
+        self.mock.count("gemini", "generate")
+        self._send_json(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                            "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": 1200 + len(prompt) // 4,
+                              "candidatesTokenCount": len(text) // 4,
+                              "totalTokenCount": 1200 + (len(prompt) + len(text)) // 4},
+            "modelVersion": model,
+        })
+
+    # ── Anthropic ──
+    def _anthropic_messages(self):
+        req = json.loads(self._read_body() or b"{}")
+        self._sleep(self.mock.options.latency)
+        if self._inject_failure("anthropic"):
+            return
+        request_text = ""
+        for msg in req.get("messages", []):
+            content = msg.get("content", "")
+            if isinstance(content, str):
+                request_text += content
+            else:
+                request_text += "\n".join(b.get("text", "") for b in content if isinstance(b, dict))
+        text = self.mock.recordings.next("anthropic")
+        if text is None:
+            sid = re.search(r"【生徒の解答】\n[^\n]*\n(\S+)", request_text)
+            text = json.dumps(_default_grading(request_text, sid.group(1) if sid else ""), ensure_ascii=False)
+        cached = self.mock.count("anthropic", "messages") > 1
+        prompt_tokens = len(request_text) // 2
+        self._send_json(200, {
+            "id": f"msg_mock_{uuid.uuid4().hex[:12]}",
+            "type": "message",
+            "role": "assistant",
+            "model": req.get("model", "mock"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": 200,
+                "output_tokens": len(text) // 2,
+                "cache_creation_input_tokens": 0 if cached else prompt_tokens,
+                "cache_read_input_tokens": prompt_tokens if cached else 0,
+            },
+        })
+
+
+class MockServer:
+    """モックサーバー本体。start()でバックグラウンドスレッドとして起動する"""
+    def __init__(self, host="127.0.0.1", port=0, options=None):
+        self.options = options or MockOptions()
+        self.recordings = _Recordings(self.options.recordings_dir)
+        self._files = {}
+        self._uploads = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, provider, key):
+        with self._lock:
+            c = self._counts.setdefault(provider, {})
+            c[key] = c.get(key, 0) + 1
+            return c[key]
+
+    def stats(self):
+        with self._lock:
+            return json.loads(json.dumps(self._counts))
+
+    def begin_upload(self, upload_id, mime_type):
+        with self._lock:
+            self._uploads[upload_id] = [0, mime_type]
+
+    def append_upload(self, upload_id, size):
+        with self._lock:
+            u = self._uploads.setdefault(upload_id, [0, "image/png"])
+            u[0] += size
+            return u[0], u[1]
+
+    def add_file(self, size, mime_type):
+        name = f"files/{uuid.uuid4().hex[:16]}"
+        now = time.time()
+        with self._lock:
+            self._files[name] = {"ready_at": now + self.options.processing_time,
+                                 "size": size, "mime_type": mime_type}
+        return self.get_file(name)
+
+    def get_file(self, name):
+        with self._lock:
+            f = self._files.get(name)
+        if not f:
+            return None
+        state = "ACTIVE" if time.time() >= f["ready_at"] else "PROCESSING"
+        return {"name": name, "mimeType": f["mime_type"], "sizeBytes": str(f["size"]),
+                "state": state, "uri": f"{self.url}/v1beta/{name}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="オフライン用モックLLMサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="generate/messagesの平均応答秒")
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--processing-time", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--recordings", default=None, help="記録済み応答のフォルダ")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    opts = MockOptions(latency=args.latency, upload_latency=args.upload_latency,
+                       processing_time=args.processing_time, error_rate=args.error_rate,
+                       rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                       recordings_dir=args.recordings, seed=args.seed)
+    server = MockServer(args.host, args.port, opts)
+    print(f"🧪 モックLLMサーバー起動: {server.url}")
+    print(f"   → LLM_MOCK_URL={server.url} を設定して各Stepを実行してください")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
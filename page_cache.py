@@ -0,0 +1,183 @@
+"""
+レビュー画面用のページ描画キャッシュ
+- PDFハンドルのプール（ファイルごとに開きっぱなしにし、更新されたら開き直す）
+- 描画済みPNGのLRUキャッシュ（バイト数で上限管理）。キーは (path, mtime, page, zoom)
+- 前後ページ・対応するPDFのバックグラウンド先読み
+
+MuPDFはスレッドセーフではないため、描画は1つのロックで直列化する。
+PDFはbytesとして読み込んでから開く（Windowsでファイルを掴んだままにせず、
+done/ への移動や削除を妨げないため）。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import fitz
+
+DPI = 150
+
+
+class DocumentPool:
+    """開いたPDFをLRUで保持する。mtimeが変わったら開き直す"""
+    def __init__(self, max_docs=16):
+        self.max_docs = max_docs
+        self._docs = OrderedDict()  # path -> (mtime_ns, doc)
+
+    def get(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        entry = self._docs.get(path)
+        if entry and entry[0] == mtime:
+            self._docs.move_to_end(path)
+            return mtime, entry[1]
+        if entry:
+            entry[1].close()
+        with open(path, "rb") as f:
+            doc = fitz.open(stream=f.read(), filetype="pdf")
+        self._docs[path] = (mtime, doc)
+        self._docs.move_to_end(path)
+        while len(self._docs) > self.max_docs:
+            _, (_, old) = self._docs.popitem(last=False)
+            old.close()
+        return mtime, doc
+
+    def close_all(self):
+        for _, doc in self._docs.values():
+            doc.close()
+        self._docs.clear()
+
+
+class PageRenderCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_docs=16):
+        self.max_bytes = max_bytes
+        self._pool = DocumentPool(max_docs)
+        self._pages = OrderedDict()  # (path, mtime, page, zoom) -> (png, total_pages)
+        self._bytes = 0
+        self._render_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self._queue = []  # 先読み待ち。新しい要求ほど後ろ（後ろから処理する）
+        self._cond = threading.Condition()
+        self._worker = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._worker.start()
+
+    # ── 取得 ──
+
+    def get(self, path, page_idx=0, zoom=1.0):
+        """(PNGのbytes, 実際のページ番号, 総ページ数) を返す。ページ番号は範囲内に丸める"""
+        path = os.path.abspath(path)
+        zoom = round(float(zoom), 3)
+        with self._render_lock:
+            mtime, doc = self._pool.get(path)
+            total = len(doc)
+            page_idx = max(0, min(int(page_idx), total - 1))
+            key = (path, mtime, page_idx, zoom)
+            with self._lock:
+                hit = self._pages.get(key)
+                if hit:
+                    self._pages.move_to_end(key)
+                    self.hits += 1
+                    return hit[0], page_idx, total
+                self.misses += 1
+            png = self._render(doc, page_idx, zoom)
+        self._put(key, png, total)
+        return png, page_idx, total
+
+    def page_count(self, path):
+        """(mtime_ns, 総ページ数) を返す（描画はしない）"""
+        with self._render_lock:
+            mtime, doc = self._pool.get(os.path.abspath(path))
+            return mtime, len(doc)
+
+    def get_tile(self, path, page_idx, zoom, tx, ty, size=512):
+        """拡大表示用のタイル（size×size px）をPNGで返す。範囲外ならNone"""
+        path = os.path.abspath(path)
+        zoom = round(float(zoom), 3)
+        scale = zoom * DPI / 72
+        with self._render_lock:
+            mtime, doc = self._pool.get(path)
+            if not 0 <= page_idx < len(doc):
+                return None
+            key = (path, mtime, page_idx, zoom, "tile", tx, ty, size)
+            with self._lock:
+                hit = self._pages.get(key)
+                if hit:
+                    self._pages.move_to_end(key)
+                    self.hits += 1
+                    return hit[0]
+                self.misses += 1
+            page = doc[page_idx]
+            clip = fitz.Rect(tx * size / scale, ty * size / scale,
+                             (tx + 1) * size / scale, (ty + 1) * size / scale) & page.rect
+            if clip.is_empty:
+                return None
+            png = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=clip).tobytes("png")
+        self._put(key, png, len(doc))
+        return png
+
+    def _render(self, doc, page_idx, zoom):
+        mat = fitz.Matrix(zoom * DPI / 72, zoom * DPI / 72)
+        return doc[page_idx].get_pixmap(matrix=mat).tobytes("png")
+
+    def _put(self, key, png, total):
+        with self._lock:
+            if key in self._pages:
+                return
+            self._pages[key] = (png, total)
+            self._bytes += len(png)
+            while self._bytes > self.max_bytes and len(self._pages) > 1:
+                _, (old, _) = self._pages.popitem(last=False)
+                self._bytes -= len(old)
+
+    def _cached(self, path, page_idx, zoom):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return True  # 存在しないファイルは先読みしない
+        with self._lock:
+            return (path, mtime, page_idx, round(float(zoom), 3)) in self._pages
+
+    # ── 先読み ──
+
+    def prefetch(self, targets):
+        """targets: [(path, page_idx, zoom), ...] を先読みキューに積む（古い要求より優先）"""
+        with self._cond:
+            for t in reversed(targets):
+                path, page_idx, zoom = os.path.abspath(t[0]), t[1], t[2]
+                if page_idx < 0:
+                    continue
+                item = (path, page_idx, zoom)
+                if item in self._queue:
+                    self._queue.remove(item)
+                self._queue.append(item)
+            del self._queue[:-64]  # 溜まりすぎた古い要求は捨てる
+            self._cond.notify()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                path, page_idx, zoom = self._queue.pop()
+            if self._cached(path, page_idx, zoom):
+                continue
+            try:
+                with self._render_lock:
+                    mtime, doc = self._pool.get(path)
+                    if page_idx >= len(doc):
+                        continue
+                    png = self._render(doc, page_idx, zoom)
+                self._put((path, mtime, page_idx, round(float(zoom), 3)), png, len(doc))
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"pages": len(self._pages), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._render_lock, self._lock:
+            self._pages.clear()
+            self._bytes = 0
+            self._pool.close_all()
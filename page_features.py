@@ -0,0 +1,89 @@
+"""
+ページ画像の特徴量（NumPy）
+答案PDFのページを低解像度のグレースケールで描画し、LLMを呼ばずに手元で判定するための小さな関数群。
+300dpiで描画する Step1 と違い、36dpi程度で十分なので1ページ数ミリ秒で済む。
+
+    render_gray   ページ（または clip の範囲）をグレースケールの ndarray にする
+    ink_coverage  インクの割合
+    ink_contrast  紙の地の色より十分暗い画素の割合（白紙判定用）
+    is_blank      白紙ページの判定（batch_splitter.py と Step1 で共通）
+    dhash         差分ハッシュ（ほぼ同じページ・同じ用紙のヘッダーの判定用）
+    hamming       ハッシュ同士のビットの違いの数
+
+batch_splitter.py（一括スキャンの分割）と Step1 の白紙・重複ページ除外で使う。
+
+    pip install numpy
+"""
+import fitz
+import numpy as np
+
+DEFAULT_DPI = 36
+INK_THRESHOLD = 160  # これより暗い画素をインクとみなす（0=黒, 255=白）
+# 白紙判定。36dpiでは細い線や鉛筆の字がにじんで INK_THRESHOLD より明るくなり、記入済みのスキャン答案でも
+# ink_coverage が 0.001 前後になるので、絶対的な暗さではなく紙の地の色（中央値）との差で数える。
+# 合成答案（sheet_generator.py、スキャン相当を含む）は 0.015 以上、灰色の紙・裏写り・縁の影だけのページは 0、
+# 1行だけ書いたページで 0.0005 程度
+BLANK_CONTRAST = 40       # 地の色よりこれだけ暗い画素をインクとみなす
+BLANK_COVERAGE = 0.0002   # その割合がこれ未満なら白紙
+
+
+def render_gray(page, dpi=DEFAULT_DPI, clip=None):
+    """ページを (高さ, 幅) の uint8 配列として描画する。clip は fitz.Rect（PDF座標）"""
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, clip=clip, alpha=False)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return arr[:, :pix.width].copy()
+
+
+def top_band(page, fraction):
+    """ページ上部 fraction の範囲（ヘッダー部分）の矩形"""
+    r = page.rect
+    return fitz.Rect(r.x0, r.y0, r.x1, r.y0 + r.height * fraction)
+
+
+def ink_coverage(gray, threshold=INK_THRESHOLD, margin=0.03):
+    """インクの画素の割合（0〜1）。スキャナーの縁の影を拾わないよう周囲 margin を除く"""
+    h, w = gray.shape
+    dy, dx = int(h * margin), int(w * margin)
+    core = gray[dy:h - dy or None, dx:w - dx or None]
+    if core.size == 0:
+        return 0.0
+    return float(np.count_nonzero(core < threshold)) / core.size
+
+
+def ink_contrast(gray, delta=BLANK_CONTRAST, margin=0.03):
+    """紙の地の色（中央値）より delta 以上暗い画素の割合（0〜1）。周囲 margin は除く"""
+    h, w = gray.shape
+    dy, dx = int(h * margin), int(w * margin)
+    core = gray[dy:h - dy or None, dx:w - dx or None]
+    if core.size == 0:
+        return 0.0
+    background = int(np.median(core))
+    return float(np.count_nonzero(core < background - delta)) / core.size
+
+
+def is_blank(gray, threshold=BLANK_COVERAGE):
+    """白紙ページなら True（gray は render_gray の結果。既定の36dpiで判定値を決めてある）"""
+    return ink_contrast(gray) < threshold
+
+
+def _shrink(gray, width, height):
+    """面積平均で (height, width) に縮小する"""
+    h, w = gray.shape
+    ys = np.linspace(0, h, height + 1).astype(int)
+    xs = np.linspace(0, w, width + 1).astype(int)
+    ys[-1], xs[-1] = h, w
+    rows = np.add.reduceat(gray.astype(np.float32), ys[:-1], axis=0)
+    cells = np.add.reduceat(rows, xs[:-1], axis=1)
+    counts = np.outer(np.diff(ys), np.diff(xs)).clip(min=1)
+    return cells / counts
+
+
+def dhash(gray, size=8):
+    """差分ハッシュ（size*size ビットの int）。明るさ・わずかなずれに強い"""
+    small = _shrink(gray, size + 1, size)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
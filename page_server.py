@@ -0,0 +1,121 @@
+"""
+ページ画像のローカルHTTPサーバー
+描画済みのページ・タイルをPNGのままHTTPで配信する。pywebviewのJSブリッジに
+base64のdata URLを流さず、フロントエンドは <img src> にURLを渡すだけでよい。
+
+    /page?path=...&page=0&zoom=1.0&v=<mtime>&t=<token>
+    /tile?path=...&page=0&zoom=4.0&tx=0&ty=0&size=512&v=<mtime>&t=<token>
+
+- 127.0.0.1 のみで待ち受け、起動ごとのトークンを持たないリクエストは拒否する
+- 配信できるのは allowed_roots 配下のPDFだけ
+- URLに mtime を含めるので、レスポンスは immutable としてブラウザにキャッシュさせる
+"""
+import os
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="text/plain; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        srv = self.server.page_server
+        parsed = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if not secrets.compare_digest(q.get("t", ""), srv.token):
+            return self._send(403, b"forbidden")
+        path = srv.resolve(q.get("path", ""))
+        if not path:
+            return self._send(404, b"not found")
+        try:
+            page = int(q.get("page", 0))
+            zoom = float(q.get("zoom", 1.0))
+            etag = f'"{q.get("v", "")}-{page}-{zoom}-{q.get("tx", "")}-{q.get("ty", "")}-{q.get("size", "")}"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, headers={"ETag": etag})
+            if parsed.path == "/page":
+                png, _, _ = srv.cache.get(path, page, zoom)
+            elif parsed.path == "/tile":
+                png = srv.cache.get_tile(path, page, zoom, int(q.get("tx", 0)), int(q.get("ty", 0)),
+                                         int(q.get("size", 512)))
+                if png is None:
+                    return self._send(404, b"tile out of range")
+            else:
+                return self._send(404, b"not found")
+        except (ValueError, OSError) as e:
+            return self._send(400, str(e).encode("utf-8"))
+        self._send(200, png, "image/png", {
+            "ETag": etag,
+            "Cache-Control": "private, max-age=31536000, immutable",
+        })
+
+
+class PageServer:
+    def __init__(self, cache, allowed_roots, host="127.0.0.1", port=0, public_host=None):
+        self.cache = cache
+        self.public_host = public_host  # URLに使うホスト名（0.0.0.0 で待ち受ける場合など）
+        self.token = secrets.token_urlsafe(16)
+        self._roots = allowed_roots  # 呼び出し時に評価する（設定変更に追従するため）
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.page_server = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{self.public_host or host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def resolve(self, path):
+        """許可されたフォルダ配下の既存PDFなら絶対パスを、そうでなければNoneを返す"""
+        if not path or not path.lower().endswith(".pdf"):
+            return None
+        real = os.path.realpath(path)
+        roots = self._roots() if callable(self._roots) else self._roots
+        for root in roots:
+            root = os.path.realpath(root)
+            try:
+                inside = os.path.commonpath([real, root]) == root
+            except ValueError:  # Windowsでドライブが違う場合
+                inside = False
+            if inside and os.path.isfile(real):
+                return real
+        return None
+
+    def page_url(self, path, page, zoom, mtime):
+        query = urlencode({"path": os.path.abspath(path), "page": page, "zoom": zoom, "v": mtime, "t": self.token})
+        return f"{self.base_url}/page?{query}"
+
+    def tile_url_template(self, path, page, zoom, mtime, size=512):
+        """{tx}・{ty} をフロントエンドで置き換えて使うタイルURL"""
+        query = urlencode({"path": os.path.abspath(path), "page": page, "zoom": zoom, "size": size,
+                           "v": mtime, "t": self.token})
+        return f"{self.base_url}/tile?{query}&tx={{tx}}&ty={{ty}}"
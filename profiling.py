@@ -0,0 +1,253 @@
+"""
+Stepスクリプトのプロファイリング（任意）
+バッチが遅いときに、時間が pdf_to_images のPNG書き出しなのか、write_to_pdf の add_freetext_annot なのか、
+ネットワーク待ちなのかを切り分けるためのもの。普段はオフで、何もしない。
+
+有効にする方法（どちらか）:
+    環境変数  GRADING_PROFILE=cprofile,memory
+    config.json  "profile": "sample"          （backend の set_profiling() からも切り替えられる）
+
+モード（カンマ区切りで組み合わせる。"1" / "true" は cprofile,memory と同じ）:
+    cprofile  関数ごとの呼び出し回数・時間（決定的。オーバーヘッドが大きめ）
+    sample    一定間隔でスタックを記録するサンプリング（オーバーヘッドが小さい。
+              ソケット待ちなど、処理が止まっている場所も記録される）
+    memory    tracemalloc でメモリ確保の多い行とピーク使用量を記録
+
+cprofile と sample は、with の中で開始したスレッド（Step1の ThreadPoolExecutor のワーカーなど）も記録する。
+with に入る前から動いているスレッドは、Python 3.12 以降の cprofile でだけ記録される。
+
+実行ごとに profiles/ に書き出し、上位N件（config.json の "profile_top"、既定15）をログに表示する。
+    <時刻>_<名前>_<pid>.prof     cProfile（python -m pstats / snakeviz で開ける）
+    <時刻>_<名前>_<pid>.folded   サンプリング結果（flamegraph.pl / speedscope で開ける）
+    <時刻>_<名前>_<pid>_mem.txt  メモリ確保の多い行
+"""
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+ENV_FLAG = "GRADING_PROFILE"
+MODES = ("cprofile", "sample", "memory")
+SAMPLE_INTERVAL = 0.005
+
+
+def _config():
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def parse_modes(value):
+    """"cprofile,memory" → {"cprofile", "memory"}。"1" / "true" は cprofile と memory"""
+    value = str(value or "").strip().lower()
+    if value in ("", "0", "off", "false", "none"):
+        return set()
+    if value in ("1", "on", "true", "yes"):
+        return {"cprofile", "memory"}
+    return {m.strip() for m in value.split(",") if m.strip() in MODES}
+
+
+def modes():
+    """有効なモード（環境変数が config.json より優先）"""
+    if os.environ.get(ENV_FLAG) is not None:
+        return parse_modes(os.environ[ENV_FLAG])
+    return parse_modes(_config().get("profile"))
+
+
+class StackSampler:
+    """対象スレッド（all_threads なら自分以外の全スレッド）のスタックを interval 秒ごとに記録する"""
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL, all_threads=False):
+        self.thread_id = thread_id or threading.get_ident()
+        self.all_threads = all_threads
+        self.interval = interval
+        self.stacks = Counter()  # (frame, ...)（外側から順）-> サンプル数
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            if self.all_threads:
+                targets = [f for tid, f in frames.items() if tid != own]
+            else:
+                targets = [frames[self.thread_id]] if self.thread_id in frames else []
+            for frame in targets:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[tuple(reversed(stack))] += 1
+                self.samples += 1  # スレッドごとに1サンプル（割合はスレッドの延べ時間に対するもの）
+
+    def folded(self):
+        """flamegraph 用の「外側;...;内側 件数」形式"""
+        return "\n".join(f"{';'.join(stack)} {n}" for stack, n in self.stacks.most_common()) + "\n"
+
+    def top(self, n):
+        """(自身で止まっていた割合の上位, スタックに含まれていた割合の上位)"""
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[_strip_line(stack[-1])] += count
+            for name in {_strip_line(f) for f in stack}:
+                inclusive[name] += count
+        return own.most_common(n), inclusive.most_common(n)
+
+
+class _ThreadProfiles:
+    """
+    with の中で開始したスレッドにも cProfile を付ける（Python 3.11 以前の cProfile は呼び出したスレッドしか
+    記録しないため）。3.12 以降は cProfile が全スレッドを記録し、2つ目のプロファイラは有効にできないので使わない
+    """
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.setprofile(self._hook)
+        return self
+
+    def stop(self):
+        threading.setprofile(None)
+
+    def _hook(self, frame, event, arg):
+        # 新しいスレッドの最初のイベントで呼ばれる。以降はそのスレッド専用の cProfile に任せる
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profiler)
+        profiler.enable()
+
+
+def _strip_line(frame_label):
+    """"fn (file.py:12)" → "fn (file.py)"（行番号違いを同じ関数にまとめる）"""
+    head, _, rest = frame_label.rpartition(":")
+    return f"{head})" if rest.endswith(")") else frame_label
+
+
+@contextmanager
+def profile_run(name, enabled_modes=None):
+    """with の中の処理をプロファイルする。モードが空なら何もしない"""
+    active = modes() if enabled_modes is None else set(enabled_modes)
+    if not active:
+        yield
+        return
+
+    top_n = int(_config().get("profile_top", 15))
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{datetime.now():%Y%m%d_%H%M%S}_{name}_{os.getpid()}")
+    profiler = cProfile.Profile() if "cprofile" in active else None
+    threads = _ThreadProfiles().start() if profiler and sys.version_info < (3, 12) else None
+    sampler = StackSampler(all_threads=True) if "sample" in active else None
+    tracing = "memory" in active and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start(10)
+    if sampler:
+        sampler.start()
+    if profiler:
+        profiler.enable()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        if profiler:
+            profiler.disable()
+        if threads:
+            threads.stop()
+        if sampler:
+            sampler.stop()
+        mem = None
+        if tracing:
+            mem = (tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        try:
+            _report(name, stem, elapsed, top_n, _merge(profiler, threads), sampler, mem)
+        except Exception as e:
+            print(f"⚠️ プロファイル結果を書き出せませんでした: {e}")
+
+
+def _merge(profiler, threads):
+    """メインスレッドと各スレッドの cProfile の結果を1つの pstats.Stats にまとめる"""
+    if profiler is None:
+        return None
+    stats = pstats.Stats(profiler)
+    for p in threads.profiles if threads else []:
+        p.disable()  # 終わっていないスレッドの分も、ここまでの結果を使う
+        stats.add(p)
+    return stats
+
+
+def _report(name, stem, elapsed, top_n, stats, sampler, mem):
+    print(f"🔬 プロファイル: {name}（{elapsed:.1f}秒）")
+    if stats:
+        path = f"{stem}.prof"
+        stats.dump_stats(path)
+        rows = sorted(stats.stats.items(), key=lambda kv: -kv[1][2])[:top_n]  # tottime 順
+        print(f"   [cProfile] 自身の処理時間の上位（{os.path.basename(path)}）")
+        for (filename, line, func), (cc, nc, tt, ct, _) in rows:
+            print(f"   {tt:8.3f}s  cum {ct:8.3f}s  ×{nc:<6d} {func} ({os.path.basename(filename)}:{line})")
+    if sampler:
+        path = f"{stem}.folded"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(sampler.folded())
+        own, inclusive = sampler.top(top_n)
+        total = max(sampler.samples, 1)
+        print(f"   [sample] {sampler.samples}サンプル、止まっていた場所の上位（{os.path.basename(path)}）")
+        for label, n in own:
+            print(f"   {100 * n / total:5.1f}%  {label}")
+        print("   [sample] 呼び出し中だった関数の上位")
+        for label, n in inclusive:
+            print(f"   {100 * n / total:5.1f}%  {label}")
+    if mem:
+        snapshot, peak = mem
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        stats = snapshot.statistics("lineno")
+        path = f"{stem}_mem.txt"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"peak {peak / 1024 / 1024:.1f} MiB\n")
+            for s in stats[:100]:
+                f.write(f"{s}\n")
+        print(f"   [memory] ピーク {peak / 1024 / 1024:.1f}MiB、確保の多い行（{os.path.basename(path)}）")
+        for s in stats[:top_n]:
+            frame = s.traceback[0]
+            print(f"   {s.size / 1024 / 1024:8.2f}MiB  ×{s.count:<7d} {os.path.basename(frame.filename)}:{frame.lineno}")
+
+
+def profiled(name):
+    """main() に付けるデコレーター。有効なときだけ profile_run で包む"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile_run(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
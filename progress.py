@@ -0,0 +1,116 @@
+"""
+進捗イベント（JSON lines）
+Stepスクリプトは進捗を emit() で出す。backend から起動されたとき（環境変数 GRADING_EVENTS=1）は
+1行1JSONのイベントとして、コマンドラインから直接実行したときは従来どおりの進捗バーとして表示する。
+
+    @@event {"event": "file", "stage": "step1", "file": "a.pdf", "index": 3, "total": 40, "status": "done", "seconds": 4.2}
+
+イベントの種類:
+    stage_start  stage, total
+    file         stage, file, index, total, status（done / skip / error）, seconds ほか任意
+    stage_end    stage, done, skipped, errors, seconds
+
+backend側では UiBatcher がログとイベントをまとめ、一定間隔で window.updateEvents() に1回で渡す。
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+EVENT_PREFIX = "@@event "
+ENV_FLAG = "GRADING_EVENTS"
+
+
+def enabled():
+    return os.environ.get(ENV_FLAG) == "1"
+
+
+def _bar(index, total, length=30):
+    total = max(total, 1)
+    filled = int(length * index // total)
+    return f"|{'█' * filled}{'-' * (length - filled)}| {100 * index / total:.1f}%"
+
+
+def emit(event, **fields):
+    """イベントを1件出力する"""
+    if enabled():
+        payload = {"event": event, "t": round(time.time(), 3), **fields}
+        print(EVENT_PREFIX + json.dumps(payload, ensure_ascii=False))
+    elif event == "stage_start":
+        print(f"Progress: {_bar(0, fields.get('total', 0))} Start")
+    elif event == "file":
+        label = f"{fields.get('status', 'done').capitalize()} ({fields.get('file', '')})"
+        if len(label) > 20:
+            label = label[:17] + "..."
+        print(f"Progress: {_bar(fields.get('index', 0), fields.get('total', 0))} {label}")
+    sys.stdout.flush()
+
+
+def parse(line):
+    """イベント行ならdictを、そうでなければNoneを返す"""
+    if not line.startswith(EVENT_PREFIX):
+        return None
+    try:
+        return json.loads(line[len(EVENT_PREFIX):])
+    except ValueError:
+        return None
+
+
+class UiBatcher:
+    """
+    ログ行とイベントを溜めて、最大 rate 回/秒で sink(batch) に渡す。
+    batch = {"logs": [...], "events": [...]}。同じファイルの file イベントは最新の1件にまとめる。
+    """
+    def __init__(self, sink, rate=10.0):
+        self.sink = sink
+        self.interval = 1.0 / rate
+        self._logs = []
+        self._events = []
+        self._file_slots = {}  # (stage, file) -> self._events 内の位置
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def log(self, msg):
+        with self._cond:
+            self._logs.append(msg)
+            self._cond.notify()
+
+    def event(self, ev):
+        with self._cond:
+            if ev.get("event") == "file":
+                key = (ev.get("stage"), ev.get("file"))
+                slot = self._file_slots.get(key)
+                if slot is not None:
+                    self._events[slot] = ev
+                    return
+                self._file_slots[key] = len(self._events)
+            self._events.append(ev)
+            self._cond.notify()
+
+    def _take(self):
+        batch = {"logs": self._logs, "events": self._events}
+        self._logs, self._events, self._file_slots = [], [], {}
+        return batch
+
+    def flush(self):
+        with self._cond:
+            if not self._logs and not self._events:
+                return
+            batch = self._take()
+        self._send(batch)
+
+    def _send(self, batch):
+        try:
+            self.sink(batch)
+        except Exception:
+            pass
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._logs and not self._events:
+                    self._cond.wait()
+            time.sleep(self.interval)  # この間に届いた分をまとめて送る
+            self.flush()
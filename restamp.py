@@ -0,0 +1,139 @@
+"""
+再印字専用コマンド
+採点結果ストア（results_store.py）に保存済みの採点結果dictから、
+write_to_pdf だけを並列で実行して採点済みPDFを作り直す。APIは一切呼ばない。
+coord_db の座標を直したときや採点者名を変えたときに使う。
+
+元の答案PDFは inputs/ → done/YYYYMMDD/ の順に探す。
+
+使い方:
+    python restamp.py                       # 直近の実行（run）を再印字
+    python restamp.py --run 20260301_101500
+    python restamp.py --master 2025_1_1 --latest
+    python restamp.py --all --latest --out ./restamped
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import progress
+import results_store
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+def _config():
+    cfg = {"input_dir": "./inputs", "output_dir": "./step3_final", "done_dir": "./done"}
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    except Exception:
+        pass
+    return cfg
+
+
+def index_source_pdfs(input_dir, done_dir):
+    """答案PDFのベース名 → パス。inputs/ を優先し、done/ は新しい日付を優先する"""
+    index = {}
+    folders = [input_dir]
+    if os.path.isdir(done_dir):
+        folders += [os.path.join(done_dir, d) for d in sorted(os.listdir(done_dir), reverse=True)
+                    if len(d) == 8 and d.isdigit()]
+    for folder in folders:
+        for pdf in glob.glob(os.path.join(folder, "*.pdf")):
+            index.setdefault(os.path.splitext(os.path.basename(pdf))[0], pdf)
+    return index
+
+
+def _stamp_one(args):
+    data, master_id, pdf_path, output_dir = args
+    import step2_and3_combined as step23
+    t0 = time.perf_counter()
+    ok = step23.write_to_pdf(data, master_id, pdf_path, None, output_dir=output_dir)
+    return ok, time.perf_counter() - t0
+
+
+def restamp(rows, source_index, output_dir, workers=None):
+    """rows（ストアの行）を並列で再印字し、(成功数, 見つからない答案名リスト, 失敗した答案名リスト) を返す"""
+    jobs, missing, failed = {}, [], []
+    for row in rows:
+        pdf = source_index.get(row["sheet"])
+        if not pdf:
+            missing.append(row["sheet"])
+            continue
+        jobs[row["sheet"]] = (row["data"], row["master_id"], pdf, output_dir)
+    ok_count = 0
+    t0 = time.perf_counter()
+    workers = workers or min(os.cpu_count() or 1, 8)
+    progress.emit("stage_start", stage="restamp", total=len(jobs))
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = {ex.submit(_stamp_one, job): sheet for sheet, job in jobs.items()}
+        for done, fut in enumerate(as_completed(futures), 1):
+            sheet = futures[fut]
+            seconds = None
+            try:
+                ok, seconds = fut.result()
+            except Exception as e:
+                print(f"⚠️ 再印字エラー ({sheet}): {e}")
+                ok = False
+            if ok:
+                ok_count += 1
+            else:
+                failed.append(sheet)
+            progress.emit("file", stage="restamp", file=f"{sheet}.pdf", index=done, total=len(jobs),
+                          status="done" if ok else "error",
+                          seconds=round(seconds, 2) if seconds is not None else None)
+    progress.emit("stage_end", stage="restamp", done=ok_count, skipped=len(missing), errors=len(failed),
+                  seconds=round(time.perf_counter() - t0, 1))
+    return ok_count, missing, failed
+
+
+def main():
+    cfg = _config()
+    parser = argparse.ArgumentParser(description="保存済みの採点結果からPDFを再印字する（API呼び出しなし）")
+    parser.add_argument("--db", default=None, help="採点結果ストアのSQLiteファイル")
+    parser.add_argument("--run", default=None, help="実行ID（省略時は直近の実行）")
+    parser.add_argument("--master", default=None, help="マスターIDで絞り込む")
+    parser.add_argument("--student", default=None, help="生徒番号で絞り込む")
+    parser.add_argument("--all", action="store_true", help="実行IDで絞り込まない")
+    parser.add_argument("--latest", action="store_true", help="答案ごとに最新の結果だけを使う")
+    parser.add_argument("--out", default=cfg["output_dir"], help="出力フォルダ")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    with results_store.ResultsStore(args.db) as store:
+        run_id = args.run
+        if not run_id and not args.all and not args.master and not args.student:
+            runs = store.runs()
+            if not runs:
+                print("❌ 採点結果ストアに結果がありません。先にStep2/3を実行してください。")
+                sys.exit(1)
+            run_id = runs[0]["run_id"]
+        rows = store.find(run_id=run_id, master_id=args.master, student_id=args.student,
+                          latest_only=args.latest or args.all)
+
+    if not rows:
+        print("❌ 条件に合う採点結果がありません。")
+        sys.exit(1)
+
+    label = f"実行 {run_id}" if run_id else "保存済みの結果"
+    print(f"🖨️ {label} の {len(rows)}件を再印字します → {args.out}")
+    source_index = index_source_pdfs(cfg["input_dir"], cfg["done_dir"])
+    ok_count, missing, failed = restamp(rows, source_index, args.out, workers=args.workers)
+
+    for sheet in missing:
+        print(f"⚠️ 元のPDFが見つかりません: {sheet}.pdf")
+    print(f"\n✨ 再印字完了！ 成功:{ok_count}件 元PDFなし:{len(missing)}件 エラー:{len(failed)}件 | "
+          f"所要時間: {time.time() - start:.1f}秒")
+    if ok_count == 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
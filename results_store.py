@@ -0,0 +1,249 @@
+"""
+採点結果ストア（SQLite）
+Step2の採点結果dictを、マスターID・モデル・トークン使用量・所要時間と一緒に保存する。
+PDFへの再印字・集計・監査のたびにAPIを呼び直したりPDFを解析したりしなくて済むようにする。
+
+生徒番号・マスターID・答案名・実行IDにインデックスを張っているので、
+それぞれの検索は件数が増えても O(log n) で済む。
+
+使い方:
+    python results_store.py runs
+    python results_store.py show --student 55615210
+    python results_store.py export --format csv --master 2025_1_1 --out scores.csv
+    python results_store.py export --format jsonl --out all_results.jsonl
+"""
+import os
+import sys
+import csv
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+DEFAULT_DB_PATH = "./results.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id                    INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id                TEXT NOT NULL,
+    sheet                 TEXT NOT NULL,
+    student_id            TEXT,
+    master_id             TEXT NOT NULL,
+    model                 TEXT,
+    input_tokens          INTEGER,
+    output_tokens         INTEGER,
+    cache_read_tokens     INTEGER,
+    cache_creation_tokens INTEGER,
+    grade_seconds         REAL,
+    stamp_seconds         REAL,
+    total_score           REAL,
+    total_max             REAL,
+    stamped               INTEGER NOT NULL DEFAULT 0,
+    data                  TEXT NOT NULL,
+    created_at            TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_student ON results(student_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_master  ON results(master_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_sheet   ON results(sheet, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_run     ON results(run_id);
+"""
+
+_COLUMNS = ["id", "run_id", "sheet", "student_id", "master_id", "model",
+            "input_tokens", "output_tokens", "cache_read_tokens", "cache_creation_tokens",
+            "grade_seconds", "stamp_seconds", "total_score", "total_max", "stamped", "created_at"]
+
+
+def default_db_path() -> str:
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f).get("results_db", DEFAULT_DB_PATH)
+    except Exception:
+        return DEFAULT_DB_PATH
+
+
+def new_run_id() -> str:
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def totals(data):
+    """採点結果dictから (合計点, 満点) を計算する（write_to_pdf と同じ集計）"""
+    total_score, total_max = 0, 0
+    for q_val in data.get("questions", {}).values():
+        total_score += q_val.get("score", 0) or 0
+        total_max += int(q_val.get("max", 0) or 0)
+    return total_score, total_max
+
+
+class ResultsStore:
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        d = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # ── 書き込み ──
+
+    def save(self, run_id, sheet, master_id, data, student_id=None, model=None, usage=None,
+             grade_seconds=None, stamp_seconds=None, stamped=False) -> int:
+        """採点結果を1件保存し、行IDを返す"""
+        usage = usage or {}
+        total_score, total_max = totals(data)
+        student_id = student_id or data.get("student_id") or None
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO results (run_id, sheet, student_id, master_id, model, input_tokens, output_tokens,"
+                " cache_read_tokens, cache_creation_tokens, grade_seconds, stamp_seconds, total_score, total_max,"
+                " stamped, data, created_at) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                (run_id, sheet, student_id, master_id, model,
+                 usage.get("input_tokens"), usage.get("output_tokens"),
+                 usage.get("cache_read_input_tokens"), usage.get("cache_creation_input_tokens"),
+                 grade_seconds, stamp_seconds, total_score, total_max, int(bool(stamped)),
+                 json.dumps(data, ensure_ascii=False), datetime.now().isoformat(timespec="seconds")))
+            return cur.lastrowid
+
+    def mark_stamped(self, row_id, stamp_seconds=None):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE results SET stamped = 1, stamp_seconds = COALESCE(?, stamp_seconds) WHERE id = ?",
+                               (stamp_seconds, row_id))
+
+    # ── 読み出し ──
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [self._row(r) for r in self._conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def _row(r):
+        row = dict(r)
+        if "data" in row:
+            row["data"] = json.loads(row["data"])
+        return row
+
+    def get(self, row_id):
+        rows = self._query("SELECT * FROM results WHERE id = ?", (row_id,))
+        return rows[0] if rows else None
+
+    def by_student(self, student_id):
+        return self._query("SELECT * FROM results WHERE student_id = ? ORDER BY created_at", (student_id,))
+
+    def by_master(self, master_id):
+        return self._query("SELECT * FROM results WHERE master_id = ? ORDER BY created_at", (master_id,))
+
+    def by_run(self, run_id):
+        return self._query("SELECT * FROM results WHERE run_id = ? ORDER BY id", (run_id,))
+
+    def latest_by_sheet(self, sheet):
+        rows = self._query("SELECT * FROM results WHERE sheet = ? ORDER BY created_at DESC, id DESC LIMIT 1", (sheet,))
+        return rows[0] if rows else None
+
+    def find(self, run_id=None, master_id=None, student_id=None, since=None, latest_only=False):
+        """条件で絞り込む。latest_only=True なら答案ごとに最新の1件だけ返す"""
+        where, params = [], []
+        for col, val in (("run_id", run_id), ("master_id", master_id), ("student_id", student_id)):
+            if val:
+                where.append(f"{col} = ?")
+                params.append(val)
+        if since:
+            where.append("created_at >= ?")
+            params.append(since)
+        cond = f"WHERE {' AND '.join(where)}" if where else ""
+        if latest_only:
+            sql = (f"SELECT * FROM results WHERE id IN ("
+                   f"SELECT MAX(id) FROM results {cond} GROUP BY sheet) ORDER BY id")
+        else:
+            sql = f"SELECT * FROM results {cond} ORDER BY id"
+        return self._query(sql, params)
+
+    def runs(self):
+        return self._query(
+            "SELECT run_id, COUNT(*) AS count, MIN(created_at) AS started, MAX(created_at) AS finished,"
+            " SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens,"
+            " SUM(cache_read_tokens) AS cache_read_tokens FROM results GROUP BY run_id ORDER BY started DESC")
+
+    # ── 一括エクスポート ──
+
+    def export(self, fh, fmt="jsonl", **filters) -> int:
+        """絞り込んだ結果を fh に書き出し、件数を返す（fmt: jsonl / csv）"""
+        rows = self.find(**filters)
+        if fmt == "jsonl":
+            for row in rows:
+                fh.write(json.dumps(row, ensure_ascii=False) + "\n")
+        elif fmt == "csv":
+            q_keys = []
+            for row in rows:
+                for k in row["data"].get("questions", {}):
+                    if k not in q_keys:
+                        q_keys.append(k)
+            writer = csv.writer(fh)
+            writer.writerow(_COLUMNS + [f"score_{k}" for k in q_keys] + [f"max_{k}" for k in q_keys])
+            for row in rows:
+                qs = row["data"].get("questions", {})
+                writer.writerow([row[c] for c in _COLUMNS]
+                                + [qs.get(k, {}).get("score", "") for k in q_keys]
+                                + [qs.get(k, {}).get("max", "") for k in q_keys])
+        else:
+            raise ValueError(f"未対応の形式: {fmt}")
+        return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="採点結果ストアの参照・エクスポート")
+    parser.add_argument("--db", default=None, help="SQLiteファイル（省略時はconfig.jsonのresults_db）")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    sub.add_parser("runs", help="実行ごとの件数・トークン数を表示")
+
+    p_show = sub.add_parser("show", help="生徒・マスター・実行IDで検索して表示")
+    p_exp = sub.add_parser("export", help="CSVまたはJSON Linesで書き出す")
+    for p in (p_show, p_exp):
+        p.add_argument("--student", default=None)
+        p.add_argument("--master", default=None)
+        p.add_argument("--run", default=None)
+        p.add_argument("--since", default=None, help="この日時以降（ISO形式）")
+        p.add_argument("--latest", action="store_true", help="答案ごとに最新の1件だけ")
+    p_exp.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    p_exp.add_argument("--out", default=None, help="出力ファイル（省略時は標準出力）")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.cmd == "runs":
+            for r in store.runs():
+                print(f"{r['run_id']}  {r['count']:>5}件  {r['started']} 〜 {r['finished']}  "
+                      f"in:{r['input_tokens'] or 0} out:{r['output_tokens'] or 0} cache:{r['cache_read_tokens'] or 0}")
+            return
+        filters = dict(run_id=args.run, master_id=args.master, student_id=args.student,
+                       since=args.since, latest_only=args.latest)
+        if args.cmd == "show":
+            for r in store.find(**filters):
+                print(f"#{r['id']}  {r['created_at']}  {r['sheet']}  生徒:{r['student_id']}  "
+                      f"{r['master_id']}  {r['total_score']:g}／{r['total_max']:g}")
+            return
+        if args.out:
+            with open(args.out, "w", encoding="utf-8", newline="") as f:
+                n = store.export(f, args.format, **filters)
+            print(f"💾 {n}件を {args.out} に書き出しました")
+        else:
+            store.export(sys.stdout, args.format, **filters)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
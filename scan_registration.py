@@ -0,0 +1,450 @@
+"""
+スキャンの位置合わせ（NumPy）
+coord_db の座標は coordinate_picker.py で開いたPDF（参照PDF）の上で取ったもので、
+実際のスキャンは数ミリずれたり傾いたりしている。そのまま印字すると枠からはみ出すので、
+ページごとに参照PDFとのアフィン変換を推定し、座標を変換してから使う。
+
+推定のしかた:
+    1. 参照ページと答案ページを 72dpi（1画素 = 1pt）のグレースケールで描画し、輪郭（勾配の大きさ）にする
+    2. ページを GRID×GRID に区切り、隣り合う2×2区画ずつの窓（半分ずつ重なる）ごとに位相限定相関でずれを求める
+       （参照側の窓のFFTはマスターごとにメモリに持っておくので、答案側の計算だけで済む）
+       （余白の窓と、横線だけ・縦線だけの窓は使わない）
+    3. MAX_SHIFT を超えるずれ（罫線やマーク欄の繰り返し模様に引っぱられたもの）は捨て、
+       残りの窓から RANSAC（3点ずつ選んで一番多くの窓と合うアフィン変換を探す）で外れを除いて最小二乗で求める
+    4. 回転・拡大率・移動量があり得ない範囲なら使わない（変換なし）
+
+推定のしかたを変えたら ALGO_VERSION を上げる（キャッシュの参照キーに入るので、古い結果は計算し直される）。
+
+参照PDFは coord_db/<マスターID>.json の "reference_pdf"（master_index.py と共通）。参照PDFがなければ何もしない。
+推定結果は答案PDFの内容のハッシュごとに SQLite（config.json の "registration_db"）にキャッシュするので、
+再印字（restamp.py）やワーカーの再実行では計算し直さない。
+
+使い方:
+    python scan_registration.py inputs/answer_01.pdf --master 2025_1_1
+    python scan_registration.py --master 2025_1_1 --self-check   # 参照PDFを既知の量だけずらして推定できるか確かめる
+"""
+import os
+import sys
+import json
+import math
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+import fitz
+import numpy as np
+import metrics
+from archive_index import sha256_file
+
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+DEFAULT_DB_PATH = "./registration.db"
+COORD_DB_DIR = "./coord_db"
+ALGO_VERSION = 2
+REG_DPI = 72            # 1画素 = 1pt。変換をそのままPDF座標で扱える
+GRID = 8                # 区画の分割数（GRID×GRID）。窓は2×2区画なので (GRID-1)^2 個
+MIN_EDGE = 1.0          # 輪郭の平均がこれ未満の窓（余白）は使わない
+MIN_ISOTROPY = 0.05     # 横方向と縦方向の輪郭の変化の比がこれ未満の窓（長い横罫線だけなど）は線に沿ったずれが測れないので使わない
+MIN_PEAK_RATIO = 8.0    # 相関のピークが平均から標準偏差のこの倍数以上離れていなければ使わない
+MAX_RESIDUAL = 3.0      # 当てはめの残差がこれ（pt）を超える窓は外れとして除く
+MIN_TILES = 6
+RANSAC_ITERATIONS = 200
+SELF_CHECK_SHIFTS = [(7.0, -4.0), (-15.0, 11.0), (32.0, 25.0)]  # --self-check で試すずれ（pt）
+MAX_ANGLE = 5.0         # 度
+MAX_SCALE_ERROR = 0.03
+MAX_SHIFT = 60.0        # pt（約2cm）
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS registrations (
+    sheet_hash  TEXT NOT NULL,
+    master_id   TEXT NOT NULL,
+    page        INTEGER NOT NULL,
+    reference   TEXT NOT NULL,
+    transform   TEXT NOT NULL,
+    tiles       INTEGER NOT NULL,
+    created_at  TEXT NOT NULL,
+    PRIMARY KEY (sheet_hash, master_id, page)
+);
+"""
+
+
+def _config():
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def enabled():
+    return bool(_config().get("scan_registration", True))
+
+
+class Transform:
+    """参照PDFの座標 (x, y) → 答案の座標 (a*x + b*y + c, d*x + e*y + f)"""
+    def __init__(self, a=1.0, b=0.0, c=0.0, d=0.0, e=1.0, f=0.0):
+        self.a, self.b, self.c, self.d, self.e, self.f = a, b, c, d, e, f
+
+    @classmethod
+    def identity(cls):
+        return cls()
+
+    def to_list(self):
+        return [self.a, self.b, self.c, self.d, self.e, self.f]
+
+    def apply(self, x, y):
+        return self.a * x + self.b * y + self.c, self.d * x + self.e * y + self.f
+
+    def rect(self, x0, y0, x1, y1):
+        """矩形の四隅を変換し、それを囲む矩形 [x0, y0, x1, y1] を返す（注釈は傾けられないため）"""
+        pts = [self.apply(x, y) for x in (x0, x1) for y in (y0, y1)]
+        xs, ys = [p[0] for p in pts], [p[1] for p in pts]
+        return [round(min(xs), 1), round(min(ys), 1), round(max(xs), 1), round(max(ys), 1)]
+
+    @property
+    def angle(self):
+        return math.degrees(math.atan2(self.d, self.a))
+
+    @property
+    def scale(self):
+        return math.hypot(self.a, self.d)
+
+    @property
+    def shift(self):
+        return self.c, self.f
+
+    def describe(self):
+        return f"移動 ({self.c:+.1f}, {self.f:+.1f})pt・回転 {self.angle:+.2f}°・拡大率 {self.scale:.3f}"
+
+
+def _edges(gray):
+    """勾配の大きさ（明るさやトナーの濃さの違いに左右されにくい）"""
+    g = gray.astype(np.float32)
+    gx = np.zeros_like(g)
+    gy = np.zeros_like(g)
+    gx[:, 1:-1] = g[:, 2:] - g[:, :-2]
+    gy[1:-1, :] = g[2:, :] - g[:-2, :]
+    return np.hypot(gx, gy)
+
+
+def _render(page, sx=1.0, sy=1.0):
+    pix = page.get_pixmap(matrix=fitz.Matrix(sx * REG_DPI / 72, sy * REG_DPI / 72),
+                          colorspace=fitz.csGRAY, alpha=False)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return arr[:, :pix.width]
+
+
+def _tiles(shape):
+    """[(y0, y1, x0, x1), ...]（2×2区画の窓。すべて同じ大きさで、半分ずつ重なる）"""
+    h, w = shape
+    th, tw = h // GRID, w // GRID
+    return [(i * th, (i + 2) * th, j * tw, (j + 2) * tw) for i in range(GRID - 1) for j in range(GRID - 1)]
+
+
+def _isotropy(tile):
+    """輪郭の横方向の変化と縦方向の変化の小さい方 / 大きい方（0 なら一方向の線だけ）"""
+    ex = np.abs(np.diff(tile, axis=1)).sum()
+    ey = np.abs(np.diff(tile, axis=0)).sum()
+    return min(ex, ey) / max(ex, ey, 1e-9)
+
+
+class _ReferencePage:
+    """参照ページのタイルのFFT（答案ごとに計算し直さないよう使い回す）"""
+    def __init__(self, size, edges):
+        self.size = size  # (幅, 高さ) pt
+        self.shape = edges.shape
+        self.tiles = []  # (中心x, 中心y, (y0, y1, x0, x1), conj(FFT))
+        th, tw = 2 * (self.shape[0] // GRID), 2 * (self.shape[1] // GRID)
+        self.window = np.outer(np.hanning(th), np.hanning(tw)).astype(np.float32)
+        for box in _tiles(self.shape):
+            y0, y1, x0, x1 = box
+            tile = edges[y0:y1, x0:x1]
+            if tile.mean() < MIN_EDGE or _isotropy(tile) < MIN_ISOTROPY:
+                continue
+            spec = np.conj(np.fft.rfft2((tile - tile.mean()) * self.window))
+            self.tiles.append(((x0 + x1) / 2, (y0 + y1) / 2, box, spec))
+
+    @classmethod
+    def from_page(cls, page):
+        return cls((page.rect.width, page.rect.height), _edges(_render(page)))
+
+
+_ref_lock = threading.Lock()
+_ref_cache = {}  # (参照PDFのパス, 更新時刻, ページ) -> _ReferencePage
+
+
+def _reference_page(ref_path, page_num):
+    st = os.stat(ref_path)
+    key = (os.path.abspath(ref_path), st.st_mtime_ns, page_num)
+    with _ref_lock:
+        ref = _ref_cache.get(key)
+    if ref is None:
+        with fitz.open(ref_path) as doc:
+            ref = _ReferencePage.from_page(doc[page_num]) if page_num < len(doc) else None
+        with _ref_lock:
+            if len(_ref_cache) > 32:
+                _ref_cache.clear()
+            _ref_cache[key] = ref
+    return ref
+
+
+def _phase_shift(spec_ref, tile, window):
+    """tile が参照タイルから (dx, dy) ずれている量と、ピークの鋭さ"""
+    spec = np.fft.rfft2((tile - tile.mean()) * window)
+    cross = spec * spec_ref
+    cross /= np.abs(cross) + 1e-9
+    corr = np.fft.irfft2(cross, s=tile.shape)
+    py, px = np.unravel_index(int(np.argmax(corr)), corr.shape)
+    peak = corr[py, px]
+    ratio = (peak - corr.mean()) / (corr.std() + 1e-9)
+    h, w = corr.shape
+
+    def sub(m, z, p):  # 放物線で小数点以下のずれを求める
+        denom = m - 2 * z + p
+        return 0.0 if abs(denom) < 1e-9 else 0.5 * (m - p) / denom
+    dy = py + sub(corr[(py - 1) % h, px], peak, corr[(py + 1) % h, px])
+    dx = px + sub(corr[py, (px - 1) % w], peak, corr[py, (px + 1) % w])
+    if dy > h / 2:
+        dy -= h
+    if dx > w / 2:
+        dx -= w
+    return dx, dy, ratio
+
+
+def _fit(src, dst):
+    """最小二乗のアフィン変換（3×2）と各点の残差"""
+    X = np.hstack([src, np.ones((len(src), 1))])
+    P, *_ = np.linalg.lstsq(X, dst, rcond=None)
+    return P, np.hypot(*(X @ P - dst).T)
+
+
+def _ransac(src, dst, iterations=RANSAC_ITERATIONS, tol=MAX_RESIDUAL):
+    """3点ずつ選んだアフィン変換のうち、残差 tol 以内の点が最も多いものの内側の点（bool配列）"""
+    rng = np.random.default_rng(0)  # 同じ答案なら毎回同じ結果にする
+    X = np.hstack([src, np.ones((len(src), 1))])
+    best, best_err = np.zeros(len(src), dtype=bool), np.inf
+    for _ in range(iterations):
+        idx = rng.choice(len(src), 3, replace=False)
+        if abs(np.linalg.det(X[idx])) < 1e-6:  # 一直線上の3点
+            continue
+        P = np.linalg.solve(X[idx], dst[idx])
+        residual = np.hypot(*(X @ P - dst).T)
+        inliers = residual <= tol
+        err = residual[inliers].sum()
+        if inliers.sum() > best.sum() or (inliers.sum() == best.sum() and err < best_err):
+            best, best_err = inliers, err
+    return best
+
+
+def estimate(ref, page):
+    """
+    参照ページ（_ReferencePage）に対する答案ページのアフィン変換を推定する。
+    (Transform, 使ったタイル数, 理由) を返す。使えないときは恒等変換と理由
+    """
+    # 答案のページの大きさが違っても（A4とLetterなど）参照と同じ画素数で描画する
+    sx, sy = ref.size[0] / page.rect.width, ref.size[1] / page.rect.height
+    P, tiles, reason = estimate_edges(ref, _edges(_render(page, sx, sy)))
+    if reason:
+        return Transform.identity(), tiles, reason
+    # 答案側の描画の拡大率を戻す
+    return Transform(P[0, 0] / sx, P[1, 0] / sx, P[2, 0] / sx, P[0, 1] / sy, P[1, 1] / sy, P[2, 1] / sy), tiles, None
+
+
+def estimate_edges(ref, edges):
+    """輪郭画像どうしで推定する。(3×2の行列, 使ったタイル数, 理由) を返す"""
+    if len(ref.tiles) < MIN_TILES:
+        return None, 0, "参照ページに印字のある部分が少なすぎます"
+    if edges.shape != ref.shape:
+        padded = np.zeros(ref.shape, dtype=np.float32)
+        h, w = min(edges.shape[0], ref.shape[0]), min(edges.shape[1], ref.shape[1])
+        padded[:h, :w] = edges[:h, :w]
+        edges = padded
+    src, dst = [], []
+    for cx, cy, (y0, y1, x0, x1), spec in ref.tiles:
+        dx, dy, ratio = _phase_shift(spec, edges[y0:y1, x0:x1], ref.window)
+        if ratio >= MIN_PEAK_RATIO and math.hypot(dx, dy) <= MAX_SHIFT:
+            src.append((cx, cy))
+            dst.append((cx + dx, cy + dy))
+    if len(src) < MIN_TILES:
+        return None, len(src), "一致するタイルが少なすぎます"
+    src, dst = np.array(src), np.array(dst)
+    keep = _ransac(src, dst)
+    if keep.sum() < MIN_TILES:
+        return None, int(keep.sum()), "タイルのずれが1つの変換で説明できません"
+    src, dst = src[keep], dst[keep]
+    P, residual = _fit(src, dst)
+    if residual.max() > MAX_RESIDUAL:
+        return None, len(src), "タイルのずれが1つの変換で説明できません"
+    angle = math.degrees(math.atan2(P[0, 1], P[0, 0]))
+    scale = math.hypot(P[0, 0], P[0, 1])
+    center = np.array([ref.shape[1] / 2, ref.shape[0] / 2])
+    moved = np.hypot(*(np.append(center, 1) @ P - center))
+    if abs(angle) > MAX_ANGLE or abs(scale - 1) > MAX_SCALE_ERROR or moved > MAX_SHIFT:
+        return None, len(src), f"推定結果が大きすぎます（回転 {angle:+.2f}°・拡大率 {scale:.3f}・移動 {moved:.1f}pt）"
+    return P, len(src), None
+
+
+def _shifted(edges, dx, dy):
+    """輪郭画像を (dx, dy) 画素（整数）だけずらし、はみ出た分は捨てて空いた分は0で埋める"""
+    out = np.zeros_like(edges)
+    h, w = edges.shape
+    dx, dy = int(round(dx)), int(round(dy))
+    out[max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] = \
+        edges[max(-dy, 0):h + min(-dy, 0), max(-dx, 0):w + min(-dx, 0)]
+    return out
+
+
+def self_check(page, shifts=SELF_CHECK_SHIFTS, tol=0.5):
+    """
+    参照ページを既知の量だけずらしたものを推定し、[(ずれ, 推定した移動量, 合格か, 理由), ...] を返す。
+    移動だけなので、推定した変換のページ中央での移動量と比べる
+    """
+    edges = _edges(_render(page))
+    ref = _ReferencePage((page.rect.width, page.rect.height), edges)
+    center = np.array([ref.shape[1] / 2, ref.shape[0] / 2, 1])
+    results = []
+    for dx, dy in shifts:
+        P, tiles, reason = estimate_edges(ref, _shifted(edges, dx, dy))
+        if reason:
+            results.append(((dx, dy), None, False, reason))
+            continue
+        moved = center @ P - center[:2]
+        ok = math.hypot(moved[0] - dx, moved[1] - dy) <= tol
+        results.append(((dx, dy), (float(moved[0]), float(moved[1])), ok, None))
+    return results
+
+
+def default_db_path():
+    return _config().get("registration_db", DEFAULT_DB_PATH)
+
+
+class RegistrationCache:
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, sheet_hash, master_id, page, reference):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT transform FROM registrations WHERE sheet_hash = ? AND master_id = ? AND page = ? AND reference = ?",
+                (sheet_hash, master_id, page, reference)).fetchone()
+        return Transform(*json.loads(row[0])) if row else None
+
+    def put(self, sheet_hash, master_id, page, reference, transform, tiles):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO registrations (sheet_hash, master_id, page, reference, transform, tiles, created_at)"
+                " VALUES (?,?,?,?,?,?,?)",
+                (sheet_hash, master_id, page, reference, json.dumps(transform.to_list()), tiles,
+                 datetime.now().isoformat(timespec="seconds")))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def default_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RegistrationCache()
+        return _cache
+
+
+class SheetRegistration:
+    """1枚の答案の座標変換。ページごとに初めて使うときに推定（またはキャッシュから読み込み）する"""
+    def __init__(self, doc, master_id, ref_path, sheet_hash, cache=None):
+        self.doc = doc
+        self.master_id = master_id
+        self.ref_path = ref_path
+        st = os.stat(ref_path)
+        # 推定のしかたを変えたときも計算し直すよう、ALGO_VERSION もキーに入れる
+        self.reference = f"{os.path.basename(ref_path)}:{st.st_mtime_ns}:{st.st_size}:v{ALGO_VERSION}"
+        self.sheet_hash = sheet_hash
+        self.cache = cache
+        self.transforms = {}  # ページ番号 -> Transform
+
+    def transform(self, page_num):
+        t = self.transforms.get(page_num)
+        if t is not None:
+            return t
+        t = self.cache.get(self.sheet_hash, self.master_id, page_num, self.reference) if self.cache else None
+        if t is None:
+            try:
+                with metrics.timer("register"):
+                    ref = _reference_page(self.ref_path, page_num)
+                    t, tiles, reason = (estimate(ref, self.doc[page_num]) if ref
+                                        else (Transform.identity(), 0, "参照PDFにこのページがありません"))
+            except Exception as e:
+                t, tiles, reason = Transform.identity(), 0, str(e)
+            if reason:
+                print(f"⚠️ 位置合わせできませんでした（p{page_num + 1}）: {reason}")
+            if self.cache:
+                self.cache.put(self.sheet_hash, self.master_id, page_num, self.reference, t, tiles)
+        self.transforms[page_num] = t
+        return t
+
+    def rect(self, coord):
+        """coord_db の [ページ, x0, y0, x1, y1] → 答案上の [x0, y0, x1, y1]"""
+        return self.transform(coord[0]).rect(*coord[1:])
+
+
+def for_sheet(doc, pdf_path, master_id, coords, coord_db_dir=COORD_DB_DIR, cache=None):
+    """参照PDFがあり、位置合わせが有効なら SheetRegistration、そうでなければ None"""
+    ref = coords.get("reference_pdf")
+    if not ref or not enabled():
+        return None
+    ref_path = os.path.join(coord_db_dir, ref)
+    if not os.path.exists(ref_path):
+        return None
+    return SheetRegistration(doc, master_id, ref_path, sha256_file(pdf_path),
+                             cache if cache is not None else default_cache())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="答案PDFと参照PDFの位置合わせの結果を表示する")
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--master", required=True)
+    parser.add_argument("--coord-db", default=COORD_DB_DIR)
+    parser.add_argument("--self-check", action="store_true", help="参照PDFを既知の量だけずらして推定を確かめる")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.coord_db, f"{args.master}.json"), "r", encoding="utf-8") as f:
+        coords = json.load(f)
+    if not coords.get("reference_pdf"):
+        print(f"❌ {args.master} に参照PDFがありません（python master_index.py add で登録してください）")
+        sys.exit(1)
+    ref_path = os.path.join(args.coord_db, coords["reference_pdf"])
+    if args.self_check:
+        failed = 0
+        with fitz.open(ref_path) as doc:
+            for i, page in enumerate(doc):
+                for (dx, dy), moved, ok, reason in self_check(page):
+                    failed += not ok
+                    got = f"推定 ({moved[0]:+.1f}, {moved[1]:+.1f})pt" if moved else reason
+                    print(f"{'✅' if ok else '❌'} p{i + 1} ずれ ({dx:+.1f}, {dy:+.1f})pt → {got}")
+        if failed:
+            sys.exit(1)
+    for pdf in args.pdfs:
+        with fitz.open(pdf) as doc:
+            for i in range(len(doc)):
+                ref = _reference_page(ref_path, i)
+                if ref is None:
+                    break
+                t, tiles, reason = estimate(ref, doc[i])
+                print(f"{'⚠️' if reason else '✅'} {os.path.basename(pdf)} p{i + 1}: {t.describe()}（タイル {tiles}）"
+                      + (f" — {reason}" if reason else ""))
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
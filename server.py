@@ -0,0 +1,308 @@
+"""
+ヘッドレスHTTPサービス
+デスクトップ画面（pywebview）なしで backend.Api の操作をHTTP/JSONで提供する。
+職員室の共有PCなどで動かし、複数の講師がそれぞれバッチを投入できるようにする。
+デスクトップ画面も、このサービスのクライアントの1つとして扱える。
+
+    GET  /api                   呼び出せるメソッドの一覧
+    POST /api/<method>          本文 {"args": [...], "kwargs": {...}}、または引数名をキーにしたオブジェクト
+                                → {"result": ...}
+    POST /upload?name=a.pdf     本文のPDF・ZIPを inputs/ に取り込む（重複はスキップ）
+    GET  /events                ログ・進捗イベントのストリーム（Server-Sent Events）
+
+- リクエストはスレッドごとに並行して処理する
+- Stepの実行はジョブキュー（submit_step1 / submit_step23）に積んで即座に返し、
+  進み具合は /events と get_queue_state で確認する
+- すべての要求にトークンが必要（Authorization: Bearer <token>、SSEなどヘッダーを付けられないときは ?t=<token>）。
+  指定しなければ起動のたびに生成して表示する（127.0.0.1 でも、同じPCの別のプログラムやブラウザのページから
+  呼ばれないようにするため）
+- /api の本文は Content-Type: application/json のみ受け付ける。CORSはCFGの "server_allowed_origins" に
+  書いたオリジンにだけ許可する（既定はなし）
+- パスを受け取るメソッド（read_text・copy_pdf など）は公開しない。答案は /upload で取り込み、
+  ファイル名で指定するメソッド（submit_step1・get_page_image・read_draft・save_draft など）を使う。
+  ファイル名はフォルダ直下のPDF名（"../x.pdf" のようなパスは不可）に限る
+- get_page_image が返すページ画像のURLは、backend のページ画像サーバー（--host で待ち受け、
+  --public-host をURLのホスト名に使う）を指す
+
+使い方:
+    python server.py --port 8770
+    python server.py --host 0.0.0.0 --public-host grading-pc.local --token <共有するトークン>
+"""
+import os
+import sys
+import json
+import queue
+import secrets
+import argparse
+import tempfile
+import threading
+import inspect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import backend
+
+# デスクトップ画面でしか意味のないメソッド・内部用のメソッドは公開しない
+_EXCLUDED = {"set_window", "open_file_dialog", "open_output_dir", "open_with_pdfxchange",
+             "run_coordinate_picker", "add_listener", "remove_listener", "shutdown"}
+# 任意のパスを読み書きできてしまうメソッドも公開しない（代わりにファイル名で指定する
+# get_page_image・read_draft・save_draft を使う）
+_EXCLUDED |= {"read_text", "save_text", "copy_pdf", "extract_zip", "split_batch", "run_step1_from_zip",
+              "get_pdf_image"}
+_UPLOAD_TYPES = {"application/pdf", "application/zip", "application/x-zip-compressed", "application/octet-stream"}
+_MAX_JSON = 16 * 1024 * 1024
+
+
+class EventHub:
+    """Api のログ・進捗イベントを、接続中の各SSEクライアントのキューに配る"""
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._subs = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subs.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subs.discard(q)
+
+    def publish(self, batch):
+        with self._lock:
+            subs = list(self._subs)
+        for q in subs:
+            try:
+                q.put_nowait(batch)
+            except queue.Full:
+                pass  # 読み出しが追いつかないクライアントの分は捨てる
+
+
+class _LimitedReader:
+    """Content-Length 分だけ読むラッパー"""
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, n=-1):
+        if self.remaining <= 0:
+            return b""
+        n = self.remaining if n < 0 else min(n, self.remaining)
+        data = self.stream.read(n)
+        self.remaining -= len(data)
+        return data
+
+
+def public_methods(api):
+    methods = {}
+    for name, fn in inspect.getmembers(api, inspect.ismethod):
+        if not name.startswith("_") and name not in _EXCLUDED:
+            methods[name] = fn
+    return methods
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self._cors_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cors_headers(self):
+        """許可リストにあるオリジンからの要求にだけCORSのヘッダーを付ける"""
+        origin = self.headers.get("Origin")
+        if origin and origin in self.server.service.allowed_origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Vary", "Origin")
+
+    def _content_type(self):
+        return (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+
+    def _authorized(self, query):
+        token = self.server.service.token
+        given = query.get("t", "")
+        auth = self.headers.get("Authorization", "")
+        if auth.startswith("Bearer "):
+            given = auth[len("Bearer "):]
+        return secrets.compare_digest(given, token)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._cors_headers()
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if not self._authorized(query):
+            return self._json(401, {"error": "unauthorized"})
+        if parsed.path == "/api":
+            return self._json(200, {"methods": sorted(self.server.service.methods)})
+        if parsed.path == "/events":
+            return self._events()
+        self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        if not self._authorized(query):
+            return self._json(401, {"error": "unauthorized"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if parsed.path == "/upload":
+            if self._content_type() not in _UPLOAD_TYPES:
+                return self._json(415, {"error": "Content-Type must be application/pdf, application/zip "
+                                                 "or application/octet-stream"})
+            return self._upload(query.get("name", ""), _LimitedReader(self.rfile, length))
+        if parsed.path.startswith("/api/"):
+            if length > _MAX_JSON:
+                return self._json(413, {"error": "request too large"})
+            if self._content_type() != "application/json":
+                return self._json(415, {"error": "Content-Type must be application/json"})
+            return self._call(parsed.path[len("/api/"):], self.rfile.read(length) if length else b"")
+        self._json(404, {"error": "not found"})
+
+    def _call(self, name, raw):
+        fn = self.server.service.methods.get(name)
+        if fn is None:
+            return self._json(404, {"error": f"unknown method: {name}"})
+        try:
+            payload = json.loads(raw.decode("utf-8")) if raw.strip() else {}
+        except ValueError as e:
+            return self._json(400, {"error": f"invalid JSON: {e}"})
+        if isinstance(payload, list):
+            args, kwargs = payload, {}
+        elif isinstance(payload, dict) and ("args" in payload or "kwargs" in payload):
+            args, kwargs = payload.get("args", []), payload.get("kwargs", {})
+        elif isinstance(payload, dict):
+            args, kwargs = [], payload
+        else:
+            return self._json(400, {"error": "body must be a JSON object or array"})
+        try:
+            result = fn(*args, **kwargs)
+        except TypeError as e:
+            return self._json(400, {"error": str(e)})
+        except Exception as e:
+            return self._json(500, {"error": f"{type(e).__name__}: {e}"})
+        self._json(200, {"result": result})
+
+    def _upload(self, name, reader):
+        name = os.path.basename(name)
+        api = self.server.service.api
+        if name.lower().endswith(".pdf"):
+            try:
+                r = api._ingestor().ingest_stream(name, reader)
+            except Exception as e:
+                return self._json(500, {"error": str(e)})
+            api._log_ingest([r], f"📄 アップロード取り込み ({name})")
+            return self._json(200, {"result": [_result_dict(r)]})
+        if name.lower().endswith(".zip"):
+            # ZIPは末尾の目録を読む必要があるので一時ファイルに受けてから取り込む
+            fd, tmp = tempfile.mkstemp(suffix=".zip")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in iter(lambda: reader.read(1024 * 1024), b""):
+                        f.write(chunk)
+                results = api._ingestor().ingest_zip(tmp)
+            except Exception as e:
+                return self._json(500, {"error": str(e)})
+            finally:
+                os.remove(tmp)
+            api._log_ingest(results, f"📦 アップロード取り込み ({name})")
+            return self._json(200, {"result": [_result_dict(r) for r in results]})
+        self._json(400, {"error": "name must end with .pdf or .zip"})
+
+    def _events(self):
+        hub = self.server.service.hub
+        q = hub.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self._cors_headers()
+            self.end_headers()
+            self.close_connection = True
+            while True:
+                try:
+                    batch = q.get(timeout=15)
+                    data = json.dumps(batch, ensure_ascii=False)
+                    self.wfile.write(f"event: batch\ndata: {data}\n\n".encode("utf-8"))
+                except queue.Empty:
+                    self.wfile.write(b": ping\n\n")  # 接続維持
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            hub.unsubscribe(q)
+
+
+def _result_dict(r):
+    return {"source": r.source, "name": r.name, "status": r.status, "sha256": r.sha256,
+            "duplicate_of": r.duplicate_of}
+
+
+class GradingService:
+    def __init__(self, host="127.0.0.1", port=8770, token=None, public_host=None, allowed_origins=()):
+        self.api = backend.Api(page_host=host, page_public_host=public_host)
+        self.token = token or secrets.token_urlsafe(16)
+        self.allowed_origins = set(allowed_origins)
+        self.methods = public_methods(self.api)
+        self.hub = EventHub()
+        self.api.add_listener(self.hub.publish)
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.service = self
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        try:
+            self._httpd.serve_forever()
+        finally:
+            self._httpd.server_close()
+            self.api.shutdown()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="採点バックエンドをHTTP/JSONサービスとして起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--public-host", default=None, help="ページ画像URLに使うホスト名（他のPCから見る場合）")
+    parser.add_argument("--token", default=os.environ.get("GRADING_SERVER_TOKEN") or backend.CFG.get("server_token"))
+    args = parser.parse_args()
+
+    service = GradingService(args.host, args.port, token=args.token, public_host=args.public_host,
+                             allowed_origins=backend.CFG.get("server_allowed_origins", []))
+    if not args.token:
+        print(f"🔑 トークンを生成しました: {service.token}")
+    print(f"🌐 採点サービス起動: {service.url}（メソッド {len(service.methods)}件）")
+    print(f"   クライアントは Authorization: Bearer <トークン> を付けて呼び出してください"
+          f"（イベント: {service.url}/events?t=<トークン>）")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        print("\n停止しました")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
@@ -0,0 +1,228 @@
+"""
+合成答案PDFジェネレーター
+マスターJSON（masters/）と座標データ（coord_db/）のレイアウトから、
+手書き答案に近い複数ページのPDFを大量に生成する（10〜10,000枚）。
+ベンチマークや座標の確認用で、採点には使わない。
+
+使い方:
+    python sheet_generator.py --master 2025_1_1 --count 100 --out ./bench_sheets
+    python sheet_generator.py --master 2025_1_1 --count 1000 --scanned --workers 8
+"""
+import os
+import sys
+import json
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+COORD_DB_DIR = os.path.join(BASE_DIR, "coord_db")
+MASTER_DB_DIR = os.path.join(BASE_DIR, "masters")
+
+# 座標が収まる最小の用紙サイズを選ぶ（pt）
+PAGE_SIZES = [(595, 842), (842, 595), (842, 1191), (1191, 842)]
+
+SAMPLE_SENTENCES = [
+    "Walking through the forest, she noticed how quietly the animals moved.",
+    "He realized that technology alone could not solve the problem.",
+    "It is important to think about what we can do for the future.",
+    "Not until he lost his health did he realize its value.",
+    "The more we learn, the more we realize how little we know.",
+    "She was so tired that she could hardly keep her eyes open.",
+    "What matters is not how long you live but how you live.",
+]
+MARK_CHOICES = "abcdefghij"
+
+
+def load_layout(master_id):
+    """マスターJSONと座標データを読み込む。座標データがなければNone"""
+    coord_path = os.path.join(COORD_DB_DIR, f"{master_id}.json")
+    if not os.path.exists(coord_path):
+        return None, None
+    with open(coord_path, "r", encoding="utf-8") as f:
+        coords = json.load(f)
+    master = None
+    for name in os.listdir(MASTER_DB_DIR) if os.path.isdir(MASTER_DB_DIR) else []:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(MASTER_DB_DIR, name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            continue
+        if data.get("meta", {}).get("id") == master_id:
+            master = data
+            break
+    return master, coords
+
+
+def iter_rects(coords):
+    """座標データの全矩形を (ラベル, [page, x0, y0, x1, y1]) で列挙する"""
+    for key, val in coords.items():
+        if key == "questions":
+            for q_key, fields in val.items():
+                for field, rect in fields.items():
+                    if rect:
+                        yield f"{q_key}:{field}", rect
+        elif isinstance(val, list) and len(val) == 5:
+            yield key, val
+
+
+def layout_geometry(coords):
+    """ページ数と用紙サイズを座標データから決める"""
+    rects = [r for _, r in iter_rects(coords)]
+    pages = 1 + max((r[0] for r in rects), default=0)
+    max_x = max((r[3] for r in rects), default=0)
+    max_y = max((r[4] for r in rects), default=0)
+    for w, h in PAGE_SIZES:
+        if max_x <= w and max_y <= h:
+            return pages, (w, h)
+    return pages, PAGE_SIZES[-1]
+
+
+def build_template(master_id, master, coords):
+    """全答案に共通する枠線・見出しだけのテンプレートPDFを作り、bytesで返す"""
+    pages, (w, h) = layout_geometry(coords)
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page(width=w, height=h)
+        page.insert_text((36, 28), f"{master_id}   {p + 1}/{pages}", fontsize=11, fontname="helv")
+        page.draw_rect(fitz.Rect(300, 14, 440, 40), color=(0, 0, 0), width=0.8)
+        page.insert_text((304, 24), "Student No.", fontsize=6)
+    for label, (p, x0, y0, x1, y1) in iter_rects(coords):
+        page = doc[p]
+        page.draw_rect(fitz.Rect(x0, y0, x1, y1), color=(0.35, 0.35, 0.35), width=0.6)
+        page.insert_text((x0 + 2, y0 - 2), label, fontsize=5, color=(0.5, 0.5, 0.5))
+
+    # マーク式の設問にはマーク欄（丸の表）を描く
+    mark_keys = [k for k, q in (master or {}).get("sub_questions", {}).items() if q.get("type") == "マーク式"]
+    for q_key in mark_keys:
+        rect = coords.get("questions", {}).get(q_key, {}).get("score")
+        if not rect:
+            continue
+        page = doc[rect[0]]
+        for row in range(6):
+            y = rect[4] + 14 + row * 12
+            page.insert_text((rect[1], y + 3), f"{27 + row}", fontsize=7)
+            for c, ch in enumerate(MARK_CHOICES[:8]):
+                cx = rect[1] + 22 + c * 14
+                page.draw_oval(fitz.Rect(cx - 4, y - 4, cx + 4, y + 4), color=(0, 0, 0), width=0.5)
+                page.insert_text((cx - 1.5, y + 1.5), ch, fontsize=4)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data, mark_keys
+
+
+def _fill_sheet(template_bytes, coords, mark_keys, master_id, index, seed):
+    """テンプレートに生徒番号・解答・マークを書き込んだ1枚分のPDFを返す"""
+    rng = random.Random(seed * 1_000_003 + index)
+    doc = fitz.open("pdf", template_bytes)
+    doc[0].insert_text((340, 34), f"{rng.randint(0, 99999999):08d}", fontsize=12, fontname="cour")
+
+    for q_key, fields in coords.get("questions", {}).items():
+        rect = fields.get("text")
+        if not rect:
+            continue
+        p, x0, y0, x1, y1 = rect
+        n = rng.randint(1, 3)
+        answer = f"({q_key}) " + " ".join(rng.choice(SAMPLE_SENTENCES) for _ in range(n))
+        # 手書きの代わりに斜体で書く
+        doc[p].insert_textbox(fitz.Rect(x0 + 4, y0 + 3, x1 - 4, y1 - 3), answer,
+                              fontsize=rng.uniform(9, 12), fontname="tiit", color=(0.15, 0.15, 0.2))
+
+    for q_key in mark_keys:
+        rect = coords.get("questions", {}).get(q_key, {}).get("score")
+        if not rect:
+            continue
+        page = doc[rect[0]]
+        for row in range(6):
+            y = rect[4] + 14 + row * 12
+            cx = rect[1] + 22 + rng.randrange(8) * 14
+            shade = rng.uniform(0.1, 0.45)  # 薄い鉛筆も混ぜる
+            page.draw_oval(fitz.Rect(cx - 3.5, y - 3.5, cx + 3.5, y + 3.5),
+                           color=None, fill=(shade, shade, shade))
+    data = doc.tobytes(deflate=True)
+    doc.close()
+    return data
+
+
+def _scanify(pdf_bytes, index, seed, dpi=150):
+    """ページを画像化し、スキャナー相当のわずかな回転・ずれを加えた画像PDFにする"""
+    rng = random.Random(seed * 7_919 + index)
+    src = fitz.open("pdf", pdf_bytes)
+    out = fitz.open()
+    for page in src:
+        angle = rng.uniform(-0.8, 0.8)
+        dx, dy = rng.uniform(-6, 6), rng.uniform(-6, 6)
+        m = fitz.Matrix(dpi / 72, dpi / 72).prerotate(angle)
+        pix = page.get_pixmap(matrix=m, colorspace=fitz.csGRAY)
+        new_page = out.new_page(width=page.rect.width, height=page.rect.height)
+        target = fitz.Rect(dx, dy, page.rect.width + dx, page.rect.height + dy)
+        new_page.insert_image(target, stream=pix.tobytes("jpeg", jpg_quality=80))
+    data = out.tobytes(deflate=True)
+    out.close()
+    src.close()
+    return data
+
+
+def _generate_chunk(args):
+    template_bytes, coords, mark_keys, master_id, out_dir, indices, seed, scanned = args
+    paths = []
+    for i in indices:
+        data = _fill_sheet(template_bytes, coords, mark_keys, master_id, i, seed)
+        if scanned:
+            data = _scanify(data, i, seed)
+        path = os.path.join(out_dir, f"{master_id}_sheet_{i:05d}.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def generate_sheets(master_id, count, out_dir, scanned=False, seed=0, workers=None):
+    """
+    合成答案を count 枚生成し、PDFパスのリストを返す。
+    scanned=True でスキャン相当の画像PDFにする（Step1のラスタライズ負荷が実運用に近くなる）。
+    """
+    master, coords = load_layout(master_id)
+    if coords is None:
+        raise FileNotFoundError(f"coord_db/{master_id}.json がありません")
+    os.makedirs(out_dir, exist_ok=True)
+    template_bytes, mark_keys = build_template(master_id, master, coords)
+
+    workers = workers or min(os.cpu_count() or 1, 8)
+    chunk = max(1, min(100, count // (workers * 4) or 1))
+    jobs = [(template_bytes, coords, mark_keys, master_id, out_dir, range(s, min(count, s + chunk)), seed, scanned)
+            for s in range(0, count, chunk)]
+    if workers <= 1 or count <= chunk:
+        return [p for job in jobs for p in _generate_chunk(job)]
+    paths = []
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for result in ex.map(_generate_chunk, jobs):
+            paths.extend(result)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="マスターと座標データから合成答案PDFを生成する")
+    parser.add_argument("--master", required=True, help="マスターID（coord_dbのファイル名）")
+    parser.add_argument("--count", type=int, default=10, help="生成する枚数（10〜10000）")
+    parser.add_argument("--out", default="./bench_sheets", help="出力フォルダ")
+    parser.add_argument("--scanned", action="store_true", help="スキャン相当の画像PDFにする")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    import time
+    t0 = time.perf_counter()
+    paths = generate_sheets(args.master, args.count, args.out, scanned=args.scanned,
+                            seed=args.seed, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+    print(f"🎉 {len(paths)}枚を生成しました → {args.out}  ({elapsed:.1f}秒, {len(paths) / max(elapsed, 1e-9):.0f}枚/秒)")
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
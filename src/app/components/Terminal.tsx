@@ -1,32 +1,64 @@
 import { Terminal as TerminalIcon } from "lucide-react";
 import { useState, useEffect, useRef } from "react";
+import type { FileStatus, StepEvent, UiBatch } from "../types";
+
+const progressLine = (stage: string, index: number, total: number, label: string) => {
+  const length = 30;
+  const ratio = total > 0 ? index / total : 0;
+  const filled = Math.floor(length * ratio);
+  const bar = "█".repeat(filled) + "-".repeat(length - filled);
+  return `Progress: [${stage}] |${bar}| ${(ratio * 100).toFixed(1)}% (${index}/${total}) ${label}`;
+};
+
+// 最後の行がProgressなら置き換え、なければ追加
+const replaceProgress = (logs: string[], line: string) => {
+  const last = logs[logs.length - 1] ?? "";
+  if (last.startsWith("Progress:")) {
+    return [...logs.slice(0, -1), line];
+  }
+  return [...logs, line];
+};
 
 export function Terminal() {
   const [logs, setLogs] = useState<string[]>([
     "$ English Proofreading System v1.0.0",
     "$ Ready...",
   ]);
+  const [fileStatus, setFileStatus] = useState<Record<string, FileStatus>>({});
   const bottomRef = useRef<HTMLDivElement>(null);
 
   useEffect(() => {
-    (window as any).updateLog = (msg: string) => {
-      setLogs((prev) => [...prev, msg]);
-    };
-
-    // プログレスバー専用：最後の行がProgressなら置き換え、なければ追加
-    (window as any).updateProgress = (msg: string) => {
+    // backend の UiBatcher から、ログ行と進捗イベントがまとめて届く
+    window.updateEvents = ({ logs: newLogs, events }: UiBatch) => {
       setLogs((prev) => {
-        const last = prev[prev.length - 1] ?? "";
-        if (last.startsWith("Progress:")) {
-          return [...prev.slice(0, -1), msg];
+        let next = [...prev, ...newLogs];
+        for (const ev of events) {
+          if (ev.event === "stage_start") {
+            next = replaceProgress(next, progressLine(ev.stage, 0, ev.total, "Start"));
+          } else if (ev.event === "file") {
+            next = replaceProgress(next, progressLine(ev.stage, ev.index, ev.total, `${ev.status} ${ev.file}`));
+          } else if (ev.event === "progress") {
+            next = replaceProgress(next, ev.text);
+          }
         }
-        return [...prev, msg];
+        return next;
       });
+      if (events.some((ev) => ev.event === "file" || ev.event === "stage_start")) {
+        setFileStatus((prev) => {
+          let next = { ...prev };
+          for (const ev of events) {
+            if (ev.event === "stage_start") next = {};
+            else if (ev.event === "file") next[ev.file] = ev.status;
+          }
+          return next;
+        });
+      }
+      // 他のコンポーネントでもファイルごとの状態を使えるようにイベントとして流す
+      window.dispatchEvent(new CustomEvent<StepEvent[]>("step-events", { detail: events }));
     };
 
     return () => {
-      delete (window as any).updateLog;
-      delete (window as any).updateProgress;
+      delete window.updateEvents;
     };
   }, []);
 
@@ -60,6 +92,24 @@ export function Terminal() {
           <TerminalIcon className="w-3.5 h-3.5" />
           <span>Terminal</span>
         </div>
+        {Object.keys(fileStatus).length > 0 && (
+          <div className="flex items-center gap-3 text-xs font-mono">
+            <span className="text-green-400">
+              done {Object.values(fileStatus).filter((s) => s === "done").length}
+            </span>
+            <span className="text-yellow-400">
+              skip {Object.values(fileStatus).filter((s) => s === "skip").length}
+            </span>
+            <span className="text-red-400">
+              error {Object.values(fileStatus).filter((s) => s === "error").length}
+            </span>
+            {Object.values(fileStatus).some((s) => s === "review") && (
+              <span className="text-orange-400">
+                review {Object.values(fileStatus).filter((s) => s === "review").length}
+              </span>
+            )}
+          </div>
+        )}
         <button
           className="text-gray-600 hover:text-gray-400 text-xs transition-colors"
           onClick={() => setLogs(["$ ログをクリアしました"])}
@@ -35,9 +35,13 @@ export function WorkspacePanel({
   useEffect(() => {
     if (type === "pdf" && pdfPath) {
       window.pywebview.api.get_pdf_image(pdfPath, pageIdx, 1.0).then((res) => {
-        if ("image_data" in res) {
+        // 通常はローカル画像サーバーのURL、起動できなかった場合はdata URL
+        if ("image_url" in res) {
+          setImgSrc(res.image_url);
+          setTotalPages(res.total_pages ?? 1);
+        } else if ("image_data" in res) {
           setImgSrc(res.image_data);
-          setTotalPages((res as any).total_pages ?? 1);
+          setTotalPages(res.total_pages ?? 1);
         }
       });
     }
@@ -1,32 +1,139 @@
 export type Pair = { pdf: string; txt: string; filename: string };
 export type DoneDate = { key: string; label: string; count: number };
+export type ArchiveFile = {
+  id: number;
+  folder: string;
+  date: string;
+  kind: "input" | "text" | "output";
+  name: string;
+  base: string;
+  size: number | null;
+  master_id: string | null;
+  student_id: string | null;
+  archived_at: string;
+  sha256: string | null;
+  path: string;
+};
 export type Step23State = "idle" | "running" | "done";
 export type Settings = { grader_name: string; pdfxchange_path: string };
 
+// progress.py のJSONイベント
+export type FileStatus = "done" | "skip" | "error" | "review";
+export type StepEvent =
+  | { event: "stage_start"; t: number; stage: string; total: number }
+  | {
+      event: "file";
+      t: number;
+      stage: string;
+      file: string;
+      index: number;
+      total: number;
+      status: FileStatus;
+      seconds?: number | null;
+      master_id?: string | null;
+      student_id?: string | null;
+      score?: number;
+      reasons?: string[];
+    }
+  | { event: "stage_end"; t: number; stage: string; done: number; skipped: number; errors: number; seconds: number }
+  | { event: "progress"; text: string };
+export type UiBatch = { logs: string[]; events: StepEvent[] };
+
+// job_scheduler.py のジョブ状態
+export type JobStatus = "queued" | "running" | "done" | "failed" | "cancelled";
+export type JobFileStatus = "queued" | "running" | "cancelled" | FileStatus;
+export type JobState = {
+  id: string;
+  kind: string;
+  lane: string;
+  label: string;
+  priority: number;
+  status: JobStatus;
+  files: Record<string, JobFileStatus>;
+  current_file: string | null;
+  created: number;
+  started: number | null;
+  finished: number | null;
+};
+export type WatchState = {
+  watching: boolean;
+  backend: "watchdog" | "polling" | null;
+  run_id: string | null;
+  review: Record<string, string[]>;
+};
+export type QueueState = {
+  lanes: Record<string, { running: string | null; queued: number }>;
+  jobs: JobState[];
+};
+
+// metrics.py の実行レポート
+export type StageTiming = { count: number; total: number; mean: number; p50: number; p95: number; max: number };
+export type RunReport = {
+  run: string;
+  stage: string;
+  label?: string;
+  created_at: string;
+  sheets: number;
+  seconds: number | null;
+  sheets_per_min: number | null;
+  errors?: number;
+  stages: Record<string, StageTiming>;
+  tokens: Record<string, { input: number; output: number; cache_read: number; cache_write: number }>;
+  cost_usd: number;
+  unpriced_models: string[];
+  retries: Record<string, number>;
+  counters: Record<string, number>;
+};
+
 declare global {
   interface Window {
+    updateEvents?: (batch: UiBatch) => void;
     pywebview: {
       api: {
         open_file_dialog: () => Promise<string | null>;
         open_output_dir: () => Promise<boolean>;
         open_with_pdfxchange: () => Promise<boolean>;
         extract_zip: (path: string) => Promise<boolean>;
+        run_step1_from_zip: (path: string) => Promise<boolean>;
         run_step1: () => Promise<boolean>;
         copy_pdf: (path: string) => Promise<boolean>;
+        split_batch: (
+          path: string,
+          mode?: "auto" | "pages" | "blank" | "header",
+          pages?: number | null,
+          master_id?: string | null
+        ) => Promise<number>;
         get_pairs: () => Promise<Pair[]>;
         get_done_dates: () => Promise<DoneDate[]>;
         restore_from_done: (date_str: string) => Promise<boolean>;
+        search_archive: (date?: string, master_id?: string, student_id?: string) => Promise<ArchiveFile[]>;
+        restore_archive: (date?: string, master_id?: string, student_id?: string) => Promise<boolean>;
         get_pdf_image: (
           path: string,
           page: number,
           zoom: number
         ) => Promise<
+          | { image_url: string; tile_url: string; current_page: number; total_pages: number }
           | { image_data: string; current_page: number; total_pages: number }
           | { error: string }
         >;
         read_text: (path: string) => Promise<string>;
         save_text: (path: string, content: string) => Promise<boolean>;
+        // ファイル名で指定する版（HTTPサービスからも使える）
+        get_page_image: (
+          name: string,
+          page_idx?: number,
+          zoom?: number,
+          folder?: "input" | "output"
+        ) => Promise<
+          | { image_url: string; tile_url: string; current_page: number; total_pages: number }
+          | { image_data: string; current_page: number; total_pages: number }
+          | { error: string }
+        >;
+        read_draft: (name: string) => Promise<string | null>;
+        save_draft: (name: string, text: string) => Promise<boolean>;
         run_step23: () => Promise<boolean>;
+        run_restamp: (run_id?: string) => Promise<boolean>;
         get_settings: () => Promise<Settings>;
         save_settings: (
           grader_name: string,
@@ -35,6 +142,18 @@ declare global {
         run_coordinate_picker: () => Promise<boolean>;
         cancel_step1: () => Promise<boolean>;
         cancel_step23: () => Promise<boolean>;
+        submit_step1: (files?: string[] | null, priority?: number) => Promise<string | null>;
+        submit_step23: (files?: string[] | null, priority?: number) => Promise<string | null>;
+        get_queue_state: () => Promise<QueueState>;
+        cancel_job: (job_id: string) => Promise<boolean>;
+        cancel_file: (job_id: string, filename: string) => Promise<boolean>;
+        start_watch: (include_existing?: boolean) => Promise<boolean>;
+        stop_watch: () => Promise<boolean>;
+        get_watch_state: () => Promise<WatchState>;
+        approve_review: (filename: string) => Promise<boolean>;
+        get_run_reports: (limit?: number) => Promise<RunReport[]>;
+        get_profiling: () => Promise<string[]>;
+        set_profiling: (mode?: string) => Promise<boolean>;
       };
     };
   }
@@ -4,72 +4,80 @@ import glob
 import time
 import sys
 import json
+import argparse
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import fitz  # PyMuPDF
 from PIL import Image, ImageEnhance, ImageStat  # 変更点①: ImageStatを追加
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv
 load_dotenv()
+import llm_client
+import progress
+import json_cache
+import metrics
+import profiling
+try:
+    import page_features  # 白紙・重複ページの判定（numpy が必要）
+except ImportError:
+    page_features = None
+try:
+    import master_index  # ヘッダーの指紋によるマスターIDの判定（numpy が必要）
+except ImportError:
+    master_index = None
 
 # ============================
 # 設定エリア
 # ============================
-GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY", "")
 INPUT_DIR = "./inputs"
 OUTPUT_DIR = "./step1_texts"
+DONE_DIR = "./done"
 MASTER_DB_DIR = "./masters"  # ★変更点: マスターDBのディレクトリ設定を追加
 MODEL_NAME = "gemini-2.5-flash" 
-# ============================
-
-client = genai.Client(api_key=GOOGLE_API_KEY)
+# APIキー・接続先・リトライ設定は llm_client.py（config.json の "llm"）で管理
 
-def print_progress_bar(iteration, total, prefix='', suffix='', length=30):
-    percent = ("{0:.1f}").format(100 * (iteration / float(total)))
-    filled_length = int(length * iteration // total)
-    bar = '█' * filled_length + '-' * (length - filled_length)
-    if len(suffix) > 20: suffix = suffix[:17] + "..."
-    print(f'Progress: {prefix} |{bar}| {percent}% {suffix}')
-    sys.stdout.flush()
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+def _load_config() -> dict:
+    try:
+        with open(_CONFIG_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+_CFG = _load_config()
+# 画像化・アップロードを何ページ先まで進めておくか（config.json の "step1_page_window"）
+# ページ数の多いPDFでも、ディスク上の画像・メモリ上のページはこの枚数程度に収まる
+PAGE_WINDOW = max(1, int(_CFG.get("step1_page_window", 2) or 2))
+# アップロード前に白紙ページ（裏面など）と重複ページ（二重送り）を除く
+DROP_BLANK_PAGES = bool(_CFG.get("step1_drop_blank_pages", True))
+DROP_DUPLICATE_PAGES = bool(_CFG.get("step1_drop_duplicate_pages", True))
+DUPLICATE_DISTANCE = 6   # 256ビットの差分ハッシュの違いがこれ以下で、インクの割合も近ければ重複
+# マスターIDをまずヘッダーの指紋（coord_db の参照PDF）で判定し、決まらないときだけLLMに選ばせる
+LOCAL_MASTER_MATCH = bool(_CFG.get("step1_local_master_match", True))
+# ============================
 
 def call_gemini_safe(contents_list, response_mime_type="text/plain"):
-    max_retries = 3
-    retry_delay = 20
-    normal_delay = 5 
+    try:
+        response = llm_client.gemini_generate(MODEL_NAME, contents_list, response_mime_type)
+        return response.text
+    except KeyboardInterrupt:
+        print("\nユーザーによる中断を検知しました。終了します。")
+        sys.exit(1)
+    except Exception as e:
+        print(f"\nエラー発生: {e}")
+        return f"ERROR: {e}"
 
-    for attempt in range(max_retries):
-        try:
-            response = client.models.generate_content(
-                model=MODEL_NAME,
-                contents=contents_list,
-                config=types.GenerateContentConfig(response_mime_type=response_mime_type)
-            )
-            time.sleep(normal_delay)
-            return response.text
-
-        except KeyboardInterrupt:
-            print("\nユーザーによる中断を検知しました。終了します。")
-            sys.exit(1)
-        except Exception as e:
-            print(f"\nエラー発生 (試行 {attempt+1}/{max_retries}): {e}")
-            if attempt < max_retries - 1:
-                print(f"⏳ {retry_delay}秒待機してリトライします...")
-                time.sleep(retry_delay)
-            else:
-                return f"ERROR: {e}"
-    return "ERROR: Max retries exceeded"
-
-def pdf_to_images(pdf_path, dpi=300):
-    """PDFの全ページを画像化してリストで返す"""
-    doc = fitz.open(pdf_path)
-    img_paths = []
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        pix = page.get_pixmap(dpi=dpi)
-        img_path = f"temp_{os.path.basename(pdf_path)}_p{page_num}.png"
-        pix.save(img_path)
-        
-        # --- 【変更点②: 自動コントラスト調整ロジックの追加】 ---
-        img = Image.open(img_path)
+def is_api_error(text):
+    """ERROR の結果が LLM のAPI呼び出しの失敗（llm_client.LLMError の「[gemini] ...」）によるものか"""
+    return text.lstrip().startswith(("ERROR: [gemini]", "ERROR: [anthropic]"))
+
+def render_page(page, img_path, dpi=300):
+    """1ページを画像化してコントラストを調整し、img_path に保存する"""
+    pix = page.get_pixmap(dpi=dpi)
+    pix.save(img_path)
+    del pix  # 300dpiのピクセルデータをすぐに手放す
+    
+    # --- 【変更点②: 自動コントラスト調整ロジックの追加】 ---
+    with Image.open(img_path) as img:
         # 画像をグレースケールに変換して明るさの平均値を計算
         gray_img = img.convert("L")
         stat = ImageStat.Stat(gray_img)
@@ -88,10 +96,117 @@ def pdf_to_images(pdf_path, dpi=300):
             img_enhanced.save(img_path)
         # 230以下の場合は十分な濃さがあると判断し、上書き保存をスキップ（何もしない）
         # --------------------------------------------------------
-        
-        img_paths.append(img_path)
-    doc.close()
-    return img_paths
+    return img_path
+
+class PageFilter:
+    """
+    300dpiで画像化する前に、36dpiのグレースケールで白紙ページと直前までのページの重複を見分ける。
+    白紙の判定は batch_splitter.py と同じ page_features.is_blank。
+    除いたページ数と、アップロードしたページの平均サイズから見積もった削減バイト数を記録する。
+    """
+    def __init__(self, drop_blank=DROP_BLANK_PAGES, drop_duplicates=DROP_DUPLICATE_PAGES):
+        self.drop_blank = drop_blank and page_features is not None
+        self.drop_duplicates = drop_duplicates and page_features is not None
+        self.kept = []  # (差分ハッシュ, インクの割合)
+        self.dropped = {"blank": [], "duplicate": []}  # 理由 -> ページ番号
+        self.uploaded_bytes = 0
+        self.uploaded_pages = 0
+
+    @property
+    def enabled(self):
+        return self.drop_blank or self.drop_duplicates
+
+    def check(self, page_num, page):
+        """除くなら理由（"blank" / "duplicate"）、使うなら None"""
+        if not self.enabled:
+            return None
+        with metrics.timer("page_filter"):
+            gray = page_features.render_gray(page)
+            if self.drop_blank and page_features.is_blank(gray):
+                self.dropped["blank"].append(page_num)
+                return "blank"
+            h = page_features.dhash(gray, size=16)
+            coverage = page_features.ink_contrast(gray)
+            if self.drop_duplicates:
+                for kh, kc in self.kept:
+                    if page_features.hamming(h, kh) <= DUPLICATE_DISTANCE and abs(coverage - kc) <= 0.1 * max(kc, 1e-6):
+                        self.dropped["duplicate"].append(page_num)
+                        return "duplicate"
+            self.kept.append((h, coverage))
+        return None
+
+    def keep_anyway(self, page_num):
+        """除いたページを使うことにする（全ページが除かれたときに1ページ目だけは送るため）"""
+        for pages in self.dropped.values():
+            if page_num in pages:
+                pages.remove(page_num)
+
+    def note_upload(self, img_path):
+        try:
+            self.uploaded_bytes += os.path.getsize(img_path)
+            self.uploaded_pages += 1
+        except OSError:
+            pass
+
+    def saved(self):
+        """(除いたページ数, 削減できたアップロードの推定バイト数)"""
+        n = sum(len(v) for v in self.dropped.values())
+        avg = self.uploaded_bytes / self.uploaded_pages if self.uploaded_pages else 0
+        return n, int(n * avg)
+
+def iter_page_images(pdf_path, dpi=300, pdf_bytes=None, page_filter=None):
+    """
+    PDFを1ページずつ画像化して (ページ番号, 画像パス) を返す（pdf_bytes があればファイルを読まずにそれを使う）。
+    page_filter（PageFilter）を渡すと、白紙・重複ページは画像化せずに飛ばす。
+    ただし全ページが除かれたときは、判定の誤りで答案を丸ごと失わないよう1ページ目だけは返す。
+    """
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf") if pdf_bytes is not None else fitz.open(pdf_path)
+    try:
+        kept = 0
+        for page_num in range(len(doc)):
+            if page_filter is not None and page_filter.check(page_num, doc[page_num]):
+                if page_num < len(doc) - 1 or kept:
+                    continue
+                page_num = 0
+                page_filter.keep_anyway(page_num)
+            img_path = f"temp_{os.path.basename(pdf_path)}_p{page_num}.png"
+            with metrics.timer("rasterize"):
+                render_page(doc[page_num], img_path, dpi)
+            kept += 1
+            yield page_num, img_path
+    finally:
+        doc.close()
+
+def pdf_to_images(pdf_path, dpi=300, pdf_bytes=None):
+    """PDFの全ページを画像化してリストで返す（ベンチマーク用。Step1本体は stream_pages を使う）"""
+    return [p for _, p in iter_page_images(pdf_path, dpi, pdf_bytes)]
+
+def stream_pages(pdf_path, pdf_bytes=None, window=None, page_filter=None):
+    """
+    画像化 → コントラスト調整 → アップロードをページ単位で流し、(ページ番号, 画像パス, アップロード結果) を順に返す。
+    アップロード中のページは最大 window 枚で、それ以上は先に画像化しない。
+    受け取った側は使い終わった画像パスを削除する（途中で止めた場合、未使用の画像はここで削除する）。
+    """
+    window = window or PAGE_WINDOW
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=window)
+    try:
+        for page_num, img_path in iter_page_images(pdf_path, dpi=300, pdf_bytes=pdf_bytes, page_filter=page_filter):
+            if page_filter is not None:
+                page_filter.note_upload(img_path)
+            pending.append((page_num, img_path,
+                            pool.submit(llm_client.gemini_upload, img_path, mime_type="image/png")))
+            if len(pending) >= window:
+                page_num, img_path, future = pending.popleft()
+                yield page_num, img_path, future.result()
+        while pending:
+            page_num, img_path, future = pending.popleft()
+            yield page_num, img_path, future.result()
+    finally:
+        pool.shutdown(wait=True)
+        for _, img_path, _ in pending:
+            if os.path.exists(img_path):
+                os.remove(img_path)
 
 def crop_image(img_path, box):
     img = Image.open(img_path)
@@ -121,6 +236,7 @@ def crop_image(img_path, box):
     cropped_img = img.crop((left, upper, right, lower))
     cropped_path = f"cropped_{os.path.basename(img_path)}"
     cropped_img.save(cropped_path)
+    img.close()  # 元のページ画像をすぐに削除できるように閉じておく
     return cropped_path
 
 def find_mark_sheet_box(upload_file):
@@ -144,26 +260,105 @@ def find_mark_sheet_box(upload_file):
             pass
     return None
 
-def extract_text_with_ai(pdf_path, master_ids_str):  # ★変更点: 引数に master_ids_str を追加
+def _log_dropped_pages(filename, page_filter):
+    dropped, saved_bytes = page_filter.saved()
+    if not dropped:
+        return
+    blank, dup = page_filter.dropped["blank"], page_filter.dropped["duplicate"]
+    parts = []
+    if blank:
+        parts.append(f"白紙 {len(blank)}ページ（p{', p'.join(str(i + 1) for i in blank)}）")
+    if dup:
+        parts.append(f"重複 {len(dup)}ページ（p{', p'.join(str(i + 1) for i in dup)}）")
+    print(f"🧹 {filename}: {'・'.join(parts)}を除外（アップロード約{saved_bytes / 1024 / 1024:.1f}MB削減）")
+    for reason, pages in page_filter.dropped.items():
+        if pages:
+            metrics.inc("pages_dropped", len(pages), reason=reason)
+    metrics.inc("upload_bytes_saved", saved_bytes)
+
+_master_index = None
+
+_missing_warned = set()
+
+def match_master_locally(pdf_path, pdf_bytes=None, ids=()):
+    """
+    1ページ目のヘッダーからマスターIDを判定する。判定できなければ None（LLMに任せる）。
+    ids（masters/ のマスターID）のどれかに参照PDFがなければ、その用紙と取り違えかねないので判定しない
+    """
+    global _master_index
+    if master_index is None or not LOCAL_MASTER_MATCH:
+        return None
+    try:
+        with metrics.timer("master_match"):
+            if _master_index is None:
+                _master_index = master_index.MasterIndex()
+            _master_index.refresh()
+            if not _master_index.entries:
+                return None
+            missing = _master_index.missing(ids)
+            if missing:
+                if tuple(missing) not in _missing_warned:
+                    _missing_warned.add(tuple(missing))
+                    print(f"⚠️ 参照PDFのないマスターがあるため、ヘッダーでは判定しません: {', '.join(missing)}")
+                metrics.inc("master_match_fallback")
+                return None
+            match = _master_index.match_pdf(pdf_path, pdf_bytes)
+    except Exception as e:
+        print(f"⚠️ ヘッダーによるマスター判定に失敗しました（LLMで判定します）: {e}")
+        return None
+    metrics.inc("master_match_local" if match else "master_match_fallback")
+    return match
+
+def reconcile_master_id(filename, result_text, match, ids):
+    """
+    LLMが1行目に書いたマスターIDとヘッダーの判定を突き合わせる。
+    LLMが選択肢にないID（UNKNOWN など）を書いたときはヘッダーの判定で置き換え、
+    選択肢の別のIDを読んだときは食い違いとして警告し、LLMの読みを残す
+    """
+    first, _, rest = result_text.lstrip().partition("\n")
+    read = first.strip()
+    if read == match.master_id:
+        metrics.inc("master_match_agree")
+        return result_text
+    if read in ids:
+        print(f"⚠️ {filename}: マスターIDが食い違っています（LLM: {read} / ヘッダー: {match.master_id}）。LLMの読みを使います")
+        metrics.inc("master_match_conflict")
+        return result_text
+    print(f"🧭 {filename}: LLMが読めなかったマスターID（{read[:30] or '空'}）をヘッダーの判定 {match.master_id} で補いました")
+    metrics.inc("master_match_filled")
+    return f"{match.master_id}\n{rest}"
+
+def extract_text_with_ai(pdf_path, master_ids_str, pdf_bytes=None):  # ★変更点: 引数に master_ids_str を追加
     filename = os.path.basename(pdf_path)
-    img_paths = []
     cropped_img_path = None
+    upload_cropped = None
     uploaded_pages = []
+    page_filter = PageFilter()
     
     try:
-        # 1. 全ページを画像化
-        img_paths = pdf_to_images(pdf_path, dpi=300)
-        
-        # 2. 全ページをGeminiにアップロード
-        for p in img_paths:
-            uf = client.files.upload(
-                file=p,
-                config=types.UploadFileConfig(mime_type="image/png")
-            )
-            while uf.state.name == "PROCESSING":
-                time.sleep(1)
-                uf = client.files.get(name=uf.name)
-            uploaded_pages.append(uf)
+        ids = [line[2:].strip() for line in master_ids_str.splitlines() if line.startswith("- ")]
+        match = match_master_locally(pdf_path, pdf_bytes, ids)
+        if match:
+            print(f"🧭 {filename}: ヘッダーから {match.master_id} と判定しました（差 {match.distance}）")
+
+        # 1. 1ページずつ 画像化 → アップロード（ページ数が多くてもディスク・メモリ上の画像は数枚分だけ）
+        # 2. マークシートの有無もページごとに判定し、見つかったページは画像を消す前に切り抜いておく
+        with contextlib.closing(stream_pages(pdf_path, pdf_bytes, page_filter=page_filter)) as pages:
+            for page_num, img_path, uf in pages:
+                try:
+                    uploaded_pages.append(uf)
+                    if upload_cropped is None:
+                        box = find_mark_sheet_box(uf)
+                        if box:
+                            with metrics.timer("crop"):
+                                cropped_img_path = crop_image(img_path, box)
+                            upload_cropped = llm_client.gemini_upload(cropped_img_path, mime_type="image/png")
+                finally:
+                    if os.path.exists(img_path):
+                        os.remove(img_path)
+        _log_dropped_pages(filename, page_filter)
+        if not uploaded_pages:
+            return filename, "ERROR: 白紙のPDFです（内容のあるページがありません）"
             
         # --- 【タスク1: 記述式とヘッダーの読み取り（全ページ対象）】 ---
         # ★変更点: プロンプトをf-string化し、master_ids_str を動的に埋め込み
@@ -197,23 +392,13 @@ def extract_text_with_ai(pdf_path, master_ids_str):  # ★変更点: 引数に m
         """
         # アップロードした全ページを渡す
         result_text = call_gemini_safe(uploaded_pages + [prompt_text])
+        if match and not result_text.startswith("ERROR"):
+            result_text = reconcile_master_id(filename, result_text, match, ids)
 
-        # --- 【タスク2: マークシートの読み取り（該当ページのみ切り抜き）】 ---
+        # --- 【タスク2: マークシートの読み取り（1.で切り抜いたページのみ）】 ---
         result_marks = ""
-        for i, uf in enumerate(uploaded_pages):
-            box = find_mark_sheet_box(uf)
-            if box:
-                # マークシートが見つかったページ(i)の画像を切り抜く
-                cropped_img_path = crop_image(img_paths[i], box)
-                upload_cropped = client.files.upload(
-                    file=cropped_img_path,
-                    config=types.UploadFileConfig(mime_type="image/png")
-                )
-                while upload_cropped.state.name == "PROCESSING":
-                    time.sleep(1)
-                    upload_cropped = client.files.get(name=upload_cropped.name)
-                    
-                prompt_marks = """
+        if upload_cropped is not None:
+            prompt_marks = """
                 提供されたマークシートの拡大画像から事実だけを読み取ってください。
 
                 【最重要ルール：マークシートの読み取り】
@@ -233,8 +418,7 @@ def extract_text_with_ai(pdf_path, master_ids_str):  # ★変更点: 引数に m
                 ・すべての行が同じ記号になることはあり得ません。前の問題に引きずられず、1行ずつ独立して観察してください。
                 ・余計な挨拶は不要です。
                 """
-                result_marks = call_gemini_safe([upload_cropped, prompt_marks])
-                break  # マークシートを1つ見つけて処理したらループを抜ける
+            result_marks = call_gemini_safe([upload_cropped, prompt_marks])
 
         # 2つの結果を合体させて返す
         final_text = result_text
@@ -247,16 +431,36 @@ def extract_text_with_ai(pdf_path, master_ids_str):  # ★変更点: 引数に m
         return filename, f"ERROR: {e}"
         
     finally:
-        # ゴミファイルの削除
-        for p in img_paths:
-            if os.path.exists(p):
-                os.remove(p)
+        # ゴミファイルの削除（ページ画像は stream_pages 側・ループ内で削除済み）
         if cropped_img_path and os.path.exists(cropped_img_path):
             os.remove(cropped_img_path)
 
+def _zip_work(zip_path):
+    """ZIP内のPDFを inputs/ に取り込みながら (パス, bytes) を順に返す。重複は飛ばす"""
+    import zipfile
+    import ingest
+    from archive_index import ArchiveIndex
+    index = ArchiveIndex(DONE_DIR) if os.path.isdir(DONE_DIR) else None
+    if index:
+        index.refresh()
+        index.backfill_hashes()
+    ingestor = ingest.Ingestor(INPUT_DIR, index)
+    with zipfile.ZipFile(zip_path) as z:
+        total = len(ingestor.zip_members(z))
+
+    def gen():
+        for r in ingestor.iter_zip(zip_path, keep_bytes=True):
+            if r.status == "duplicate":
+                print(f"⏭️ {r.source} は {r.duplicate_of} と同じ内容のためスキップ")
+                continue
+            yield r.path, r.data
+    return gen(), total
+
+@profiling.profiled("step1")
 def main():
     import sys
     sys.stdout.reconfigure(encoding='utf-8')
+    metrics.reset()  # 常駐ワーカーで前回の実行の集計を持ち越さない
     
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
@@ -265,14 +469,9 @@ def main():
     master_ids_str = ""
     if os.path.exists(MASTER_DB_DIR):
         ids = []
-        for path in glob.glob(os.path.join(MASTER_DB_DIR, "*.json")):
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                if "meta" in data and "id" in data["meta"]:
-                    ids.append(f"- {data['meta']['id']}")
-            except Exception:
-                pass
+        for path, data in json_cache.load_dir(MASTER_DB_DIR):
+            if "meta" in data and "id" in data["meta"]:
+                ids.append(f"- {data['meta']['id']}")
         if ids:
             master_ids_str = "\n".join(ids)
             
@@ -283,32 +482,60 @@ def main():
         print("   → ファイルを追加後、再実行してください。")
         return
     
-    pdf_files = glob.glob(os.path.join(INPUT_DIR, "*.pdf"))
-    total_files = len(pdf_files)
+    # --files a.pdf b.pdf で対象を絞れる（backend のジョブキューは1件ずつ渡す）
+    # --zip scans.zip ならZIPから直接取り込み、書き出したPDFを読み直さずにそのまま処理する
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", nargs="*", default=None)
+    parser.add_argument("--zip", default=None)
+    args, _ = parser.parse_known_args()
+    if args.zip:
+        work, total_files = _zip_work(args.zip)
+    else:
+        if args.files is not None:
+            pdf_files = [os.path.join(INPUT_DIR, os.path.basename(f)) for f in args.files]
+            pdf_files = [p for p in pdf_files if os.path.exists(p)]
+        else:
+            pdf_files = glob.glob(os.path.join(INPUT_DIR, "*.pdf"))
+        work, total_files = ((p, None) for p in pdf_files), len(pdf_files)
     
-    if not pdf_files:
+    if not total_files:
         print("PDFが見つかりません。")
         return
 
     print(f"📄 {total_files}件のファイルを処理します（モデル: {MODEL_NAME}）...")
-    print_progress_bar(0, total_files, prefix='Progress:', suffix='Start', length=30)
+    progress.emit("stage_start", stage="step1", total=total_files)
     
     start_time = time.time()
+    error_count = 0
+    processed = 0
 
-    for i, pdf_path in enumerate(pdf_files):
+    for i, (pdf_path, pdf_bytes) in enumerate(work):
+        t_file = time.time()
         # ★変更点: 動的に生成した master_ids_str を関数に渡す
-        filename, text = extract_text_with_ai(pdf_path, master_ids_str)
+        filename, text = extract_text_with_ai(pdf_path, master_ids_str, pdf_bytes)
         
         base_name = filename.replace('.pdf', '')
         txt_path = os.path.join(OUTPUT_DIR, f"{base_name}_draft.txt")
         
         with open(txt_path, "w", encoding="utf-8") as f:
             f.write(text)
-        
-        print_progress_bar(i + 1, total_files, prefix='Progress:', suffix=f'Done ({base_name})', length=30)
+
+        lines = text.strip().split('\n')
+        status = "error" if "ERROR:" in text else "done"
+        error_count += status == "error"
+        processed += 1
+        metrics.observe("step1.file", time.time() - t_file)
+        progress.emit("file", stage="step1", file=filename, index=i + 1, total=total_files, status=status,
+                      seconds=round(time.time() - t_file, 2),
+                      master_id=lines[0].strip() if lines else None,
+                      student_id=lines[1].strip() if len(lines) > 1 else None)
 
     end_time = time.time()
+    progress.emit("stage_end", stage="step1", done=processed - error_count, skipped=total_files - processed,
+                  errors=error_count,
+                  seconds=round(end_time - start_time, 1))
     print(f"\n🎉 全処理完了！ 所要時間: {end_time - start_time:.1f}秒")
+    metrics.finish("step1", sheets=processed - error_count, seconds=end_time - start_time, errors=error_count)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
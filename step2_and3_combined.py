@@ -3,20 +3,28 @@ Step2 + Step3 統合スクリプト
 JSONファイルをディスクに書かず、メモリ上でStep3に渡す
 """
 import json
+import argparse
 import os
 import glob
 import time
-import sys
-import anthropic
 import fitz
 from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+import llm_client
+import results_store
+import json_cache
+import progress
+import metrics
+import profiling
+try:
+    import scan_registration  # スキャンのずれ・傾きの補正（numpy が必要）
+except ImportError:
+    scan_registration = None
 
 # ============================
 # 設定エリア
 # ============================
-ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 MODEL_NAME = "claude-sonnet-4-5-20250929"
 COORD_DB_DIR = "./coord_db"
 INPUT_TEXT_DIR = "./step1_texts"
@@ -42,11 +50,10 @@ def load_coord(master_id):
     path = os.path.join(COORD_DB_DIR, f"{master_id}.json")
     if not os.path.exists(path):
         return None
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return json_cache.load_json(path)
     
 
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+# APIキー・接続先・リトライ設定は llm_client.py（config.json の "llm"）で管理
 BETAS = ["prompt-caching-2024-07-31"]
 
 SYSTEM_PROMPT = """あなたは東京大学受験専門の予備校講師です。
@@ -103,41 +110,24 @@ SYSTEM_PROMPT = """あなたは東京大学受験専門の予備校講師です
 
 
 
-def print_progress_bar(iteration, total, prefix='', suffix='', length=30):
-    percent = f"{100 * (iteration / float(total)):.1f}"
-    filled = int(length * iteration // total)
-    bar = '█' * filled + '-' * (length - filled)
-    suffix = suffix[:17] + "..." if len(suffix) > 20 else suffix
-    print(f'Progress: {prefix} |{bar}| {percent}% {suffix}')
-    sys.stdout.flush()
-        
-        
 def load_coord_db(db_dir):
     coord_db = {}
     if not os.path.exists(db_dir):
         return coord_db
-    for path in glob.glob(os.path.join(db_dir, "*.json")):
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            mid = data.get("master_id")
-            if mid:
-                coord_db[mid] = data
-        except Exception as e:
-            print(f"⚠️ coord_dbロードエラー ({path}): {e}")
+    on_error = lambda path, e: print(f"⚠️ coord_dbロードエラー ({path}): {e}")
+    for path, data in json_cache.load_dir(db_dir, on_error):
+        mid = data.get("master_id")
+        if mid:
+            coord_db[mid] = data
     return coord_db
 
 
 def load_all_masters(db_dir):
     masters = []
-    for path in glob.glob(os.path.join(db_dir, "*.json")):
-        try:
-            with open(path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            if "meta" in data and "id" in data["meta"]:
-                masters.append(data)
-        except Exception as e:
-            print(f"⚠️ JSONロードエラー ({path}): {e}")
+    on_error = lambda path, e: print(f"⚠️ JSONロードエラー ({path}): {e}")
+    for path, data in json_cache.load_dir(db_dir, on_error):
+        if "meta" in data and "id" in data["meta"]:
+            masters.append(data)
     return masters
 
 
@@ -192,41 +182,46 @@ def extract_json_from_response(raw_text):
     return raw_text
 
 
+def _usage_dict(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    keys = ["input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"]
+    return {k: getattr(usage, k, None) for k in keys}
+
+
 def grade_answer(student_text, master_data, rubric_txt=None):
-    """Step2: 採点してdictを返す（ファイルに書かない）"""
+    """Step2: 採点してdictを返す（ファイルに書かない）。トークン使用量は "usage" キーに入れる"""
     content = build_content(master_data, student_text, rubric_txt)
+    # レート制限・一時エラーのリトライは llm_client 側で行う。ここではJSONの崩れのみ再試行する
     for attempt in range(3):
         try:
-            response = client.beta.messages.create(
+            response = llm_client.anthropic_create(
                 model=MODEL_NAME,
                 max_tokens=4000,
                 system=SYSTEM_PROMPT,
                 messages=[{"role": "user", "content": content}],
                 betas=BETAS
             )
-            time.sleep(1)
             raw_text = response.content[0].text
-            json_str = extract_json_from_response(raw_text)
-            print("=== API RESPONSE ===")
-            print(json_str[:500])
-            
-            return json.loads(json_str)
-        except anthropic.RateLimitError:
-            wait = 30 * (attempt + 1)
-            print(f"\n⚠️ レート制限 (試行{attempt+1}/3): {wait}秒待機...")
-            time.sleep(wait)
-        except anthropic.APIError as e:
-            print(f"\n⚠️ APIエラー (試行{attempt+1}/3): {e}")
-            if attempt < 2:
-                time.sleep(15)
+            with metrics.timer("json_parse"):
+                json_str = extract_json_from_response(raw_text)
+                print("=== API RESPONSE ===")
+                print(json_str[:500])
+
+                data = json.loads(json_str)
+            data["usage"] = _usage_dict(response)
+            return data
+        except llm_client.LLMError as e:
+            print(f"\n⚠️ APIエラー: {e}")
+            return {"error": str(e)}
         except json.JSONDecodeError as e:
+            metrics.inc("json_retries")
             print(f"\n⚠️ JSONパース失敗 (試行{attempt+1}/3): {e}")
-            if attempt < 2:
-                time.sleep(5)
         except Exception as e:
             print(f"\n⚠️ 予期しないエラー (試行{attempt+1}/3): {e}")
             if attempt < 2:
-                time.sleep(15)
+                time.sleep(llm_client.backoff_delay(attempt))
     return {"error": "Max retries exceeded"}
 
 
@@ -243,18 +238,26 @@ def add_editable_text(page, rect_coords, text, size=10, align=0):
     annot.update()
 
 
-def write_to_pdf(data, master_id, pdf_path, coord_db):
-    """Step3: dictを受け取ってPDFに書き込む"""
-    coords = load_coord(master_id)
-    if not coords:
-        print(f"⚠️ COORD_DBに {master_id} がありません")
-        return False
+def _placer(doc, pdf_path, master_id, coords):
+    """coord_db の [ページ, x0, y0, x1, y1] → 答案上の [x0, y0, x1, y1]（参照PDFがあればスキャンのずれを補正）"""
+    reg = None
+    if scan_registration is not None:
+        try:
+            reg = scan_registration.for_sheet(doc, pdf_path, master_id, coords, COORD_DB_DIR)
+        except Exception as e:
+            print(f"⚠️ 位置合わせを使えません（座標をそのまま使います）: {e}")
+    return reg.rect if reg else (lambda c: c[1:])
 
-    doc = fitz.open(pdf_path)
 
+def stamp_fields(data, coords):
+    """
+    印字する欄を [(名前, [ページ, x0, y0, x1, y1], テキスト, align), ...] で返す（印字する順）。
+    write_to_pdf と validate_layout.py（はみ出しの確認）で共通
+    """
+    fields = []
     # 採点者名
     if "grader_name" in coords:
-        add_editable_text(doc[coords["grader_name"][0]], coords["grader_name"][1:], _get_grader_name(), size=10, align=1)
+        fields.append(("grader_name", coords["grader_name"], _get_grader_name(), 1))
 
     # 合計点
     total_score, total_max = 0, 0
@@ -265,9 +268,9 @@ def write_to_pdf(data, master_id, pdf_path, coord_db):
     score_str = f"{total_score}／{total_max}"
 
     if "total_score" in coords:
-        add_editable_text(doc[coords["total_score"][0]], coords["total_score"][1:], score_str, size=10, align=1)
+        fields.append(("total_score", coords["total_score"], score_str, 1))
     if "score_field_2" in coords:
-        add_editable_text(doc[coords["score_field_2"][0]], coords["score_field_2"][1:], score_str, size=10, align=1)
+        fields.append(("score_field_2", coords["score_field_2"], score_str, 1))
 
     # 設問
     q_coords_map = coords.get("questions", {})
@@ -282,27 +285,45 @@ def write_to_pdf(data, master_id, pdf_path, coord_db):
             kanpe_list = [f"{k}:{'〇' if v == 'circle' else '✖'}" for k, v in q_val["sub_results"].items()]
             text_content = f"{text_content}\n【確認用】{' '.join(kanpe_list)}"
         if "text" in c and c["text"] is not None and text_content:
-            add_editable_text(doc[c["text"][0]], c["text"][1:], text_content, size=10, align=0)
+            fields.append((f"{q_key}:text", c["text"], text_content, 0))
         if "score" in c:
             s_str = f"{q_val.get('score',0)}／{q_val.get('max',0)}"
-            add_editable_text(doc[c["score"][0]], c["score"][1:], s_str, size=10, align=1)
+            fields.append((f"{q_key}:score", c["score"], s_str, 1))
 
     # コメント
     if "comment_box" in coords:
         parts = data.get("comment_parts", {})
         full_comment = f"【コメント】\n{parts.get('praise','')}\n{parts.get('advice','')}\n{parts.get('closing','')}"
-        add_editable_text(doc[coords["comment_box"][0]], coords["comment_box"][1:], full_comment, size=10, align=0)
+        fields.append(("comment_box", coords["comment_box"], full_comment, 0))
+    return fields
+
+
+def write_to_pdf(data, master_id, pdf_path, coord_db, output_dir=None):
+    """Step3: dictを受け取ってPDFに書き込む（output_dir省略時は OUTPUT_DIR）"""
+    coords = load_coord(master_id)
+    if not coords:
+        print(f"⚠️ COORD_DBに {master_id} がありません")
+        return False
+
+    doc = fitz.open(pdf_path)
+    place = _placer(doc, pdf_path, master_id, coords)
+    for _, coord, text, align in stamp_fields(data, coords):
+        add_editable_text(doc[coord[0]], place(coord), text, size=10, align=align)
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    output_dir = output_dir or OUTPUT_DIR
+    os.makedirs(output_dir, exist_ok=True)
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    out_path = os.path.join(OUTPUT_DIR, f"{base_name}.pdf")
+    out_path = os.path.join(output_dir, f"{base_name}.pdf")
     doc.save(out_path)
+    doc.close()
     return True
 
 
+@profiling.profiled("step23")
 def main():
     import sys
     sys.stdout.reconfigure(encoding='utf-8')
+    metrics.reset()  # 常駐ワーカーで前回の実行の集計を持ち越さない
     
     coord_db = load_coord_db(COORD_DB_DIR)
     if not coord_db:
@@ -313,7 +334,17 @@ def main():
         print("❌ マスターデータが見つかりません。./masters/ を確認してください。")
         return
 
-    text_files = glob.glob(os.path.join(INPUT_TEXT_DIR, "*_draft.txt"))
+    # --files a.pdf b.pdf で対象を絞れる（backend のジョブキューは1件ずつ渡す）
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", nargs="*", default=None)
+    parser.add_argument("--run-id", default=None, help="採点結果ストアに記録する実行ID（省略時は新規）")
+    args, _ = parser.parse_known_args()
+    if args.files is not None:
+        text_files = [os.path.join(INPUT_TEXT_DIR, f"{os.path.splitext(os.path.basename(f))[0]}_draft.txt")
+                      for f in args.files]
+        text_files = [p for p in text_files if os.path.exists(p)]
+    else:
+        text_files = glob.glob(os.path.join(INPUT_TEXT_DIR, "*_draft.txt"))
     if not text_files:
         print("❌ step1のテキストファイルが見つかりません。")
         return
@@ -321,7 +352,15 @@ def main():
     txt_count = len(glob.glob(os.path.join(RUBRIC_TXT_DIR, "*.txt"))) if os.path.exists(RUBRIC_TXT_DIR) else 0
     print(f"📚 解説TXT: {txt_count}件 | 採点基準JSON: {len(masters_list)}件")
     print(f"🚀 {len(text_files)}件の答案を処理します（モデル: {MODEL_NAME}）...")
-    print_progress_bar(0, len(text_files), prefix='Progress:', suffix='Start', length=30)
+    progress.emit("stage_start", stage="step23", total=len(text_files))
+
+    # 採点結果をSQLiteにも残す（再印字・集計用）。開けなくても採点は続ける
+    run_id = args.run_id or results_store.new_run_id()
+    try:
+        store = results_store.ResultsStore()
+    except Exception as e:
+        print(f"⚠️ 採点結果ストアを開けませんでした（保存せずに続行します）: {e}")
+        store = None
 
     start_time = time.time()
     success_count = 0
@@ -329,6 +368,7 @@ def main():
     error_count = 0
 
     for i, txt_path in enumerate(text_files):
+        t_file = time.time()
         filename = os.path.basename(txt_path)
         base_name = filename.replace("_draft.txt", "")
 
@@ -344,7 +384,8 @@ def main():
             print(f"\n⚠️ スキップ: {filename}")
             print(f"   → 1行目: \"{first_line}\"")
             print(f"   → 登録済みマスターID: {', '.join(available_ids)}")
-            print_progress_bar(i + 1, len(text_files), prefix='Progress:', suffix=f'Skip ({filename})', length=30)
+            progress.emit("file", stage="step23", file=f"{base_name}.pdf", index=i + 1, total=len(text_files),
+                          status="skip", seconds=round(time.time() - t_file, 2), master_id=first_line)
             continue
             
 
@@ -352,17 +393,25 @@ def main():
         rubric_txt = load_rubric_txt(master_id)
 
         # Step2: 採点（メモリ上のdictとして受け取る）
+        t_grade = time.time()
         result_data = grade_answer(student_text, matched_master, rubric_txt)
+        grade_seconds = time.time() - t_grade
+        metrics.observe("grade", grade_seconds)
 
         if "error" in result_data:
             error_count += 1
-            print_progress_bar(i + 1, len(text_files), prefix='Progress:', suffix=f'Error ({filename})', length=30)
+            progress.emit("file", stage="step23", file=f"{base_name}.pdf", index=i + 1, total=len(text_files),
+                          status="error", seconds=round(time.time() - t_file, 2), master_id=master_id,
+                          grade_seconds=round(grade_seconds, 2))
             continue
 
         result_data["master_id"] = master_id
+        usage = result_data.pop("usage", {})
 
         # Step3: PDFに直接書き込む
         pdf_path = os.path.join(INPUT_PDF_DIR, f"{base_name}.pdf")
+        ok = False
+        t_stamp = time.time()
         if not os.path.exists(pdf_path):
             print(f"\n⚠️ PDFが見つかりません: {pdf_path}")
             error_count += 1
@@ -372,16 +421,39 @@ def main():
                 success_count += 1
             else:
                 error_count += 1
+        stamp_seconds = time.time() - t_stamp
+        if ok:
+            metrics.observe("stamp", stamp_seconds)
+
+        if store:
+            lines = student_text.strip().split('\n')
+            try:
+                store.save(run_id, base_name, master_id, result_data,
+                           student_id=result_data.get("student_id") or (lines[1].strip() if len(lines) > 1 else None),
+                           model=MODEL_NAME, usage=usage, grade_seconds=grade_seconds,
+                           stamp_seconds=stamp_seconds if ok else None, stamped=ok)
+            except Exception as e:
+                print(f"⚠️ 採点結果の保存に失敗しました ({filename}): {e}")
+
+        metrics.observe("step23.file", time.time() - t_file)
+        progress.emit("file", stage="step23", file=f"{base_name}.pdf", index=i + 1, total=len(text_files),
+                      status="done" if ok else "error", seconds=round(time.time() - t_file, 2),
+                      master_id=master_id, grade_seconds=round(grade_seconds, 2),
+                      stamp_seconds=round(stamp_seconds, 2),
+                      score=results_store.totals(result_data)[0])
+
+    elapsed = time.time() - start_time
+    print(f"\n✨ 完了！ 成功:{success_count}件 スキップ:{skip_count}件 エラー:{error_count}件 | 所要時間: {elapsed:.1f}秒")
+    progress.emit("stage_end", stage="step23", done=success_count, skipped=skip_count, errors=error_count,
+                  seconds=round(elapsed, 1))
+    metrics.finish("step23", run=run_id, sheets=success_count, seconds=elapsed,
+                   skipped=skip_count, errors=error_count)
+
+    # 終了の通知・実行レポートを出してから、呼び出し側（backend）に失敗を知らせる
+    if success_count == 0:
+        print(f"❌ 成功件数が0件のため、ファイルの移動を行いません。スキップ理由を確認してください。")
+        sys.exit(1)
 
-        print_progress_bar(i + 1, len(text_files), prefix='Progress:', suffix=f'Done ({base_name})', length=30)
 
-        elapsed = time.time() - start_time
-        print(f"\n✨ 完了！ 成功:{success_count}件 スキップ:{skip_count}件 エラー:{error_count}件 | 所要時間: {elapsed:.1f}秒")
-        
-        if success_count == 0:
-            print(f"❌ 成功件数が0件のため、ファイルの移動を行いません。スキップ理由を確認してください。")
-            sys.exit(1)
-            
-            
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Step実行用の常駐ワーカー
+backend.py が1つだけ起動して使い回すPythonプロセス。Stepごとに新しいインタプリタを
+起動する代わりに、このプロセス内で各スクリプトの main() を呼ぶ。
+google.genai / anthropic / fitz / PIL のimport、LLMクライアントの接続プール、
+masters・coord_dbのJSON（json_cache.py）が2回目以降の実行でそのまま使われる。
+
+プロトコル（1行1JSON）:
+    stdin  ← {"script": "/abs/path/step1_mark_and_text_v2.py", "args": [...], "cwd": "..."}
+    stdout → スクリプトの出力行をそのまま流し、最後に DONE_PREFIX + {"returncode": n, "stderr": "..."}
+
+キャンセルはプロセスごと終了させる（WorkerClient が次のジョブで起動し直す）。
+スクリプトが更新されたら再読み込みし、config.json が更新されたらワーカーを起動し直す。
+"""
+import os
+import sys
+import io
+import json
+import threading
+import traceback
+import subprocess
+import contextlib
+import importlib.util
+
+DONE_PREFIX = "\x1e@@step_worker_done "
+_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+# ── ワーカー側 ──
+
+_modules = {}  # script path -> (mtime_ns, module)
+
+
+def _load_script(path):
+    """スクリプトをモジュールとして読み込む（更新されていなければ前回のものを使う）"""
+    mtime = os.stat(path).st_mtime_ns
+    entry = _modules.get(path)
+    if entry and entry[0] == mtime:
+        return entry[1]
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module  # restamp.py などからの import step2_and3_combined と同じモジュールにする
+    spec.loader.exec_module(module)
+    _modules[path] = (mtime, module)
+    return module
+
+
+def _run_job(job):
+    """1ジョブを実行して (returncode, stderrの末尾) を返す"""
+    stderr = io.StringIO()
+    argv = sys.argv
+    cwd = os.getcwd()
+    code = 0
+    try:
+        with contextlib.redirect_stderr(stderr):
+            if job.get("cwd"):
+                os.chdir(job["cwd"])
+            sys.argv = [job["script"]] + list(job.get("args") or [])
+            try:
+                _load_script(job["script"]).main()
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                if e.code is not None and not isinstance(e.code, int):
+                    print(e.code, file=sys.stderr)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+        sys.stdout.flush()
+    return code, stderr.getvalue()[-2000:]
+
+
+def serve():
+    sys.stdout.reconfigure(encoding="utf-8", line_buffering=True)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            code, err = 2, f"invalid job: {e}"
+        else:
+            code, err = _run_job(job)
+        print(DONE_PREFIX + json.dumps({"returncode": code, "stderr": err}, ensure_ascii=False), flush=True)
+
+
+# ── backend側 ──
+
+def _config_mtime():
+    try:
+        return os.stat(_CONFIG_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+class WorkerClient:
+    """常駐ワーカーの起動・ジョブ送信・終了を管理する。ジョブは1つずつ順番に実行する"""
+    def __init__(self, python=None):
+        self.python = python or sys.executable
+        self.proc = None
+        self._config_mtime = None
+        self._lock = threading.Lock()
+
+    def _alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        """起動していなければ起動する（config.jsonが変わっていたら起動し直す）"""
+        if self._alive() and self._config_mtime == _config_mtime():
+            return self.proc
+        self.kill()
+        self._config_mtime = _config_mtime()
+        self.proc = subprocess.Popen(
+            [self.python, "-u", os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+        )
+        return self.proc
+
+    def run(self, script_path, args=None, on_line=None):
+        """
+        スクリプトを実行し、出力を1行ずつ on_line に渡す。
+        (returncode, stderr) を返す。途中でkill()された場合は returncode が None。
+        """
+        with self._lock:
+            proc = self.start()
+            job = {"script": os.path.abspath(script_path), "args": list(args or []), "cwd": os.getcwd()}
+            proc.stdin.write(json.dumps(job, ensure_ascii=False) + "\n")
+            proc.stdin.flush()
+            for line in iter(proc.stdout.readline, ""):
+                if line.startswith(DONE_PREFIX):
+                    result = json.loads(line[len(DONE_PREFIX):])
+                    return result["returncode"], result.get("stderr", "")
+                if on_line:
+                    on_line(line)
+            return None, ""  # ワーカーが終了した（キャンセル・クラッシュ）
+
+    def kill(self):
+        proc, self.proc = self.proc, None
+        if proc is None or proc.poll() is not None:
+            return
+        try:
+            proc.terminate()
+            proc.wait(timeout=5)
+        except Exception:
+            proc.kill()
+
+    # cancel_step1 / cancel_step23 が subprocess.Popen と同じように扱えるようにする
+    terminate = kill
+
+
+if __name__ == "__main__":
+    serve()
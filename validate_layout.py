@@ -0,0 +1,297 @@
+"""
+座標データ（coord_db）のレイアウト検証とプレビュー
+枠が小さすぎる・ページ番号が違う・欄どうしが重なっている、といった座標の問題は、
+今までは採点済みPDFを PDF-XChange で開くまで分からなかった。これを印字の前にまとめて確かめる。
+
+マスターごとに:
+    ・ページ番号が参照PDFのページ数を超えていないか、枠がページの外に出ていないか、幅・高さが0以下でないか
+    ・別の欄と大きく重なっていないか、マスターの設問に座標がない欄がないか
+    ・採点結果ストアに保存済みの採点結果から、欄ごとに一番長いテキスト（添削・コメント）を選び、
+      write_to_pdf と同じ内容・同じ文字サイズで入れたときに枠からはみ出さないか（実際には書き込まない）
+    ・参照PDF（なければ sheet_generator のテンプレート）に枠を色分けして描いたプレビュー画像を書き出す
+      緑=問題なし / 橙=注意 / 赤=エラー。はみ出す欄は必要な高さを点線で描く
+
+マスターごとに別プロセスで並列に処理する。
+
+使い方:
+    python validate_layout.py                       # 全マスター
+    python validate_layout.py --master 2025_1_1 --out ./layout_previews
+    python validate_layout.py --no-preview --json layout_report.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+import json_cache
+import results_store
+import sheet_generator
+
+COORD_DB_DIR = "./coord_db"
+PREVIEW_DIR = "./layout_previews"
+PREVIEW_DPI = 100
+FONT_SIZE = 10          # write_to_pdf と同じ
+LINE_HEIGHT = 1.2       # 行の高さ（文字サイズに対する倍率）
+PADDING = 2.0           # 注釈の枠線と内側の余白（片側、pt）
+OVERLAP_RATIO = 0.2     # 小さい方の枠のこの割合以上が重なっていたら注意
+BOUNDS_TOLERANCE = 1.0
+COLORS = {"ok": (0.1, 0.6, 0.2), "warning": (0.95, 0.55, 0.0), "error": (0.85, 0.0, 0.0)}
+LEVEL_ICONS = {"error": "❌", "warning": "⚠️", "info": "ℹ️"}
+
+# 全角文字は1文字、英数字は単語単位で折り返す（PDF-XChange の FreeText 注釈と同じ考え方）
+_TOKEN = re.compile(r"[\u2e80-\uffff]|[^\s\u2e80-\uffff]+\s*|\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def _char_width(ch, size):
+    if ord(ch) >= 0x2E80:
+        return float(size)  # 全角は正方形とみなす
+    return fitz.get_text_length(ch, fontname="helv", fontsize=size)
+
+
+def wrap_lines(text, width, size=FONT_SIZE):
+    """width（pt）で折り返したときの行数"""
+    lines = 0
+    for para in str(text).split("\n"):
+        lines += 1
+        x = 0.0
+        for token in _TOKEN.findall(para):
+            w = sum(_char_width(c, size) for c in token)
+            if x + w > width and x > 0:
+                lines += 1
+                x = 0.0
+                token = token.lstrip()
+                w = sum(_char_width(c, size) for c in token)
+            if w <= width:
+                x += w
+                continue
+            for c in token:  # 枠より長い単語は文字の途中で折り返す
+                cw = _char_width(c, size)
+                if x + cw > width and x > 0:
+                    lines += 1
+                    x = 0.0
+                x += cw
+    return lines
+
+
+def text_fit(text, rect, size=FONT_SIZE):
+    """(必要な高さ, 使える高さ)（pt）"""
+    _, x0, y0, x1, y1 = rect
+    width = max(1.0, x1 - x0 - 2 * PADDING)
+    return wrap_lines(text, width, size) * size * LINE_HEIGHT, (y1 - y0) - 2 * PADDING
+
+
+def _area(r):
+    return max(0, r[2] - r[0]) * max(0, r[3] - r[1])
+
+
+def _overlap(a, b):
+    return _area((max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])))
+
+
+def collect_samples(coords, master, rows):
+    """
+    欄の名前 -> 印字するテキストのうち一番長いもの。
+    保存済みの採点結果（rows）がなくても、得点欄・採点者名欄はマスターの満点から作る
+    """
+    import step2_and3_combined as step23
+    full_marks = {k: {"score": q.get("max", 0), "max": q.get("max", 0)}
+                  for k, q in (master or {}).get("sub_questions", {}).items()}
+    samples = {}
+    for data in [{"questions": full_marks}] + [r["data"] for r in rows]:
+        try:
+            fields = step23.stamp_fields(data, coords)
+        except (TypeError, ValueError, AttributeError):
+            continue  # 形の崩れた古い採点結果は飛ばす
+        for name, _, text, _ in fields:
+            if len(str(text)) > len(samples.get(name, "")):
+                samples[name] = str(text)
+    return samples
+
+
+def check_layout(coords, master, page_sizes, samples, has_reference):
+    """問題の一覧 [{"level", "field", "kind", "message"}, ...] を返す"""
+    issues = []
+
+    def add(level, field, kind, message):
+        issues.append({"level": level, "field": field, "kind": kind, "message": message})
+
+    rects = list(sheet_generator.iter_rects(coords))
+    for name, rect in rects:
+        page, x0, y0, x1, y1 = rect
+        if x1 <= x0 or y1 <= y0:
+            add("error", name, "size", f"幅か高さが0以下です {rect}")
+            continue
+        if has_reference:
+            if page >= len(page_sizes):
+                add("error", name, "page", f"{page + 1}ページ目を指していますが、参照PDFは{len(page_sizes)}ページです")
+                continue
+            w, h = page_sizes[page]
+            if x0 < -BOUNDS_TOLERANCE or y0 < -BOUNDS_TOLERANCE or x1 > w + BOUNDS_TOLERANCE or y1 > h + BOUNDS_TOLERANCE:
+                add("error", name, "bounds", f"ページ（{w:.0f}×{h:.0f}pt）の外にはみ出しています {rect}")
+        if y1 - y0 < FONT_SIZE * LINE_HEIGHT + 2 * PADDING:
+            add("warning", name, "size", f"高さ {y1 - y0:.0f}pt では{FONT_SIZE}ptの文字が1行も入りません")
+        if name in samples:
+            need, avail = text_fit(samples[name], rect)
+            if need > avail:
+                add("warning", name, "overflow",
+                    f"最長のテキスト（{len(samples[name])}文字）が入りきりません（必要 {need:.0f}pt / 枠 {avail:.0f}pt）")
+
+    for i, (name_a, a) in enumerate(rects):
+        for name_b, b in rects[i + 1:]:
+            if a[0] != b[0]:
+                continue
+            inter = _overlap(a[1:], b[1:])
+            smaller = min(_area(a[1:]), _area(b[1:]))
+            if smaller and inter / smaller >= OVERLAP_RATIO:
+                add("warning", name_a, "overlap", f"{name_b} と {100 * inter / smaller:.0f}% 重なっています")
+
+    q_coords = coords.get("questions", {})
+    for key, q in (master or {}).get("sub_questions", {}).items():
+        fields = q_coords.get(key, {})
+        if "score" not in fields:
+            add("warning", f"{key}:score", "missing", "マスターにある設問ですが、得点欄の座標がありません")
+        if q.get("type") == "記述式" and not fields.get("text"):
+            add("warning", f"{key}:text", "missing", "記述式の設問ですが、添削欄の座標がありません")
+    if not has_reference:
+        add("info", "", "reference", "参照PDFがないため、ページ数・ページ外の確認はしていません（テンプレートでプレビュー）")
+    return issues
+
+
+def _open_reference(master_id, master, coords, coord_db_dir):
+    """(参照PDF, 参照PDFかどうか)。なければ sheet_generator のテンプレート"""
+    ref = coords.get("reference_pdf")
+    path = os.path.join(coord_db_dir, ref) if ref else None
+    if path and os.path.exists(path):
+        return fitz.open(path), True
+    data, _ = sheet_generator.build_template(master_id, master, coords)
+    return fitz.open(stream=data, filetype="pdf"), False
+
+
+def render_previews(doc, coords, issues, samples, out_dir, master_id):
+    """枠を色分けして描いたページ画像を書き出し、パスのリストを返す"""
+    worst = {}
+    rank = {"ok": 0, "warning": 1, "error": 2}
+    for issue in issues:
+        if issue["level"] in rank and rank[issue["level"]] > rank[worst.get(issue["field"], "ok")]:
+            worst[issue["field"]] = issue["level"]
+    pages = set()
+    for name, (p, x0, y0, x1, y1) in sheet_generator.iter_rects(coords):
+        if p >= len(doc) or x1 <= x0 or y1 <= y0:
+            continue
+        page = doc[p]
+        dx, dy = page.cropbox.x0, page.cropbox.y0
+        color = COLORS[worst.get(name, "ok")]
+        page.draw_rect(fitz.Rect(x0 + dx, y0 + dy, x1 + dx, y1 + dy), color=color, width=1.2)
+        page.insert_text((x0 + dx + 1, y0 + dy - 2), name, fontsize=6, color=color)
+        if name in samples:
+            need, avail = text_fit(samples[name], [p, x0, y0, x1, y1])
+            if need > avail:
+                bottom = y0 + need + 2 * PADDING
+                page.draw_rect(fitz.Rect(x0 + dx, y0 + dy, x1 + dx, bottom + dy), color=color, width=0.6, dashes="[3] 0")
+        pages.add(p)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for p in sorted(pages):
+        path = os.path.join(out_dir, f"{master_id}_p{p + 1}.png")
+        doc[p].get_pixmap(dpi=PREVIEW_DPI).save(path)
+        paths.append(path)
+    return paths
+
+
+def validate_master(args):
+    """1マスター分の検証（別プロセスで実行する）"""
+    master_id, coords, master, samples, results, coord_db_dir, out_dir = args
+    t0 = time.perf_counter()
+    doc, has_reference = _open_reference(master_id, master, coords, coord_db_dir)
+    try:
+        page_sizes = [(pg.rect.width, pg.rect.height) for pg in doc]
+        issues = check_layout(coords, master, page_sizes, samples, has_reference)
+        previews = render_previews(doc, coords, issues, samples, out_dir, master_id) if out_dir else []
+    finally:
+        doc.close()
+    return {"master_id": master_id, "fields": sum(1 for _ in sheet_generator.iter_rects(coords)),
+            "reference": has_reference, "results": results, "issues": issues,
+            "previews": previews, "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def _load_masters():
+    masters = {}
+    if os.path.isdir(sheet_generator.MASTER_DB_DIR):
+        for _, data in json_cache.load_dir(sheet_generator.MASTER_DB_DIR):
+            mid = data.get("meta", {}).get("id")
+            if mid:
+                masters[mid] = data
+    return masters
+
+
+def validate_all(master_ids=None, coord_db_dir=COORD_DB_DIR, out_dir=PREVIEW_DIR, workers=None, db_path=None):
+    """coord_db の全マスター（または master_ids）を並列に検証し、マスターごとの結果のリストを返す"""
+    masters = _load_masters()
+    jobs = []
+    store = results_store.ResultsStore(db_path) if (db_path or os.path.exists(results_store.default_db_path())) else None
+    try:
+        for path, coords in json_cache.load_dir(coord_db_dir):
+            mid = coords.get("master_id") or os.path.splitext(os.path.basename(path))[0]
+            if master_ids and mid not in master_ids:
+                continue
+            rows = store.by_master(mid) if store else []
+            samples = collect_samples(coords, masters.get(mid), rows)
+            jobs.append((mid, coords, masters.get(mid), samples, len(rows), coord_db_dir, out_dir))
+    finally:
+        if store:
+            store.close()
+    if len(jobs) <= 1 or workers == 1:
+        return [validate_master(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(validate_master, jobs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="coord_db の座標を検証し、枠を描いたプレビューを書き出す")
+    parser.add_argument("--master", nargs="*", default=None, help="対象のマスターID（省略時は全部）")
+    parser.add_argument("--coord-db", default=COORD_DB_DIR)
+    parser.add_argument("--out", default=PREVIEW_DIR, help="プレビュー画像の保存先")
+    parser.add_argument("--no-preview", action="store_true")
+    parser.add_argument("--db", default=None, help="採点結果ストア（省略時は config.json の results_db）")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--json", default=None, help="結果をJSONで保存するパス")
+    parser.add_argument("--strict", action="store_true", help="注意（warning）があっても終了コード1にする")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    reports = validate_all(args.master, args.coord_db, None if args.no_preview else args.out, args.workers, args.db)
+    if not reports:
+        print("⚠️ 検証するマスターがありません（coord_db を確認してください）")
+        sys.exit(1)
+
+    errors = warnings = 0
+    for r in reports:
+        levels = [i["level"] for i in r["issues"]]
+        errors += levels.count("error")
+        warnings += levels.count("warning")
+        source = "参照PDF" if r["reference"] else "テンプレート"
+        head = "✅" if not {"error", "warning"} & set(levels) else ("❌" if "error" in levels else "⚠️")
+        print(f"{head} {r['master_id']}: {r['fields']}欄（{source}、保存済みの採点結果 {r['results']}件のテキストで確認）")
+        for i in r["issues"]:
+            field = f"{i['field']}: " if i["field"] else ""
+            print(f"   {LEVEL_ICONS[i['level']]} {field}{i['message']}")
+        for path in r["previews"]:
+            print(f"   🖼️ {path}")
+    print(f"📊 {len(reports)}マスター / エラー {errors}件 / 注意 {warnings}件 / {time.perf_counter() - t0:.1f}秒")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    if errors or (args.strict and warnings):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main()
@@ -0,0 +1,159 @@
+"""
+監視フォルダモード（ストリーミング処理）
+inputs/ を監視し、新しく置かれたPDFを1件ずつ Step1 → Step2/3 に流す。
+まとめて取り込んで全件のStep1を待つ必要がなく、最初の採点済みPDFがすぐに出てくる。
+
+- watchdog がインストールされていればOSのファイル通知（inotify など）を使い、
+  なければ一定間隔でフォルダを走査する
+- コピー途中のファイルを拾わないよう、サイズが一定時間変わらなくなってから処理する
+- Step1の結果が怪しい答案（マスターID不明・読み取りエラーなど）は自動採点せず、確認待ちにする
+
+    pip install watchdog   # 任意
+"""
+import os
+import glob
+import time
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher._notice(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher._notice(event.dest_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher._notice(event.src_path)
+
+
+class FolderWatcher:
+    """
+    folder に現れたPDFを on_new(path) に1回ずつ渡す。
+    start() 時点で既にあるファイルは known として渡さない（ignore_existing=False なら渡す）。
+    """
+    def __init__(self, folder, on_new, poll_interval=2.0, settle_seconds=2.0, ignore_existing=True):
+        self.folder = os.path.abspath(folder)
+        self.on_new = on_new
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.ignore_existing = ignore_existing
+        self._seen = set()
+        self._pending = {}  # path -> (size, サイズが最後に変わった時刻)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+
+    @property
+    def backend(self):
+        return "watchdog" if self._observer else "polling"
+
+    def start(self):
+        os.makedirs(self.folder, exist_ok=True)
+        existing = set(self._scan())
+        if self.ignore_existing:
+            self._seen |= existing
+        else:
+            for path in existing:
+                self._notice(path)
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_Handler(self), self.folder, recursive=False)
+                self._observer.start()
+            except Exception:
+                self._observer = None  # 通知が使えない環境（ネットワークドライブなど）は走査にする
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def forget(self, path):
+        """同じ名前のファイルが再び置かれたときにもう一度処理できるようにする"""
+        with self._lock:
+            self._seen.discard(os.path.abspath(path))
+
+    def _scan(self):
+        return [os.path.abspath(p) for p in glob.glob(os.path.join(self.folder, "*.pdf"))]
+
+    def _notice(self, path):
+        path = os.path.abspath(path)
+        if not path.lower().endswith(".pdf"):
+            return
+        with self._lock:
+            if path not in self._seen:
+                self._pending.setdefault(path, (-1, time.time()))
+
+    def _loop(self):
+        while not self._stop.wait(min(self.poll_interval, self.settle_seconds / 2 or 0.5)):
+            if self._observer is None:
+                for path in self._scan():
+                    self._notice(path)
+            self._check_pending()
+
+    def _check_pending(self):
+        ready = []
+        now = time.time()
+        with self._lock:
+            for path, (size, since) in list(self._pending.items()):
+                try:
+                    cur = os.path.getsize(path)
+                except OSError:
+                    del self._pending[path]  # 置かれてすぐ消えた・移動された
+                    continue
+                if cur != size:
+                    self._pending[path] = (cur, now)
+                elif now - since >= self.settle_seconds:
+                    del self._pending[path]
+                    self._seen.add(path)
+                    ready.append(path)
+        for path in sorted(ready):
+            try:
+                self.on_new(path)
+            except Exception:
+                pass
+
+
+def review_reasons(text, master_ids):
+    """Step1のテキストを自動採点に回さず確認すべき理由のリスト（空なら自動採点してよい）"""
+    reasons = []
+    if not text or not text.strip():
+        return ["テキストが空です"]
+    if "ERROR:" in text:
+        reasons.append("読み取りエラーがあります")
+    lines = text.strip().split("\n")
+    first = lines[0].strip()
+    if first == "UNKNOWN":
+        reasons.append("マスターIDを判定できませんでした")
+    elif first not in master_ids:
+        reasons.append(f"未登録のマスターID: {first[:30]}")
+    student = lines[1].strip() if len(lines) > 1 else ""
+    if not student or not any(c.isdigit() for c in student):
+        reasons.append("生徒番号を読み取れませんでした")
+    if len(lines) < 3:
+        reasons.append("解答が抽出されていません")
+    return reasons